@@ -0,0 +1,158 @@
+"""
+Per-worker admission control.
+
+Each budget allows `max_in_flight` requests to run at once and up to
+`max_queue` more to wait for a slot, for at most `queue_timeout`
+seconds. Anything beyond that is shed immediately, so an overloaded
+worker answers in milliseconds instead of letting clients time out:
+
+    queue full       -> 429 Too Many Requests
+    waited too long  -> 503 Service Unavailable
+
+Both carry a Retry-After header estimated from the recent service time,
+and an X-Admission-Budget header naming the budget: the view never ran,
+so a client may safely resend even a non-idempotent request.
+
+Admission only sheds load if requests can actually pile up in front of
+it: in-flight plus queued requests, summed over every budget, must stay
+below the worker's gthread count, or overload just queues inside
+gunicorn. default_limits derives budgets that fit a thread count.
+"""
+import functools
+import math
+import threading
+import time
+
+from flask import jsonify
+
+
+class AdmissionController:
+    """Bounded in-flight + bounded queue for one class of requests."""
+
+    def __init__(self, name, max_in_flight, max_queue, queue_timeout):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.service_time = 0.05  # EWMA seconds, seeded with a guess
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        """Return None when admitted, else the HTTP status to shed with."""
+        with self._cond:
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return None
+            if self.waiting >= self.max_queue:
+                self.shed_queue_full += 1
+                return 429
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed_timeout += 1
+                        # A release may have woken us just as we timed
+                        # out; hand the wakeup to the next waiter
+                        if self.in_flight < self.max_in_flight:
+                            self._cond.notify()
+                        return 503
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+
+    def release(self, elapsed):
+        with self._cond:
+            self.in_flight -= 1
+            self.service_time = 0.9 * self.service_time + 0.1 * elapsed
+            self._cond.notify()
+
+    def retry_after(self):
+        """Seconds until a slot is likely free for a newly arriving client."""
+        with self._cond:
+            backlog = self.in_flight + self.waiting
+            estimate = self.service_time * backlog / max(self.max_in_flight, 1)
+        return max(1, math.ceil(estimate))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "shed_queue_full": self.shed_queue_full,
+                "shed_timeout": self.shed_timeout,
+                "service_time_ms": round(self.service_time * 1000, 3)
+            }
+
+
+def default_limits(threads):
+    """
+    {"predict": (max_in_flight, max_queue), "batch": (...)} for a worker
+    with `threads` gthreads. One thread stays free for endpoints outside
+    admission control (/metrics, /batch_results, ...), and /predict gets
+    most of the rest so uploads cannot starve it.
+    """
+    available = max(threads - 1, 2)
+    batch_in_flight = max(1, available // 6)
+    batch_queue = 1 if available >= 5 else 0
+    predict = available - batch_in_flight - batch_queue
+    predict_queue = predict // 4
+    return {
+        "predict": (predict - predict_queue, predict_queue),
+        "batch": (batch_in_flight, batch_queue)
+    }
+
+
+def thread_budget_problem(controllers, threads):
+    """A message if the controllers can hold `threads` or more requests, else None."""
+    held = sum(c.max_in_flight + c.max_queue for c in controllers)
+    if held < threads:
+        return None
+    budgets = ", ".join(f"{c.name}={c.max_in_flight}+{c.max_queue}" for c in controllers)
+    return (f"Admission budgets ({budgets}) can hold {held} requests but workers have only "
+            f"{threads} threads; overload will queue in gunicorn instead of being shed")
+
+
+def admission_controlled(controller):
+    """
+    Decorator that runs a Flask view under `controller`, or under the
+    controller returned by calling it when it is a function of the
+    current request (for endpoints whose cost depends on the payload).
+    """
+    select = controller if callable(controller) else (lambda: controller)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            controller = select()
+            status = controller.try_acquire()
+            if status is not None:
+                response = jsonify({
+                    "error": "Server is overloaded, please retry later.",
+                    "budget": controller.name
+                })
+                response.status_code = status
+                response.headers["Retry-After"] = str(controller.retry_after())
+                response.headers["X-Admission-Budget"] = controller.name
+                return response
+
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -1,24 +1,980 @@
+import atexit
+import base64
+import concurrent.futures
+import hashlib
 import joblib
+import json
+import math
 import os
+import tempfile
+import threading
+import time
+
+from serving_config import apply_thread_limits, configure_model, load_profile
+
+# Thread limits must be in place before xgboost (OpenMP) is loaded
+serving_profile = load_profile()
+apply_thread_limits(serving_profile)
+
 import numpy as np
 import pandas as pd
-from flask import Flask, request, jsonify
+import xgboost as xgb
+from flask import Flask, Response, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from admission import AdmissionController, admission_controlled, default_limits, thread_budget_problem
+from batching import BatchSizeTuner, RequestCoalescer
+from cascade import fit_from_frame, notebook_split
+from counterfactual import CONTROLLABLE_FEATURES, CounterfactualSearch, split_thresholds
+from distill import CompiledTree
+from drift import BaselineStats, FeatureDriftMonitor
+from features import FEATURE_COLUMNS
+from ingest import (
+    ERROR_CODES,
+    MissingColumnsError,
+    RowLimitError,
+    StreamingCsvReader,
+    describe_errors,
+    echo_values,
+    read_batch_csv,
+    validate_features,
+)
+from leaf_index import LeafRegionIndex
+from neighbors import MAX_K, build_index
+from prediction_cache import QuantizedPredictionCache
+from prediction_log import PredictionLogWriter, file_version
+from raster import META_FILE, PROGRESS_FILE, TileCache, read_tile
+from result_store import BatchResultStore
+from uploads import (
+    ArchiveError,
+    ArchiveLimitError,
+    SpooledRequest,
+    StreamingUpload,
+    UploadBudget,
+    UploadBudgetError,
+    csv_sources,
+)
 
 # --------------------------------------------------
 # 1. Initialize Flask app
 # --------------------------------------------------
 app = Flask("Crop Recommendation API")
 
+# Uploads: request bodies over MAX_UPLOAD_BYTES get a 413, and files
+# parsed by Flask move to a temporary file past UPLOAD_SPOOL_BYTES
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_BYTES", str(2 << 30)))
+SpooledRequest.spool_bytes = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1 << 20)))
+app.request_class = SpooledRequest
+
+
+@app.before_request
+def reject_oversized_upload():
+    """413 from the Content-Length header, before any body is read."""
+    if request.content_length is not None and request.content_length > app.config["MAX_CONTENT_LENGTH"]:
+        return upload_too_large()
+
+
+def upload_too_large():
+    return jsonify({
+        "error": "Upload too large.",
+        "max_bytes": app.config["MAX_CONTENT_LENGTH"]
+    }), 413
+
 # --------------------------------------------------
 # 2. Load trained model + label encoder
 # --------------------------------------------------
-artifacts = joblib.load("crop_recommendation_model.joblib")
+MODEL_PATH = "crop_recommendation_model.joblib"
+artifacts = joblib.load(MODEL_PATH)
 
 model = artifacts["model"]            # XGBoost pipeline (preprocessor + model)
 label_encoder = artifacts["label_encoder"]
 
-# Features expected by the model
-FEATURE_COLUMNS = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+configure_model(model, serving_profile)
+
+preprocessor = model.named_steps["preprocessor"]
+booster = model.named_steps["classifier"].get_booster()
+
+# Upper bound on the number of grid points a /what_if sweep may expand to
+WHAT_IF_MAX_POINTS = int(os.environ.get("WHAT_IF_MAX_POINTS", "200000"))
+
+# Rows scored per chunk in /batch_predict; the client's deadline is
+# checked between chunks. With BATCH_AUTOTUNE=1 the measured value from
+# the batch-size tuner replaces this one.
+BATCH_CHUNK_ROWS = serving_profile["batch_chunk_rows"]
+
+# Optional /batch_predict column passed through to the results
+# (override per request with ?id_column=)
+BATCH_ID_COLUMN = os.environ.get("BATCH_ID_COLUMN", "id")
+
+# Rows accepted per /batch_predict upload; larger files are rejected as
+# soon as the limit is crossed
+BATCH_MAX_ROWS = int(os.environ.get("BATCH_MAX_ROWS", "5000000"))
+
+# Monte Carlo uncertainty: default relative (1-sigma) lab error per
+# feature, and caps on samples per input / total rows scored per call
+DEFAULT_UNCERTAINTY = {"N": 0.10, "P": 0.10, "K": 0.10, "ph": 0.05}
+NON_NEGATIVE_FEATURES = ["N", "P", "K", "humidity", "ph", "rainfall"]
+MONTE_CARLO_MAX_SAMPLES = int(os.environ.get("MONTE_CARLO_MAX_SAMPLES", "10000"))
+MONTE_CARLO_MAX_ROWS = int(os.environ.get("MONTE_CARLO_MAX_ROWS", "2000000"))
+
+# Directory holding crop-suitability raster runs (see raster.py), and
+# the per-worker budget for caching raw tile arrays (a 512x512 tile is
+# about 1.3 MB)
+RASTER_OUTPUT_DIR = os.environ.get("RASTER_OUTPUT_DIR", "raster_runs")
+raster_tile_cache = TileCache(int(os.environ.get("RASTER_TILE_CACHE_MB", "64")) << 20)
+
+# Training dataset (used to fit auxiliary models at startup)
+DATASET_PATH = os.environ.get(
+    "DATASET_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model", "Crop_recommendation.csv")
+)
+
+# --------------------------------------------------
+# Optional cascade inference (CASCADE_INFERENCE=1)
+# --------------------------------------------------
+# A per-class Gaussian answers rows that sit clearly inside one crop's
+# cluster; everything else goes to the XGBoost pipeline. The threshold
+# is calibrated so that short-circuited rows agree with XGBoost at
+# CASCADE_TARGET_AGREEMENT on the notebook's held-out rows, which
+# XGBoost was not trained on.
+training_df = pd.read_csv(DATASET_PATH) if os.path.exists(DATASET_PATH) else None
+
+cascade = None
+if os.environ.get("CASCADE_INFERENCE", "0") == "1" and training_df is not None:
+    cascade_train_df, cascade_calibration_df = notebook_split(training_df, label_encoder)
+    cascade = fit_from_frame(
+        cascade_train_df,
+        label_encoder,
+        model,
+        float(os.environ.get("CASCADE_TARGET_AGREEMENT", "1.0")),
+        cascade_calibration_df
+    )
+
+
+# --------------------------------------------------
+# Leaf-region index (exact memoized XGBoost predictions)
+# --------------------------------------------------
+# Rows are binned against the ensemble's split thresholds; rows in the
+# same cell get the same prediction, so each cell is scored once. Warmed
+# with the training rows so common inputs never reach the booster.
+leaf_index = None
+if os.environ.get("LEAF_INDEX", "0") == "1":
+    leaf_index = LeafRegionIndex.from_pipeline(
+        model,
+        FEATURE_COLUMNS,
+        int(os.environ.get("LEAF_INDEX_MAX_CELLS", "200000"))
+    )
+    if training_df is not None:
+        leaf_index.warm(training_df[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+
+
+# --------------------------------------------------
+# Inference mode: full XGBoost pipeline or distilled tree
+# --------------------------------------------------
+# distilled_model.npz is produced by distill.py. INFERENCE_MODE sets the
+# default for /predict and /batch_predict; ?mode= overrides per request.
+# The distilled tree is an approximation: it agrees with XGBoost on
+# about 99.6% of the training rows but only about 93% of synthetic rows
+# spread over the feature ranges (distill.py prints both).
+INFERENCE_MODES = ("xgboost", "distilled")
+DISTILLED_MODEL_PATH = os.environ.get("DISTILLED_MODEL_PATH", "distilled_model.npz")
+distilled_model = CompiledTree.load(DISTILLED_MODEL_PATH) if os.path.exists(DISTILLED_MODEL_PATH) else None
+
+# Leaf classes are label-encoder indices: a tree distilled from another
+# model would silently name the wrong crops
+if distilled_model is not None and distilled_model.classes.tolist() != [str(c) for c in label_encoder.classes_]:
+    app.logger.warning(
+        "%s was distilled for different classes than %s; distilled mode disabled (re-run distill.py)",
+        DISTILLED_MODEL_PATH, MODEL_PATH
+    )
+    distilled_model = None
+
+DEFAULT_INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "xgboost")
+if DEFAULT_INFERENCE_MODE not in INFERENCE_MODES or distilled_model is None:
+    DEFAULT_INFERENCE_MODE = "xgboost"
+
+
+# --------------------------------------------------
+# Quantized prediction cache (shared by /predict and /explain)
+# --------------------------------------------------
+prediction_cache = QuantizedPredictionCache(
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", "100000")),
+    decimals=int(os.environ.get("PREDICTION_CACHE_DECIMALS", "4"))
+)
+
+
+# --------------------------------------------------
+# "Similar fields" KD-tree index
+# --------------------------------------------------
+# Built once over the training CSV; SIMILAR_FIELDS_PRODUCTION_CSV can
+# point at stored production inputs (with a label/recommended_crop
+# column) to include them as well.
+similar_fields_index = None
+if training_df is not None:
+    similar_fields_index = build_index(
+        DATASET_PATH,
+        os.environ.get("SIMILAR_FIELDS_PRODUCTION_CSV")
+    )
+
+
+# --------------------------------------------------
+# Counterfactual search over the booster's split thresholds
+# --------------------------------------------------
+def build_counterfactual_search():
+    """Map split thresholds back to raw units and set search bounds."""
+    scaler = preprocessor.named_transformers_["num"]
+    thresholds = [
+        t * scale + mean
+        for t, scale, mean in zip(split_thresholds(booster, len(FEATURE_COLUMNS)), scaler.scale_, scaler.mean_)
+    ]
+    if training_df is not None:
+        low = training_df[FEATURE_COLUMNS].min().to_numpy(dtype=np.float64)
+        high = training_df[FEATURE_COLUMNS].max().to_numpy(dtype=np.float64)
+    else:
+        low = np.array([t.min() if len(t) else 0.0 for t in thresholds]) - scaler.scale_
+        high = np.array([t.max() if len(t) else 0.0 for t in thresholds]) + scaler.scale_
+    low = np.maximum(low, 0.0)
+    return CounterfactualSearch(model_predict_proba, FEATURE_COLUMNS, thresholds, (low, high), scaler.scale_)
+
+
+# --------------------------------------------------
+# Feature-drift monitor (baseline = training CSV)
+# --------------------------------------------------
+drift_monitor = None
+if training_df is not None:
+    drift_monitor = FeatureDriftMonitor(
+        BaselineStats(training_df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)),
+        min_samples=int(os.environ.get("DRIFT_MIN_SAMPLES", "100"))
+    )
+
+
+def observe_inputs(features):
+    """Feed production inputs to the drift monitor."""
+    if drift_monitor is not None:
+        drift_monitor.update(features)
+
+
+# --------------------------------------------------
+# Binary prediction log (PREDICTION_LOG_DIR)
+# --------------------------------------------------
+prediction_log = None
+if os.environ.get("PREDICTION_LOG_DIR"):
+    prediction_log = PredictionLogWriter(
+        os.environ["PREDICTION_LOG_DIR"],
+        model_version=file_version(MODEL_PATH),
+        segment_bytes=int(os.environ.get("PREDICTION_LOG_SEGMENT_MB", "64")) << 20,
+        flush_interval=float(os.environ.get("PREDICTION_LOG_FLUSH_SECONDS", "0.5"))
+    )
+    atexit.register(prediction_log.close)
+
+
+def log_predictions(features, encoded_preds, started):
+    """Queue rows for the prediction log (no-op when disabled)."""
+    if prediction_log is not None:
+        prediction_log.append(features, encoded_preds, time.perf_counter() - started)
+
+
+# --------------------------------------------------
+# Stored batch results (/batch_predict?store=1, /batch_results)
+# --------------------------------------------------
+# One directory per result on local disk, so every worker on the host
+# can serve pages of a result scored by another.
+result_store = BatchResultStore(
+    os.environ.get("RESULT_STORE_DIR", os.path.join(tempfile.gettempdir(), "crop_batch_results")),
+    ttl=float(os.environ.get("RESULT_STORE_TTL_SECONDS", str(24 * 3600)))
+)
+RESULT_PAGE_MAX_ROWS = int(os.environ.get("RESULT_PAGE_MAX_ROWS", "5000"))
+
+
+# --------------------------------------------------
+# Multi-file / ZIP uploads (/batch_predict_files)
+# --------------------------------------------------
+# CSVs of one request are scored concurrently on this pool. Member
+# decompression, CSV parsing and XGBoost all release the GIL for most
+# of their work, but every pool thread runs XGBoost with the profile's
+# nthread, so by default the pool only gets as many threads as fit in
+# the worker's threads_per_worker; with the stock profile (nthread =
+# threads_per_worker) that is one file at a time. Besides the per-file limits, a request may hold at most
+# ARCHIVE_MAX_TOTAL_BYTES uncompressed and ARCHIVE_MAX_TOTAL_ROWS rows
+# over all its files (by default, as much as one /batch_predict upload).
+# Archives with a member compressed more than ARCHIVE_STORE_RATIO times
+# are answered as with ?store=1 rather than with one huge JSON body.
+xgb_nthread = model.named_steps["classifier"].get_params()["n_jobs"] or 1
+ARCHIVE_WORKERS = int(os.environ.get(
+    "ARCHIVE_WORKERS", max(1, serving_profile["threads_per_worker"] // xgb_nthread)
+))
+ARCHIVE_MAX_FILES = int(os.environ.get("ARCHIVE_MAX_FILES", "1000"))
+ARCHIVE_MAX_MEMBER_BYTES = int(os.environ.get("ARCHIVE_MAX_MEMBER_BYTES", str(app.config["MAX_CONTENT_LENGTH"])))
+ARCHIVE_MAX_TOTAL_BYTES = int(os.environ.get("ARCHIVE_MAX_TOTAL_BYTES", str(app.config["MAX_CONTENT_LENGTH"])))
+ARCHIVE_MAX_TOTAL_ROWS = int(os.environ.get("ARCHIVE_MAX_TOTAL_ROWS", str(BATCH_MAX_ROWS)))
+ARCHIVE_STORE_RATIO = float(os.environ.get("ARCHIVE_STORE_RATIO", "20"))
+archive_pool = concurrent.futures.ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix="archive")
+
+
+# --------------------------------------------------
+# Admission control (per worker)
+# --------------------------------------------------
+# /predict is cheap; endpoints that can score many rows per request
+# share a separate, much smaller budget so a few large uploads cannot
+# starve single predictions. Defaults are derived from the gthread count
+# (GUNICORN_THREADS, as in gunicorn.conf.py) so the budgets fill up, and
+# shed, before gunicorn runs out of threads.
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", "8"))
+admission_limits = default_limits(GUNICORN_THREADS)
+predict_admission = AdmissionController(
+    "predict",
+    max_in_flight=int(os.environ.get("ADMISSION_PREDICT_MAX_IN_FLIGHT", admission_limits["predict"][0])),
+    max_queue=int(os.environ.get("ADMISSION_PREDICT_MAX_QUEUE", admission_limits["predict"][1])),
+    queue_timeout=float(os.environ.get("ADMISSION_PREDICT_QUEUE_TIMEOUT", "2.0"))
+)
+batch_admission = AdmissionController(
+    "batch",
+    max_in_flight=int(os.environ.get("ADMISSION_BATCH_MAX_IN_FLIGHT", admission_limits["batch"][0])),
+    max_queue=int(os.environ.get("ADMISSION_BATCH_MAX_QUEUE", admission_limits["batch"][1])),
+    queue_timeout=float(os.environ.get("ADMISSION_BATCH_QUEUE_TIMEOUT", "5.0"))
+)
+admission_problem = thread_budget_problem((predict_admission, batch_admission), GUNICORN_THREADS)
+if admission_problem:
+    app.logger.warning(admission_problem)
+
+# A one-row JSON body costs about as much as a /predict call, so
+# /explain and /predict_proba charge it to the predict budget; the
+# frontend's per-click calls are then not shed behind uploads. Bodies
+# above this size are not parsed to find out and count as batch.
+SINGLE_ROW_MAX_BYTES = 4096
+
+
+def single_row_request():
+    """True for a small JSON body holding one feature row."""
+    if not request.is_json or not request.content_length or request.content_length > SINGLE_ROW_MAX_BYTES:
+        return False
+    data = request.get_json(silent=True)
+    return isinstance(data, dict) and "rows" not in data
+
+
+def row_admission():
+    """predict_admission for single-row JSON requests, else batch_admission."""
+    return predict_admission if single_row_request() else batch_admission
+
+
+# --------------------------------------------------
+# Adaptive batch sizes (BATCH_AUTOTUNE=1, PREDICT_COALESCING=1)
+# --------------------------------------------------
+# The tuner is probed once the model helpers exist (end of the helper
+# section) and then keeps learning from live model calls.
+batch_tuner = None
+if os.environ.get("BATCH_AUTOTUNE", "0") == "1":
+    batch_tuner = BatchSizeTuner(
+        chunk_budget=float(os.environ.get("BATCH_CHUNK_BUDGET_MS", "250")) / 1000,
+        coalesce_budget=float(os.environ.get("PREDICT_COALESCE_BUDGET_MS", "10")) / 1000,
+        retune_interval=float(os.environ.get("BATCH_RETUNE_SECONDS", "300"))
+    )
+predict_coalescer = None
+
+
+# --------------------------------------------------
+# In-process metrics (exposed on /metrics)
+# --------------------------------------------------
+metrics_lock = threading.Lock()
+METRICS = {
+    "batch_requests": 0,
+    "batch_rows": 0,
+    "batch_unique_rows": 0,
+    "cascade_rows": 0,
+    "cascade_short_circuited": 0,
+    "cache_hits": 0,
+    "cache_misses": 0,
+    "batch_deadline_exceeded": 0,
+    "batch_partial_responses": 0,
+    "batch_rows_abandoned": 0,
+    "batch_rows_invalid": 0,
+}
+
+
+def record_metrics(**increments):
+    """Add the given increments to the shared counters."""
+    with metrics_lock:
+        for key, value in increments.items():
+            METRICS[key] = METRICS.get(key, 0) + value
+
+
+def request_deadline():
+    """
+    Deadline for the current request as a time.monotonic() value, or
+    None. Clients send either X-Request-Deadline (absolute unix time in
+    seconds) or X-Request-Timeout (seconds from now); the earlier wins.
+    ValueError naming the header if a value is not a finite,
+    non-negative number.
+    """
+    remaining = []
+    if request.headers.get("X-Request-Deadline"):
+        remaining.append(deadline_header("X-Request-Deadline") - time.time())
+    if request.headers.get("X-Request-Timeout"):
+        remaining.append(deadline_header("X-Request-Timeout"))
+    return time.monotonic() + min(remaining) if remaining else None
+
+
+def deadline_header(name):
+    try:
+        value = float(request.headers[name])
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"{name} must be a finite, non-negative number of seconds")
+    return value
+
+
+def deadline_passed(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def make_continuation_token(offset, digest):
+    """
+    Opaque token naming the next row to score and the digest of the rows
+    before it (see update_rows_digest).
+    """
+    payload = json.dumps({"offset": offset, "digest": digest}).encode()
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def read_continuation_token(token):
+    """(offset, rows digest) from a token; ValueError if malformed."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return int(payload["offset"]), payload["digest"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Malformed continuation token")
+
+
+def parse_feature_request():
+    """
+    Read feature rows from the current request.
+
+    Accepts a CSV upload under 'file', a JSON object (one row), a JSON
+    list of objects, or a JSON object with a "rows" list.
+
+    Returns (features, single, error) where error is a ready-made
+    (response, status) tuple or None.
+    """
+    if "file" in request.files:
+        try:
+            df = read_batch_csv(request.files["file"].stream, FEATURE_COLUMNS, dtype=np.float64)
+        except MissingColumnsError as e:
+            return None, False, (jsonify({
+                "error": "Missing required fields",
+                "missing_fields": e.missing
+            }), 400)
+        single = False
+    else:
+        data = request.get_json(silent=True)
+        if data is None:
+            return None, False, (jsonify({"error": "Send a JSON body or a CSV file with key 'file'."}), 400)
+        single = isinstance(data, dict) and "rows" not in data
+        rows = [data] if single else (data["rows"] if isinstance(data, dict) else data)
+        df = pd.DataFrame(rows)
+
+    missing = [col for col in FEATURE_COLUMNS if col not in df.columns]
+    if missing:
+        return None, single, (jsonify({
+            "error": "Missing required fields",
+            "missing_fields": missing
+        }), 400)
+
+    try:
+        features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    except (TypeError, ValueError):
+        return None, single, (jsonify({"error": "All feature values must be numeric"}), 400)
+    return features, single, None
+
+
+def model_predict(features):
+    """Run the XGBoost pipeline on a (n, 7) float matrix."""
+    start = time.perf_counter()
+    preds = np.asarray(model.predict(pd.DataFrame(features, columns=FEATURE_COLUMNS)))
+    if batch_tuner is not None:
+        batch_tuner.observe(len(features), time.perf_counter() - start)
+    return preds
+
+
+def model_predict_proba(features):
+    """Class probabilities (n, n_classes) from the XGBoost pipeline."""
+    return np.asarray(model.predict_proba(pd.DataFrame(features, columns=FEATURE_COLUMNS)))
+
+
+def expand_sweep_grid(base, sweeps):
+    """
+    Expand a base input plus sweep specs into a (n_points, 7) matrix.
+
+    Each spec is {"feature", "start", "stop", "step"} (stop inclusive)
+    or {"feature", "values": [...]}. Returns (grid, axes) where axes is
+    a list of (feature, values) in sweep order; the grid is row-major
+    over those axes.
+    """
+    if not isinstance(sweeps, list):
+        raise ValueError("'sweeps' must be a list")
+
+    # Axis lengths are worked out from the spec and their product checked
+    # before any array is built, so an oversized sweep costs nothing.
+    axes = []
+    n_points = 1
+    for spec in sweeps:
+        if not isinstance(spec, dict):
+            raise ValueError("Each sweep must be an object")
+        feature = spec.get("feature")
+        if feature not in FEATURE_COLUMNS:
+            raise ValueError(f"Unknown sweep feature: {feature!r}")
+        if any(feature == name for name, _ in axes):
+            raise ValueError(f"Feature swept twice: {feature!r}")
+        if "values" in spec:
+            if not isinstance(spec["values"], list):
+                raise ValueError(f"'values' for {feature!r} must be a list")
+            count = len(spec["values"])
+        else:
+            start, stop, step = (float(spec[key]) for key in ("start", "stop", "step"))
+            if not all(math.isfinite(v) for v in (start, stop, step)):
+                raise ValueError(f"Invalid range for {feature!r}: values must be finite")
+            if step <= 0 or stop < start:
+                raise ValueError(f"Invalid range for {feature!r}: need step > 0 and stop >= start")
+            # Tolerance so e.g. 0..0.3 step 0.1 keeps its inclusive stop
+            count = math.floor((stop - start) / step + 1e-9) + 1
+        if not count:
+            raise ValueError(f"Empty sweep for {feature!r}")
+        n_points *= count
+        if n_points > WHAT_IF_MAX_POINTS:
+            raise ValueError(f"Sweep expands to more than {WHAT_IF_MAX_POINTS} points")
+        if "values" in spec:
+            values = np.asarray(spec["values"], dtype=np.float64)
+        else:
+            values = np.minimum(start + step * np.arange(count), stop)
+        axes.append((feature, values))
+
+    grid = np.tile(np.asarray([base[col] for col in FEATURE_COLUMNS], dtype=np.float64), (n_points, 1))
+    if axes:
+        mesh = np.meshgrid(*[values for _, values in axes], indexing="ij")
+        for (feature, _), coords in zip(axes, mesh):
+            grid[:, FEATURE_COLUMNS.index(feature)] = coords.reshape(-1)
+    return grid, axes
+
+
+def request_inference_mode():
+    """Mode for the current request, or None if it is not available."""
+    mode = request.args.get("mode", DEFAULT_INFERENCE_MODE)
+    if mode not in INFERENCE_MODES or (mode == "distilled" and distilled_model is None):
+        return None
+    return mode
+
+
+def exact_predict(features):
+    """XGBoost predictions, through the leaf-region index when enabled."""
+    if leaf_index is None:
+        return model_predict(features)
+    return leaf_index.predict(features)
+
+
+def predict_encoded(features, mode="xgboost"):
+    """Predict encoded labels, going through the cascade when enabled."""
+    if mode == "distilled":
+        return distilled_model.predict(features)
+    if cascade is None:
+        return exact_predict(features)
+    preds, confident = cascade.predict(features, exact_predict)
+    record_metrics(cascade_rows=len(preds), cascade_short_circuited=int(confident.sum()))
+    return preds
+
+
+def compute_contributions(features):
+    """
+    Per-feature TreeSHAP contributions from the booster for a (n, 7)
+    matrix. Returns a float32 array of shape (n, n_classes, 8) whose
+    last column is the bias term, in raw margin (log-odds) units.
+    """
+    transformed = preprocessor.transform(pd.DataFrame(features, columns=FEATURE_COLUMNS))
+    contribs = booster.predict(xgb.DMatrix(transformed), pred_contribs=True)
+    return np.asarray(contribs, dtype=np.float32).reshape(len(features), len(label_encoder.classes_), -1)
+
+
+def cached_lookup(features, field, compute):
+    """
+    Serve `field` from the prediction cache where possible and compute
+    the misses in one vectorized call.
+
+    Only the cache key is quantized: misses are scored on the rows as
+    sent. Rows that agree to PREDICTION_CACHE_DECIMALS share an entry,
+    so such a row gets the answer computed for the first of them.
+
+    Returns a list of per-row values aligned with `features`.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    keys = prediction_cache.keys(prediction_cache.quantize(features))
+    values = prediction_cache.get_many(keys, field)
+
+    misses = [i for i, value in enumerate(values) if value is None]
+    if misses:
+        computed = compute(features[misses])
+        miss_keys = [keys[i] for i in misses]
+        if field == "contribs":
+            # Contributions also determine the XGBoost class
+            classes = computed.sum(axis=2).argmax(axis=1)
+            prediction_cache.put_many(miss_keys, contribs=computed, pred_xgb=classes)
+        else:
+            prediction_cache.put_many(miss_keys, **{field: computed})
+        for i, value in zip(misses, computed):
+            values[i] = value
+
+    record_metrics(cache_hits=len(keys) - len(misses), cache_misses=len(misses))
+    return values
+
+
+def cached_predict(features):
+    """
+    Encoded predictions through the quantized cache; misses are merged
+    with other requests' when coalescing is enabled.
+    """
+    compute = predict_coalescer.predict if predict_coalescer is not None else predict_encoded
+    # Cascade answers may differ from XGBoost's, which /explain caches
+    field = "pred_cascade" if cascade is not None else "pred_xgb"
+    return np.asarray(cached_lookup(features, field, compute))
+
+
+def predict_proba_unique(features):
+    """Class probabilities for a (n, 7) matrix, scoring distinct rows once."""
+    unique_rows, inverse = np.unique(features, axis=0, return_inverse=True)
+    return model_predict_proba(unique_rows)[inverse.reshape(-1)]
+
+
+# Decimal places a JSON list keeps for each float dtype; beyond this the
+# digits only describe binary rounding error (0.1 in float16 would
+# otherwise print as 0.0999755859375)
+JSON_DECIMALS = {np.dtype(np.float16): 3, np.dtype(np.float32): 6}
+
+
+def encode_array(array, encoding):
+    """
+    Columnar array encoding for JSON responses: either nested lists or
+    base64 of the raw little-endian buffer in row-major order.
+    """
+    if encoding == "base64":
+        data = base64.b64encode(np.ascontiguousarray(array).astype(array.dtype.newbyteorder("<")).tobytes()).decode("ascii")
+    elif array.dtype in JSON_DECIMALS:
+        # Round the values the dtype actually holds, not the float64 ones
+        data = np.round(array.astype(np.float64), JSON_DECIMALS[array.dtype]).tolist()
+    else:
+        data = array.tolist()
+    return {"dtype": str(array.dtype), "shape": list(array.shape), "encoding": encoding, "data": data}
+
+
+def load_raster_tile(run, row, col, encoding, progress_mtime):
+    """
+    Encoded tile payload. The raw arrays are cached; progress_mtime is
+    part of the cache key so a run that is still being scored is re-read
+    as tiles complete.
+    """
+    key = (run, row, col, progress_mtime)
+    tile = raster_tile_cache.get(key)
+    if tile is None:
+        tile = read_tile(os.path.join(RASTER_OUTPUT_DIR, run), row, col)
+        if tile is None:
+            return None
+        raster_tile_cache.put(key, tile)
+    (r0, r1, c0, c1), classes, probability = tile
+    return {
+        "run": run,
+        "row": row,
+        "col": col,
+        "bounds": {"row_start": r0, "row_stop": r1, "col_start": c0, "col_stop": c1},
+        "class_index": encode_array(classes, encoding),
+        "max_probability": encode_array(probability, encoding)
+    }
+
+
+# Running estimate of model cost per row, used to honour latency budgets
+seconds_per_row = {"value": 3e-5}
+
+
+def timed_model_predict(features):
+    """model_predict that updates the per-row cost estimate."""
+    start = time.perf_counter()
+    preds = model_predict(features)
+    if len(features) >= 1000:
+        observed = (time.perf_counter() - start) / len(features)
+        seconds_per_row["value"] = 0.8 * seconds_per_row["value"] + 0.2 * observed
+    return preds
+
+
+def monte_carlo_frequencies(features, relative, absolute, samples, rng):
+    """
+    Score `samples` Gaussian perturbations of every row in one batch.
+    Returns an (n, n_classes) matrix of class frequencies.
+    """
+    n, n_classes = len(features), len(label_encoder.classes_)
+    sigma = np.abs(features) * relative + absolute
+    noisy = np.repeat(features, samples, axis=0)
+    noisy += rng.standard_normal(noisy.shape) * np.repeat(sigma, samples, axis=0)
+
+    # Keep perturbed readings physically meaningful; temperature can
+    # legitimately be below zero, so it is left unclamped
+    for col in NON_NEGATIVE_FEATURES:
+        index = FEATURE_COLUMNS.index(col)
+        np.maximum(noisy[:, index], 0.0, out=noisy[:, index])
+    ph = FEATURE_COLUMNS.index("ph")
+    humidity = FEATURE_COLUMNS.index("humidity")
+    np.minimum(noisy[:, ph], 14.0, out=noisy[:, ph])
+    np.minimum(noisy[:, humidity], 100.0, out=noisy[:, humidity])
+
+    preds = timed_model_predict(noisy)
+    flat = np.repeat(np.arange(n), samples) * n_classes + preds
+    counts = np.bincount(flat, minlength=n * n_classes).reshape(n, n_classes)
+    return counts / samples
+
+
+def integer_option(options, name, default=None, minimum=0):
+    """
+    An integer option from a JSON options object. Raises ValueError for
+    anything but a JSON integer >= minimum (floats and booleans included).
+    """
+    value = options.get(name, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"'{name}' must be an integer")
+    if value < minimum:
+        raise ValueError(f"'{name}' must be at least {minimum}")
+    return value
+
+
+def upload_frames(upload, reader, stop_parsing=None):
+    """
+    Frames of whole rows from a streamed upload, as they arrive. Once
+    stop_parsing() is true the rest of the upload is only read and its
+    rows counted, not parsed.
+    """
+    for data in upload:
+        if stop_parsing is not None and stop_parsing():
+            yield from reader.skip(data)
+        else:
+            yield from reader.feed(data)
+    yield from reader.close()
+
+
+def update_rows_digest(digest, features, codes, ids):
+    """
+    Add validated rows to a running SHA-256 over an upload's rows. Each
+    row is hashed as one fixed-width record, so the digest depends only
+    on the rows, not on how the upload was chunked, and a continuation
+    token can name the rows before its offset.
+    """
+    n_features = features.shape[1]
+    records = np.zeros(len(features), dtype=[
+        ("features", "<f4", (n_features,)),
+        ("codes", "u1", (n_features,)),
+        ("id", "<u8"),
+    ])
+    records["features"] = np.nan_to_num(features, nan=0.0)
+    records["codes"] = codes
+    if ids is not None:
+        records["id"] = pd.util.hash_pandas_object(pd.Series(ids, dtype=object), index=False).to_numpy()
+    digest.update(records.tobytes())
+
+
+def predict_unique(features, mode="xgboost"):
+    """
+    Predict encoded labels for a (n, 7) float matrix, scoring each
+    distinct row only once and scattering the results back.
+
+    Returns (encoded_preds, n_unique).
+    """
+    unique_rows, inverse = np.unique(features, axis=0, return_inverse=True)
+    encoded_unique = predict_encoded(unique_rows, mode)
+    return encoded_unique[inverse.reshape(-1)], len(unique_rows)
+
+
+def score_frame(frame, mode="xgboost"):
+    """
+    Validate and score one parsed frame. Returns (features, codes,
+    encoded_preds, n_unique); invalid rows are predicted as -1.
+    """
+    features, codes = validate_features(frame, FEATURE_COLUMNS)
+    valid = ~codes.any(axis=1)
+    preds = np.full(len(frame), -1, dtype=np.int64)
+    n_unique = 0
+    if valid.any():
+        preds[valid], n_unique = predict_unique(features[valid], mode)
+    return features, codes, preds, n_unique
+
+
+def join_parts(parts):
+    """Concatenate scored (features, codes, ids, preds) chunks."""
+    if not parts:
+        return (
+            np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32),
+            np.empty((0, len(FEATURE_COLUMNS)), dtype=np.uint8),
+            None,
+            np.empty(0, dtype=np.int64)
+        )
+    features, codes, ids, preds = zip(*parts)
+    return (
+        np.concatenate(features),
+        np.concatenate(codes),
+        np.concatenate(ids) if ids[0] is not None else None,
+        np.concatenate(preds)
+    )
+
+
+def count_errors(codes):
+    """{column: {error code: rows}} for a (n, 7) code matrix."""
+    error_counts = {}
+    for j, col in enumerate(FEATURE_COLUMNS):
+        found, counts = np.unique(codes[:, j][codes[:, j] > 0], return_counts=True)
+        if len(found):
+            error_counts[col] = {ERROR_CODES[int(c)]: int(n) for c, n in zip(found, counts)}
+    return error_counts
+
+
+def echo_results(features, encoded_preds, row_errors, ids=None, id_column=None):
+    """
+    Result rows for the JSON response: the inputs (id column first, if
+    sent), the crop and a status. Invalid rows carry their errors
+    instead of a prediction.
+    """
+    valid = encoded_preds >= 0
+    out = pd.DataFrame(echo_values(features), columns=FEATURE_COLUMNS)
+    if ids is not None:
+        out.insert(0, id_column, ids)
+    crops = np.full(len(out), None, dtype=object)
+    if valid.any():
+        crops[valid] = label_encoder.inverse_transform(encoded_preds[valid])
+    out["recommended_crop"] = crops
+    out["status"] = np.where(valid, "ok", "error")
+
+    result = out.to_dict(orient="records")
+    for i, errors in row_errors.items():
+        for col in FEATURE_COLUMNS:
+            if np.isnan(result[i][col]):
+                result[i][col] = None
+        result[i]["recommended_crop"] = None
+        result[i]["errors"] = errors
+    return result
+
+
+def score_source(chunks, budget, id_column, mode, deadline, store, started):
+    """
+    Score one CSV of a /batch_predict_files request (on an archive_pool
+    thread). Returns its entry for the response; problems with this
+    file are reported in the entry rather than raised, except
+    UploadBudgetError once the request as a whole is over `budget`.
+    Returns None once the deadline has passed.
+    """
+    reader = StreamingCsvReader(FEATURE_COLUMNS, id_column, batch_chunk_rows(), BATCH_MAX_ROWS)
+    parts = []
+    row_errors = {}
+    n_rows = n_unique = 0
+    try:
+        for frame in upload_frames(budget.metered(chunks()), reader):
+            if deadline_passed(deadline):
+                return None
+            budget.charge(n_rows=len(frame))
+            features, codes, preds, chunk_unique = score_frame(frame, mode)
+            n_unique += chunk_unique
+            if (preds < 0).any():
+                for i, errors in describe_errors(frame, codes, FEATURE_COLUMNS).items():
+                    row_errors[n_rows + i] = errors
+            ids = frame[id_column].fillna("").to_numpy() if id_column in frame.columns else None
+            parts.append((features, codes, ids, preds))
+            n_rows += len(frame)
+    except MissingColumnsError as e:
+        return {"status": "error", "error": "Missing required columns in CSV.", "missing_columns": e.missing}
+    except pd.errors.ParserError as e:
+        return {"status": "error", "error": f"Malformed CSV: {e}"}
+    except RowLimitError as e:
+        return {"status": "error", "error": str(e), "max_rows": e.limit}
+    except UploadBudgetError:
+        raise
+    except ArchiveError as e:
+        return {"status": "error", "error": str(e)}
+    if reader.header is None:
+        return {"status": "error", "error": "The uploaded CSV is empty."}
+
+    features, codes, ids, encoded_preds = join_parts(parts)
+    valid = encoded_preds >= 0
+    n_valid = int(valid.sum())
+    if n_valid:
+        log_predictions(features[valid], encoded_preds[valid], started)
+        observe_inputs(features[valid])
+    record_metrics(batch_rows=n_valid, batch_unique_rows=n_unique, batch_rows_invalid=n_rows - n_valid)
+
+    counts = np.bincount(encoded_preds[valid], minlength=len(label_encoder.classes_))
+    metadata = {
+        "rows": n_rows,
+        "rows_valid": n_valid,
+        "rows_invalid": n_rows - n_valid,
+        "error_counts": count_errors(codes),
+        "crop_counts": {str(label_encoder.classes_[c]): int(counts[c]) for c in np.flatnonzero(counts)},
+        "unique_rows": n_unique,
+        "dedup_ratio": round(1.0 - n_unique / n_valid, 4) if n_valid else 0.0,
+        "model": mode
+    }
+    if store:
+        result_id = result_store.save(features, encoded_preds, label_encoder.classes_, ids,
+                                      id_column, row_errors, metadata)
+        return {"status": "ok", "result_id": result_id, "metadata": metadata}
+    return {
+        "status": "ok",
+        "results": echo_results(features, encoded_preds, row_errors, ids, id_column),
+        "metadata": metadata
+    }
+
+
+def combine_summaries(entries):
+    """Totals, per-crop counts and error counts over all scored files."""
+    ok = [entry["metadata"] for entry in entries.values() if entry["status"] == "ok"]
+    crop_counts = {}
+    error_counts = {}
+    for metadata in ok:
+        for crop, n in metadata["crop_counts"].items():
+            crop_counts[crop] = crop_counts.get(crop, 0) + n
+        for col, codes in metadata["error_counts"].items():
+            merged = error_counts.setdefault(col, {})
+            for code, n in codes.items():
+                merged[code] = merged.get(code, 0) + n
+    return {
+        "files": len(entries),
+        "files_ok": len(ok),
+        "files_failed": len(entries) - len(ok),
+        "rows": sum(m["rows"] for m in ok),
+        "rows_valid": sum(m["rows_valid"] for m in ok),
+        "rows_invalid": sum(m["rows_invalid"] for m in ok),
+        "unique_rows": sum(m["unique_rows"] for m in ok),
+        "error_counts": error_counts,
+        "crop_counts": crop_counts
+    }
+
+
+counterfactual_search = build_counterfactual_search()
+
+
+def batch_chunk_rows():
+    """Rows per /batch_predict chunk: tuned when available."""
+    if batch_tuner is not None and batch_tuner.chunk_rows:
+        return batch_tuner.chunk_rows
+    return BATCH_CHUNK_ROWS
+
+
+if batch_tuner is not None:
+    if training_df is not None:
+        probe_rows = training_df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    else:
+        scaler = preprocessor.named_transformers_["num"]
+        probe_rows = np.random.default_rng(0).normal(scaler.mean_, scaler.scale_, (1000, len(FEATURE_COLUMNS)))
+    batch_tuner.probe(model_predict, probe_rows)
+
+if os.environ.get("PREDICT_COALESCING", "0") == "1":
+    predict_coalescer = RequestCoalescer(
+        predict_encoded,
+        tuner=batch_tuner,
+        max_batch=int(os.environ.get("PREDICT_COALESCE_MAX_BATCH", "32")),
+        max_wait=float(os.environ.get("PREDICT_COALESCE_MAX_WAIT_MS", "2")) / 1000
+    )
 
 
 # --------------------------------------------------
@@ -33,6 +989,7 @@ def home():
 # 4. Single prediction endpoint (JSON)
 # --------------------------------------------------
 @app.route("/predict", methods=["GET","POST"])
+@admission_controlled(predict_admission)
 def predict_single():
     if request.method == "GET":
         return "Use POST with JSON body to get predictions.", 200
@@ -49,8 +1006,11 @@ def predict_single():
         "ph": 6.5,
         "rainfall": 120.0
     }
+
+    ?mode=xgboost|distilled picks the model (default INFERENCE_MODE).
     """
 
+    started = time.perf_counter()
     try:
         data = request.get_json()
 
@@ -65,17 +1025,26 @@ def predict_single():
                 "missing_fields": missing
             }), 400
 
-        # Build input DataFrame in correct feature order
-        values = [[data[col] for col in FEATURE_COLUMNS]]
-        input_df = pd.DataFrame(values, columns=FEATURE_COLUMNS)
+        mode = request_inference_mode()
+        if mode is None:
+            return jsonify({"error": "Unknown or unavailable inference mode"}), 400
+
+        # Build input matrix in correct feature order
+        values = np.asarray([[data[col] for col in FEATURE_COLUMNS]], dtype=np.float64)
 
-        # Predict (encoded)
-        encoded_pred = model.predict(input_df)
+        # Predict (encoded); the distilled tree is cheaper than a cache lookup
+        if mode == "distilled":
+            encoded_pred = np.asarray([distilled_model.predict_one(values[0].tolist())])
+        else:
+            encoded_pred = cached_predict(values)
+        observe_inputs(values)
+        log_predictions(values, encoded_pred, started)
         crop_name = label_encoder.inverse_transform(encoded_pred)[0]
 
         return jsonify({
             "input": data,
-            "recommended_crop": crop_name
+            "recommended_crop": crop_name,
+            "model": mode
         })
 
     except Exception as e:
@@ -86,6 +1055,7 @@ def predict_single():
 # 5. Batch prediction endpoint (CSV upload)
 # --------------------------------------------------
 @app.route("/batch_predict", methods=["POST"])
+@admission_controlled(batch_admission)
 def batch_predict():
     """
     Batch crop recommendation via CSV upload.
@@ -94,49 +1064,896 @@ def batch_predict():
 
     The CSV must contain the following columns:
     N, P, K, temperature, humidity, ph, rainfall
+
+    Only those columns are read (as float32), plus an optional id column
+    (BATCH_ID_COLUMN, default "id", or ?id_column=) that is passed
+    through to the results. Other columns are ignored.
+
+    Rows are validated cell by cell. Valid rows get "status": "ok" and a
+    prediction; invalid rows get "status": "error", no prediction and
+    "errors": [{"column", "code", "value"}] (codes: missing_value,
+    not_a_number, not_finite, out_of_range). metadata.rows_invalid and
+    metadata.error_counts summarise them.
+
+    The upload is parsed and scored chunk by chunk while it arrives.
+    Bodies over MAX_UPLOAD_BYTES and files over BATCH_MAX_ROWS rows get a
+    413 as soon as the limit is crossed.
+
+    Deadlines: send X-Request-Deadline (unix seconds) or
+    X-Request-Timeout (seconds). Rows are scored in chunks and work stops
+    once the deadline has passed. By default that returns 504; with
+    ?partial=1 the rows scored so far are returned with
+    metadata.continuation, which can be passed back as
+    ?continuation=<token> with the same file to resume. The token
+    carries a digest of the rows before its offset; a file whose rows
+    differ there gets a 400 before anything is scored.
+
+    ?mode=xgboost|distilled picks the model (default INFERENCE_MODE).
+
+    ?store=1 keeps the results on the server instead of returning them:
+    the response is {"result_id", "metadata"}, and the rows are read
+    back page by page from /batch_results/<result_id>.
     """
 
+    started = time.perf_counter()
     try:
-        # 1. Check if file is present
-        if "file" not in request.files:
+        try:
+            deadline = request_deadline()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        allow_partial = request.args.get("partial", "0") == "1"
+        store = request.args.get("store", "0") == "1"
+        mode = request_inference_mode()
+        if mode is None:
+            return jsonify({"error": "Unknown or unavailable inference mode"}), 400
+        continuation = None
+        if request.args.get("continuation"):
+            try:
+                continuation = read_continuation_token(request.args["continuation"])
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        offset = continuation[0] if continuation else 0
+
+        # 1. Read the 'file' part straight from the request body
+        try:
+            upload = StreamingUpload(request.stream, request.content_type, "file")
+        except ValueError:
             return jsonify({
                 "error": "No file part in the request. Please upload a CSV with key 'file'."
             }), 400
+        id_column = request.args.get("id_column", BATCH_ID_COLUMN)
+        reader = StreamingCsvReader(FEATURE_COLUMNS, id_column, batch_chunk_rows(), BATCH_MAX_ROWS)
 
-        file = request.files["file"]
+        # 2. Parse and score whole-row chunks as they arrive (duplicate
+        #    rows in a chunk are scored once). Past the deadline, scoring
+        #    stops; with ?partial=1 the rest of the body is still read,
+        #    but only its rows are counted. A continuation's rows before
+        #    the offset are hashed and checked against the token before
+        #    any row after it is scored.
+        parts = []
+        row_errors = {}
+        n_rows = n_unique = 0
+        done = offset
+        rows_digest = hashlib.sha256()
+        verified = continuation is None
 
-        # 2. Check file name
-        if file.filename == "":
+        def frame_ids(frame):
+            return frame[id_column].fillna("").to_numpy() if id_column in frame.columns else None
+
+        try:
+            for frame in upload_frames(upload, reader, lambda: allow_partial and deadline_passed(deadline)):
+                start, n_rows = n_rows, n_rows + len(frame)
+                if done < start:
+                    continue
+                if n_rows <= offset:
+                    update_rows_digest(rows_digest, *validate_features(frame, FEATURE_COLUMNS), frame_ids(frame))
+                    continue
+                if deadline_passed(deadline):
+                    if not allow_partial:
+                        record_metrics(batch_deadline_exceeded=1)
+                        return jsonify({
+                            "error": "Request deadline exceeded.",
+                            "rows_completed": done - offset,
+                            "rows_received": n_rows
+                        }), 504
+                    continue
+                if not verified:
+                    head = frame.iloc[:offset - start]
+                    update_rows_digest(rows_digest, *validate_features(head, FEATURE_COLUMNS), frame_ids(head))
+                    if rows_digest.hexdigest()[:32] != continuation[1]:
+                        return jsonify({"error": "Continuation token does not match the uploaded file"}), 400
+                    verified = True
+                frame = frame.iloc[max(offset - start, 0):]
+                features, codes, preds, chunk_unique = score_frame(frame, mode)
+                n_unique += chunk_unique
+                if (preds < 0).any():
+                    for i, errors in describe_errors(frame, codes, FEATURE_COLUMNS).items():
+                        row_errors[done - offset + i] = errors
+                ids = frame_ids(frame)
+                update_rows_digest(rows_digest, features, codes, ids)
+                parts.append((features, codes, ids, preds))
+                done = n_rows
+        except MissingColumnsError as e:
+            return jsonify({
+                "error": "Missing required columns in CSV.",
+                "missing_columns": e.missing
+            }), 400
+        except pd.errors.ParserError as e:
+            return jsonify({"error": f"Malformed CSV: {e}"}), 400
+        except RowLimitError as e:
+            return jsonify({"error": str(e), "max_rows": e.limit}), 413
+        except RequestEntityTooLarge:
+            return upload_too_large()
+        if reader.skipping:
+            # Rows drained after the deadline were counted, never parsed
+            n_rows = max(n_rows, reader.rows_seen)
+
+        # 3. Validate the upload as a whole
+        if upload.filename is None:
+            return jsonify({
+                "error": "No file part in the request. Please upload a CSV with key 'file'."
+            }), 400
+        if upload.filename == "":
             return jsonify({"error": "No file selected."}), 400
+        if reader.header is None:
+            return jsonify({"error": "The uploaded CSV is empty."}), 400
+        if not verified and done >= n_rows:
+            # The file ended at or before the offset
+            if rows_digest.hexdigest()[:32] != continuation[1]:
+                return jsonify({"error": "Continuation token does not match the uploaded file"}), 400
+            verified = True
+
+        offset = min(offset, n_rows)
+        done = min(done, n_rows)
+        n_scored = done - offset
+        features, codes, ids, encoded_preds = join_parts(parts)
+        valid = encoded_preds >= 0
+        n_valid = int(valid.sum())
+        if n_valid:
+            log_predictions(features[valid], encoded_preds[valid], started)
+            observe_inputs(features[valid])
+        record_metrics(batch_requests=1, batch_rows=n_valid, batch_unique_rows=n_unique,
+                       batch_rows_invalid=n_scored - n_valid)
+        if done < n_rows:
+            record_metrics(batch_deadline_exceeded=1, batch_partial_responses=1,
+                           batch_rows_abandoned=n_rows - done)
+
+        metadata = {
+            "rows": n_scored,
+            "rows_valid": n_valid,
+            "rows_invalid": n_scored - n_valid,
+            "error_counts": count_errors(codes),
+            "unique_rows": n_unique,
+            "dedup_ratio": round(1.0 - n_unique / n_valid, 4) if n_valid else 0.0,
+            "row_offset": offset,
+            "rows_total": n_rows,
+            "partial": done < n_rows,
+            "model": mode
+        }
+        if done < n_rows:
+            # Cut short before the offset was reached: the rows are not
+            # verified yet, so hand the same token back
+            digest = rows_digest.hexdigest()[:32] if verified else continuation[1]
+            metadata["continuation"] = make_continuation_token(done, digest)
 
-        # 3. Read CSV into DataFrame
-        df = pd.read_csv(file)
+        # 4. ?store=1: keep the rows server-side and return only their id
+        if store:
+            result_id = result_store.save(features, encoded_preds, label_encoder.classes_, ids,
+                                          id_column, row_errors, metadata)
+            return jsonify({"result_id": result_id, "metadata": metadata}), 200
 
-        # 4. Validate required columns
-        missing_cols = [col for col in FEATURE_COLUMNS if col not in df.columns]
-        if missing_cols:
+        # 5. Echo the rows (id column first, if sent) with a per-row status
+        result = echo_results(features, encoded_preds, row_errors, ids, id_column)
+        return jsonify({"results": result, "metadata": metadata}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 6. Multi-file / ZIP batch endpoint
+# --------------------------------------------------
+@app.route("/batch_predict_files", methods=["POST"])
+@admission_controlled(batch_admission)
+def batch_predict_files():
+    """
+    Batch crop recommendation for several CSVs at once.
+
+    Expects form-data with one or more 'file' fields, each a CSV or a
+    ZIP archive of CSVs (one per village, say). Archive members are
+    decompressed as they are read, and files are scored concurrently on
+    a pool of ARCHIVE_WORKERS threads.
+
+    The response is {"files": {name: entry}, "summary": {...},
+    "stored": bool}. Plain files are keyed by filename and archive
+    members by "<archive>/<member>". Each entry is shaped like a
+    /batch_predict response plus "status". Per-file metadata adds
+    crop_counts. A file that cannot be read gets "status": "error" and
+    an "error" message; the other files are still scored. The summary
+    totals rows, crops and error counts over all files.
+
+    ?id_column, ?mode and ?store=1 work as on /batch_predict (with
+    store=1, each entry has its own result_id). An archive member
+    compressed more than ARCHIVE_STORE_RATIO times implies store=1; the
+    response's "stored" says which form was used. Deadlines are honoured
+    with a 504 but there is no ?partial mode.
+
+    Limits: ARCHIVE_MAX_FILES CSVs per request, BATCH_MAX_ROWS rows and
+    ARCHIVE_MAX_MEMBER_BYTES uncompressed bytes per file, and
+    ARCHIVE_MAX_TOTAL_ROWS rows and ARCHIVE_MAX_TOTAL_BYTES uncompressed
+    bytes over the whole request. Crossing a total limit is a 413.
+    """
+
+    started = time.perf_counter()
+    archives = []
+    try:
+        try:
+            deadline = request_deadline()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        store = request.args.get("store", "0") == "1"
+        mode = request_inference_mode()
+        if mode is None:
+            return jsonify({"error": "Unknown or unavailable inference mode"}), 400
+        id_column = request.args.get("id_column", BATCH_ID_COLUMN)
+
+        # 1. Collect the CSVs: plain uploads and archive members
+        try:
+            uploads = [f for f in request.files.getlist("file") if f.filename]
+        except RequestEntityTooLarge:
+            return upload_too_large()
+        if not uploads:
             return jsonify({
-                "error": "Missing required columns in CSV.",
-                "missing_columns": missing_cols
+                "error": "No file part in the request. Please upload CSV or ZIP files with key 'file'."
             }), 400
+        try:
+            sources, archives, max_ratio = csv_sources(uploads, ARCHIVE_MAX_FILES, ARCHIVE_MAX_MEMBER_BYTES)
+        except ArchiveLimitError as e:
+            return jsonify({"error": str(e), "max_files": ARCHIVE_MAX_FILES}), 413
+        names = [name for name, _ in sources]
+        if not sources:
+            return jsonify({"error": "No CSV files found in the upload."}), 400
+        if len(set(names)) != len(names):
+            duplicates = sorted({name for name in names if names.count(name) > 1})
+            return jsonify({"error": "Duplicate file names in the upload.", "duplicates": duplicates}), 400
 
-        # 5. Predict using the model
-        encoded_preds = model.predict(df[FEATURE_COLUMNS])
-        crop_names = label_encoder.inverse_transform(encoded_preds)
+        # 2. Score every CSV on the pool, against one budget for the
+        #    whole request
+        store = store or max_ratio > ARCHIVE_STORE_RATIO
+        budget = UploadBudget(ARCHIVE_MAX_TOTAL_BYTES, ARCHIVE_MAX_TOTAL_ROWS)
+        futures = {
+            name: archive_pool.submit(score_source, chunks, budget, id_column, mode, deadline, store, started)
+            for name, chunks in sources
+        }
+        try:
+            entries = {name: future.result() for name, future in futures.items()}
+        except UploadBudgetError as e:
+            # The other files stop at their next charge; let them finish
+            # before the archives are closed
+            for future in futures.values():
+                future.cancel()
+            concurrent.futures.wait(futures.values())
+            return jsonify({
+                "error": str(e),
+                "max_total_bytes": ARCHIVE_MAX_TOTAL_BYTES,
+                "max_total_rows": ARCHIVE_MAX_TOTAL_ROWS
+            }), 413
+        record_metrics(batch_requests=1)
 
-        # 6. Add predictions to DataFrame
-        df["recommended_crop"] = crop_names
+        timed_out = [name for name, entry in entries.items() if entry is None]
+        if timed_out:
+            record_metrics(batch_deadline_exceeded=1)
+            return jsonify({
+                "error": "Request deadline exceeded.",
+                "files_completed": len(entries) - len(timed_out),
+                "files": len(entries)
+            }), 504
 
-        # 7. Convert to list of dicts for JSON response
-        result = df.to_dict(orient="records")
-        return jsonify(result), 200
+        return jsonify({"files": entries, "summary": combine_summaries(entries), "stored": store}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+# --------------------------------------------------
+# 7. Stored batch results (pages, summary, CSV export)
+# --------------------------------------------------
+def open_stored_result(result_id):
+    result = result_store.open(result_id)
+    if result is None:
+        return None, (jsonify({"error": "Unknown or expired result_id"}), 404)
+    return result, None
+
+
+@app.route("/batch_results/<result_id>", methods=["GET", "DELETE"])
+def batch_results(result_id):
+    """
+    One page of a stored /batch_predict result.
+
+    Query parameters: limit (default 100, at most RESULT_PAGE_MAX_ROWS),
+    cursor (next_cursor from the previous page), crop (only rows
+    predicted as that crop) and status (ok|error). Each row carries its
+    "row" position in the upload. DELETE drops the result.
+    """
+    if request.method == "DELETE":
+        if not result_store.delete(result_id):
+            return jsonify({"error": "Unknown or expired result_id"}), 404
+        return jsonify({"deleted": result_id})
+
+    result, error = open_stored_result(result_id)
+    if error:
+        return error
+    try:
+        limit = int(request.args.get("limit", "100"))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= RESULT_PAGE_MAX_ROWS:
+        return jsonify({"error": f"limit must be between 1 and {RESULT_PAGE_MAX_ROWS}"}), 400
+    status = request.args.get("status")
+    if status not in (None, "ok", "error"):
+        return jsonify({"error": "status must be 'ok' or 'error'"}), 400
+
+    try:
+        rows, next_cursor, total = result.page(
+            request.args.get("cursor"), limit, request.args.get("crop"), status
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "result_id": result_id,
+        "results": rows,
+        "next_cursor": next_cursor,
+        "total_matching": total,
+        "metadata": result.meta["metadata"]
+    })
+
+
+@app.get("/batch_results/<result_id>/summary")
+def batch_results_summary(result_id):
+    """Per-crop counts, shares and mean inputs, computed server-side."""
+    result, error = open_stored_result(result_id)
+    if error:
+        return error
+    summary = result.summary()
+    summary["result_id"] = result_id
+    return jsonify(summary)
+
+
+@app.get("/batch_results/<result_id>/export")
+def batch_results_export(result_id):
+    """The whole stored result as CSV, streamed in chunks."""
+    result, error = open_stored_result(result_id)
+    if error:
+        return error
+    return Response(
+        result.iter_csv(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=crop_recommendations_{result_id}.csv"}
+    )
+
+
+# --------------------------------------------------
+# 8. Similar fields endpoint (k nearest training samples)
+# --------------------------------------------------
+@app.route("/similar_fields", methods=["POST"])
+@admission_controlled(batch_admission)
+def similar_fields():
+    """
+    Return the k most similar real samples for one field or a batch.
+
+    Send one JSON row, a list of rows, or a CSV file under 'file'.
+    `k` (default 5, 1 to 50) may be given as a query parameter or in
+    the JSON body. Feature values must be finite.
+    """
+    if similar_fields_index is None:
+        return jsonify({"error": "Training dataset not available on this server."}), 503
+
+    try:
+        features, single, error = parse_feature_request()
+        if error:
+            return error
+
+        if not np.isfinite(features).all():
+            return jsonify({"error": "Feature values must be finite numbers"}), 400
+
+        body = request.get_json(silent=True)
+        k = request.args.get("k", body.get("k", 5) if isinstance(body, dict) else 5)
+        try:
+            k = int(k)
+        except (TypeError, ValueError):
+            k = 0
+        if not 1 <= k <= MAX_K:
+            return jsonify({"error": f"k must be an integer between 1 and {MAX_K}"}), 400
+        neighbors = similar_fields_index.neighbors(features, k)
+
+        if single:
+            return jsonify({"neighbors": neighbors[0]})
+        return jsonify({
+            "results": [{"row": i, "neighbors": n} for i, n in enumerate(neighbors)],
+            "metadata": {"rows": len(neighbors), "index_size": len(similar_fields_index)}
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 9. Explanation endpoint (TreeSHAP contributions)
+# --------------------------------------------------
+@app.route("/explain", methods=["POST"])
+@admission_controlled(row_admission)
+def explain():
+    """
+    Per-feature contributions from the booster for one row or a batch.
+
+    Send one JSON row, a list of rows, or a CSV file under 'file'.
+    Contributions are in log-odds units for the predicted crop; add
+    ?all_classes=1 to also get them for every crop. Rows already seen
+    by /predict or /explain are served from the prediction cache.
+    """
+    try:
+        features, single, error = parse_feature_request()
+        if error:
+            return error
+
+        all_classes = request.args.get("all_classes", "0") == "1"
+        results = []
+        if not len(features):
+            return jsonify({"results": results, "metadata": {"rows": 0}})
+
+        contribs = np.stack(cached_lookup(features, "contribs", compute_contributions))
+        classes = contribs.sum(axis=2).argmax(axis=1)
+        crop_names = label_encoder.inverse_transform(classes)
+
+        for row, cls, crop in zip(contribs, classes, crop_names):
+            entry = {
+                "recommended_crop": crop,
+                "bias": round(float(row[cls, -1]), 6),
+                "contributions": {
+                    col: round(float(v), 6) for col, v in zip(FEATURE_COLUMNS, row[cls, :-1])
+                }
+            }
+            if all_classes:
+                entry["all_contributions"] = {
+                    name: {col: round(float(v), 6) for col, v in zip(FEATURE_COLUMNS, class_row[:-1])}
+                    for name, class_row in zip(label_encoder.classes_, row)
+                }
+            results.append(entry)
+
+        if single:
+            return jsonify(results[0])
+        return jsonify({"results": results, "metadata": {"rows": len(results)}})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 10. What-if sensitivity sweep endpoint
+# --------------------------------------------------
+@app.route("/what_if", methods=["POST"])
+@admission_controlled(batch_admission)
+def what_if():
+    """
+    Score a grid of scenarios around a base input in one call.
+
+    Expects JSON like:
+    {
+        "base": {"N": 50, "P": 40, "K": 40, "temperature": 25.0,
+                 "humidity": 80.0, "ph": 6.5, "rainfall": 120.0},
+        "sweeps": [
+            {"feature": "rainfall", "start": 50, "stop": 300, "step": 5},
+            {"feature": "N", "start": 0, "stop": 140, "step": 10}
+        ]
+    }
+
+    The response holds flat row-major arrays with the grid `shape`:
+    `class_indices` (into `classes`) and `max_probability`. Add
+    ?full=1 for the full (n_points, n_classes) probability matrix.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get("base"), dict):
+            return jsonify({"error": "Request body must be JSON with a 'base' object"}), 400
+
+        missing = [col for col in FEATURE_COLUMNS if col not in data["base"]]
+        if missing:
+            return jsonify({
+                "error": "Missing required fields",
+                "missing_fields": missing
+            }), 400
+
+        try:
+            grid, axes = expand_sweep_grid(data["base"], data.get("sweeps", []))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid sweep spec: {e}"}), 400
+
+        proba = model_predict_proba(grid)
+        class_indices = proba.argmax(axis=1)
+
+        response = {
+            "classes": label_encoder.classes_.tolist(),
+            "axes": [{"feature": feature, "values": values.tolist()} for feature, values in axes],
+            "shape": [len(values) for _, values in axes],
+            "class_indices": class_indices.tolist(),
+            "max_probability": np.round(proba.max(axis=1), 4).tolist()
+        }
+        if request.args.get("full", "0") == "1":
+            response["probabilities"] = np.round(proba, 4).tolist()
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 11. Counterfactual endpoint (minimal change for a target crop)
+# --------------------------------------------------
+@app.route("/counterfactual", methods=["POST"])
+@admission_controlled(batch_admission)
+def counterfactual():
+    """
+    Find the smallest weighted change to N, P, K and ph that makes the
+    model recommend `target_crop`.
+
+    Expects JSON like:
+    {
+        "input": {"N": 50, "P": 40, "K": 40, "temperature": 25.0,
+                  "humidity": 80.0, "ph": 6.5, "rainfall": 120.0},
+        "target_crop": "cotton",
+        "features": ["N", "P", "K", "ph"],      (optional)
+        "weights": {"ph": 3.0},                 (optional, default 1)
+        "beam_width": 4, "max_steps": 4,        (optional)
+        "restarts": 4                           (optional)
+    }
+
+    Cost is measured in training standard deviations times weight. The
+    search is heuristic: a beam search, then up to `restarts` rounds of
+    random sampling if the beam finds nothing. "found": false means
+    nothing was found within that budget, not that the crop is
+    unreachable.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get("input"), dict):
+            return jsonify({"error": "Request body must be JSON with an 'input' object"}), 400
+
+        missing = [col for col in FEATURE_COLUMNS if col not in data["input"]]
+        if missing:
+            return jsonify({
+                "error": "Missing required fields",
+                "missing_fields": missing
+            }), 400
+
+        target_crop = str(data.get("target_crop", "")).lower()
+        if target_crop not in label_encoder.classes_:
+            return jsonify({
+                "error": "Unknown target_crop",
+                "valid_crops": label_encoder.classes_.tolist()
+            }), 400
+
+        features = data.get("features", CONTROLLABLE_FEATURES)
+        invalid = [f for f in features if f not in CONTROLLABLE_FEATURES]
+        if invalid:
+            return jsonify({
+                "error": "Only N, P, K and ph can be changed",
+                "invalid_features": invalid
+            }), 400
+
+        x0 = [float(data["input"][col]) for col in FEATURE_COLUMNS]
+        start = time.perf_counter()
+        result = counterfactual_search.search(
+            x0,
+            int(label_encoder.transform([target_crop])[0]),
+            features=features,
+            weights=data.get("weights"),
+            beam_width=min(int(data.get("beam_width", 4)), 64),
+            max_steps=min(int(data.get("max_steps", 4)), 8),
+            restarts=min(int(data.get("restarts", 4)), 16)
+        )
+        result["target_crop"] = target_crop
+        result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 12. Class-probability endpoint (full matrix and/or top-k)
+# --------------------------------------------------
+@app.route("/predict_proba", methods=["POST"])
+@admission_controlled(row_admission)
+def predict_proba():
+    """
+    Probabilities over all crops for one row or a batch.
+
+    Send one JSON row, a list of rows, or a CSV file under 'file'.
+    Query parameters:
+      output   = matrix | topk | both   (default both)
+      k        = number of crops in the top-k view (default 3,
+                 capped at the number of crops)
+      dtype    = float16 | float32      (default float32)
+      encoding = json | base64          (default json)
+
+    The matrix is (rows, len(classes)) in `classes` order. With base64
+    encoding each array is the raw little-endian buffer, so 100k rows
+    of float16 is about 4.4 MB before compression.
+    """
+    try:
+        output = request.args.get("output", "both")
+        dtype = request.args.get("dtype", "float32")
+        encoding = request.args.get("encoding", "json")
+        if output not in ("matrix", "topk", "both") or dtype not in ("float16", "float32") \
+                or encoding not in ("json", "base64"):
+            return jsonify({"error": "Invalid output, dtype or encoding parameter"}), 400
+        try:
+            k = int(request.args.get("k", 3))
+        except ValueError:
+            return jsonify({"error": "k must be an integer"}), 400
+        if k < 1:
+            return jsonify({"error": "k must be at least 1"}), 400
+
+        features, single, error = parse_feature_request()
+        if error:
+            return error
+
+        n_classes = len(label_encoder.classes_)
+        proba = predict_proba_unique(features) if len(features) else np.zeros((0, n_classes))
+        observe_inputs(features)
+        proba = proba.astype(dtype)
+
+        response = {"classes": label_encoder.classes_.tolist(), "rows": len(proba)}
+        if output in ("matrix", "both"):
+            response["probabilities"] = encode_array(proba, encoding)
+        if output in ("topk", "both"):
+            k = min(k, n_classes)
+            top = np.argsort(-proba, axis=1, kind="stable")[:, :k]
+            response["top_k"] = {
+                "k": k,
+                "indices": encode_array(top.astype(np.uint8), encoding),
+                "probabilities": encode_array(np.take_along_axis(proba, top, axis=1), encoding)
+            }
+        if single:
+            response["recommended_crop"] = label_encoder.classes_[int(proba[0].argmax())]
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 13. Crop-suitability raster tiles
+# --------------------------------------------------
+@app.get("/raster/<run>")
+def raster_run(run):
+    """Metadata and progress for a raster run produced by raster.py."""
+    run_dir = os.path.join(RASTER_OUTPUT_DIR, run)
+    if run.startswith(".") or not os.path.exists(os.path.join(run_dir, META_FILE)):
+        return jsonify({"error": "Unknown raster run"}), 404
+
+    with open(os.path.join(run_dir, META_FILE)) as f:
+        meta = json.load(f)
+    height, width = meta["shape"]
+    tile = meta["tile"]
+    with open(os.path.join(run_dir, PROGRESS_FILE)) as f:
+        completed = sum(1 for line in f if line.strip())
+    meta["tiles"] = {
+        "rows": -(-height // tile),
+        "cols": -(-width // tile),
+        "completed": completed
+    }
+    meta.pop("features", None)
+    return jsonify(meta)
+
+
+@app.get("/raster/<run>/tiles/<int:row>/<int:col>")
+def raster_tile(run, row, col):
+    """
+    Class-index and max-probability arrays for one finished tile.
+    Class index 255 / NaN probability mark nodata cells. Use
+    ?encoding=base64 for raw little-endian buffers.
+    """
+    encoding = request.args.get("encoding", "json")
+    if encoding not in ("json", "base64"):
+        return jsonify({"error": "Invalid encoding parameter"}), 400
+
+    progress_path = os.path.join(RASTER_OUTPUT_DIR, run, PROGRESS_FILE)
+    if run.startswith(".") or not os.path.exists(progress_path):
+        return jsonify({"error": "Unknown raster run"}), 404
+
+    payload = load_raster_tile(run, row, col, encoding, os.path.getmtime(progress_path))
+    if payload is None:
+        return jsonify({"error": "Tile not found or not scored yet"}), 404
+    return jsonify(payload)
+
+
+# --------------------------------------------------
+# 14. Monte Carlo uncertainty endpoint
+# --------------------------------------------------
+@app.route("/uncertainty", methods=["POST"])
+@admission_controlled(batch_admission)
+def uncertainty():
+    """
+    How stable is the recommendation under measurement error?
+
+    Send one JSON row, {"rows": [...]}, or a CSV file under 'file'.
+    Options (JSON keys, or a JSON-encoded 'options' form field for CSV):
+      uncertainty      relative 1-sigma error per feature,
+                       default {"N": 0.1, "P": 0.1, "K": 0.1, "ph": 0.05}
+      uncertainty_abs  absolute 1-sigma error per feature (added)
+      samples          draws per input (default 1000)
+      budget_ms        latency budget; samples are reduced to fit it
+      seed             RNG seed for reproducible draws
+
+    samples, budget_ms and seed must be non-negative integers (samples
+    at least 1); anything else is a 400.
+
+    stability is the fraction of draws that keep the point prediction.
+    """
+    try:
+        features, single, error = parse_feature_request()
+        if error:
+            return error
+
+        options = request.get_json(silent=True) if request.is_json else None
+        if not isinstance(options, dict):
+            try:
+                options = json.loads(request.form.get("options", "{}"))
+            except ValueError:
+                return jsonify({"error": "'options' must be a JSON object"}), 400
+            if not isinstance(options, dict):
+                return jsonify({"error": "'options' must be a JSON object"}), 400
+
+        relative_spec = options.get("uncertainty", DEFAULT_UNCERTAINTY)
+        absolute_spec = options.get("uncertainty_abs", {})
+        if not isinstance(relative_spec, dict) or not isinstance(absolute_spec, dict):
+            return jsonify({"error": "'uncertainty' and 'uncertainty_abs' must be objects"}), 400
+        unknown = [f for f in list(relative_spec) + list(absolute_spec) if f not in FEATURE_COLUMNS]
+        if unknown:
+            return jsonify({"error": "Unknown features in uncertainty", "invalid_features": unknown}), 400
+        try:
+            relative = np.array([float(relative_spec.get(col, 0.0)) for col in FEATURE_COLUMNS])
+            absolute = np.array([float(absolute_spec.get(col, 0.0)) for col in FEATURE_COLUMNS])
+            if not (np.isfinite(relative).all() and np.isfinite(absolute).all()):
+                raise ValueError("uncertainties must be finite")
+            samples = integer_option(options, "samples", 1000, minimum=1)
+            budget_ms = integer_option(options, "budget_ms")
+            seed = integer_option(options, "seed")
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid options: {e}"}), 400
+
+        n = len(features)
+        samples = min(samples, MONTE_CARLO_MAX_SAMPLES)
+        samples = min(samples, max(1, MONTE_CARLO_MAX_ROWS // max(n, 1)))
+        if budget_ms is not None:
+            affordable = budget_ms / 1000.0 / seconds_per_row["value"] / max(n, 1)
+            samples = max(1, min(samples, int(affordable)))
+
+        start = time.perf_counter()
+        results = []
+        if n:
+            point = model_predict(features)
+            rng = np.random.default_rng(seed)
+            frequencies = monte_carlo_frequencies(features, relative, absolute, samples, rng)
+            for cls, freq in zip(point, frequencies):
+                results.append({
+                    "recommended_crop": label_encoder.classes_[cls],
+                    "stability": round(float(freq[cls]), 4),
+                    "crop_frequencies": {
+                        label_encoder.classes_[i]: round(float(freq[i]), 4) for i in np.flatnonzero(freq)
+                    }
+                })
+
+        metadata = {
+            "rows": n,
+            "samples": samples,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3)
+        }
+        if single:
+            return jsonify({**results[0], "metadata": metadata})
+        return jsonify({"results": results, "metadata": metadata})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# --------------------------------------------------
+# 15. Feature-drift endpoint
+# --------------------------------------------------
+@app.route("/drift", methods=["GET", "DELETE"])
+def drift():
+    """
+    Drift of production inputs (/predict, /batch_predict, /predict_proba)
+    against the training distribution: per-feature PSI, binned KS and
+    mean shift. DELETE resets the running statistics.
+    """
+    if drift_monitor is None:
+        return jsonify({"error": "Training dataset not available on this server."}), 503
+    if request.method == "DELETE":
+        drift_monitor.reset()
+    return jsonify(drift_monitor.report())
+
+
+# --------------------------------------------------
+# 16. Batch-size tuning endpoint
+# --------------------------------------------------
+@app.get("/batch_tuning")
+def batch_tuning():
+    """
+    Batch sizes in effect for /batch_predict chunking and /predict
+    coalescing, plus the measured cost curve when the tuner is on.
+    """
+    result = {
+        "autotune": batch_tuner is not None,
+        "chunk_rows": batch_chunk_rows(),
+        "coalescing": predict_coalescer is not None
+    }
+    if predict_coalescer is not None:
+        max_batch, max_wait = predict_coalescer.limits()
+        result["max_batch"] = max_batch
+        result["max_wait_ms"] = round(max_wait * 1000, 3)
+        result["coalescer"] = predict_coalescer.stats()
+    if batch_tuner is not None:
+        result["tuner"] = batch_tuner.snapshot()
+    return jsonify(result)
+
+
+# --------------------------------------------------
+# 17. Metrics endpoint
+# --------------------------------------------------
+@app.get("/metrics")
+def metrics():
+    """
+    Snapshot of the in-process counters.
+
+    dedup_ratio is the fraction of batch rows that were duplicates of
+    another row in the same scoring chunk and therefore not re-scored.
+    Uploads are scored chunk by chunk as they stream in, so a duplicate
+    in a different chunk of the same upload is scored again.
+    """
+    with metrics_lock:
+        snapshot = dict(METRICS)
+    rows = snapshot["batch_rows"]
+    snapshot["dedup_ratio"] = round(1.0 - snapshot["batch_unique_rows"] / rows, 4) if rows else 0.0
+    if drift_monitor is not None:
+        report = drift_monitor.report()
+        snapshot["drift_samples"] = report["samples"]
+        snapshot["drift_status"] = report["status"]
+        snapshot["drift_max_psi"] = report["max_psi"]
+        snapshot["drift_psi"] = {name: f["psi"] for name, f in report["features"].items()}
+        snapshot["drift_ks"] = {name: f["ks"] for name, f in report["features"].items()}
+    if prediction_log is not None:
+        snapshot["prediction_log_written"] = prediction_log.written
+        snapshot["prediction_log_dropped"] = prediction_log.dropped
+        snapshot["prediction_log_segments"] = prediction_log.segments
+        snapshot["prediction_log_write_errors"] = prediction_log.write_errors
+        snapshot["prediction_log_last_error"] = prediction_log.last_error
+        snapshot["prediction_log_disabled"] = prediction_log.disabled
+    snapshot["serving_profile"] = serving_profile
+    snapshot["archive_workers"] = ARCHIVE_WORKERS
+    snapshot["inference_mode"] = DEFAULT_INFERENCE_MODE
+    snapshot["distilled_model_loaded"] = distilled_model is not None
+    if leaf_index is not None:
+        snapshot["leaf_index"] = leaf_index.stats()
+    for controller in (predict_admission, batch_admission):
+        for key, value in controller.stats().items():
+            snapshot[f"admission_{controller.name}_{key}"] = value
+    cascade_rows = snapshot["cascade_rows"]
+    lookups = snapshot["cache_hits"] + snapshot["cache_misses"]
+    snapshot["cache_hit_rate"] = round(snapshot["cache_hits"] / lookups, 4) if lookups else 0.0
+    snapshot["cache_entries"] = len(prediction_cache)
+    snapshot["cascade_short_circuit_fraction"] = (
+        round(snapshot["cascade_short_circuited"] / cascade_rows, 4) if cascade_rows else 0.0
+    )
+    return jsonify(snapshot)
 
 
 # --------------------------------------------------
-# 6. Run app locally (for development)
+# 18. Run app locally (for development)
 # --------------------------------------------------
 if __name__ == "__main__":
      
@@ -0,0 +1,212 @@
+"""
+Adaptive batch sizes: chunking for /batch_predict and request
+coalescing for /predict.
+
+How many rows to hand the model per call depends on the host, the
+XGBoost thread count and the model itself. BatchSizeTuner measures the
+cost of one call at a ladder of batch sizes at startup. It keeps
+refining that curve from the model calls made while serving, and
+re-picks every `retune_interval` seconds:
+
+    chunk_rows    smallest size within `efficiency` of peak rows/s whose
+                  call fits the chunk budget (deadlines are checked
+                  between chunks, so this also bounds overshoot)
+    max_batch     largest size a coalesced /predict call can score in
+                  half the coalescing budget
+    max_wait      the rest of that budget, capped at one call's cost,
+                  since waiting longer than a call takes gains little
+
+RequestCoalescer merges concurrent /predict rows into a single model
+call of up to max_batch rows. It waits at most max_wait for the batch
+to fill.
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+CANDIDATE_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class BatchSizeTuner:
+    """Per-call cost curve over batch sizes and the sizes it implies."""
+
+    def __init__(self, sizes=CANDIDATE_SIZES, chunk_budget=0.25, coalesce_budget=0.01,
+                 efficiency=0.9, retune_interval=300.0, smoothing=0.2):
+        self.sizes = tuple(sorted(sizes))
+        self.chunk_budget = chunk_budget
+        self.coalesce_budget = coalesce_budget
+        self.efficiency = efficiency
+        self.retune_interval = retune_interval
+        self.smoothing = smoothing
+
+        self.seconds = {}       # batch size -> seconds per call
+        self.observations = {}  # batch size -> calls folded in while serving
+        self.chunk_rows = None
+        self.max_batch = 1
+        self.max_wait = 0.0
+        self.probed_at = None
+        self.tuned_at = None
+        self._lock = threading.Lock()
+
+    def probe(self, predict, rows, repeats=3):
+        """
+        Time `predict` at each candidate size using rows drawn from
+        `rows`. Stops at the first size whose call exceeds the chunk
+        budget; larger sizes could never be chosen.
+        """
+        rng = np.random.default_rng(0)
+        measured = {}
+        for size in self.sizes:
+            batch = rows[rng.integers(0, len(rows), size)]
+            predict(batch)  # warm-up
+            best = np.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                predict(batch)
+                best = min(best, time.perf_counter() - start)
+            measured[size] = best
+            if best > self.chunk_budget:
+                break
+        with self._lock:
+            self.seconds = measured
+            self.observations = {size: 0 for size in measured}
+            self.probed_at = time.time()
+        self.choose()
+
+    def observe(self, n_rows, seconds):
+        """Fold one serving-time model call into the nearest size bucket."""
+        if n_rows <= 0 or not self.seconds:
+            return
+        with self._lock:
+            size = min(self.seconds, key=lambda s: abs(np.log2(s) - np.log2(n_rows)))
+            scaled = seconds * size / n_rows
+            self.seconds[size] += self.smoothing * (scaled - self.seconds[size])
+            self.observations[size] += 1
+            due = time.time() - (self.tuned_at or 0) >= self.retune_interval
+        if due:
+            self.choose()
+
+    def choose(self):
+        with self._lock:
+            sizes = sorted(self.seconds)
+            if not sizes:
+                return
+            seconds = np.array([self.seconds[s] for s in sizes])
+            throughput = np.array(sizes) / seconds
+            fits = seconds <= self.chunk_budget
+
+            if fits.any():
+                near_peak = throughput >= self.efficiency * throughput[fits].max()
+                self.chunk_rows = sizes[np.flatnonzero(fits & near_peak)[0]]
+            else:
+                self.chunk_rows = sizes[0]
+
+            coalesce = np.flatnonzero(seconds <= self.coalesce_budget / 2)
+            self.max_batch = sizes[coalesce[-1]] if len(coalesce) else 1
+            call = self.seconds[self.max_batch]
+            self.max_wait = max(0.0, min(self.coalesce_budget - call, call)) if self.max_batch > 1 else 0.0
+            self.tuned_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            curve = [
+                {
+                    "batch_size": size,
+                    "ms_per_call": round(self.seconds[size] * 1000, 4),
+                    "rows_per_second": round(size / self.seconds[size], 1),
+                    "observations": self.observations.get(size, 0)
+                }
+                for size in sorted(self.seconds)
+            ]
+            return {
+                "chunk_rows": self.chunk_rows,
+                "max_batch": self.max_batch,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "chunk_budget_ms": self.chunk_budget * 1000,
+                "coalesce_budget_ms": self.coalesce_budget * 1000,
+                "efficiency": self.efficiency,
+                "probed_at": self.probed_at,
+                "tuned_at": self.tuned_at,
+                "curve": curve
+            }
+
+
+class _Pending:
+    __slots__ = ("features", "result", "error", "done")
+
+    def __init__(self, features):
+        self.features = features
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RequestCoalescer:
+    """Background thread that scores concurrent small requests together."""
+
+    def __init__(self, predict, tuner=None, max_batch=32, max_wait=0.002):
+        self.predict_batch = predict
+        self.tuner = tuner
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self.calls = 0
+        self.rows = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="request-coalescer", daemon=True)
+        self._thread.start()
+
+    def predict(self, features):
+        """Blocking: encoded predictions for a small (n, 7) matrix."""
+        pending = _Pending(np.asarray(features, dtype=np.float64))
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def limits(self):
+        """(max_batch, max_wait) in effect: tuned values once available."""
+        if self.tuner is not None and self.tuner.tuned_at is not None:
+            return self.tuner.max_batch, self.tuner.max_wait
+        return self.max_batch, self.max_wait
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            n_rows = len(batch[0].features)
+            max_batch, max_wait = self.limits()
+            deadline = time.monotonic() + max_wait
+            while n_rows < max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item.features)
+
+            try:
+                preds = self.predict_batch(np.concatenate([item.features for item in batch]))
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+                    item.done.set()
+                continue
+
+            self.calls += 1
+            self.rows += n_rows
+            offset = 0
+            for item in batch:
+                item.result = preds[offset:offset + len(item.features)]
+                offset += len(item.features)
+                item.done.set()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "mean_batch": round(self.rows / self.calls, 2) if self.calls else 0.0
+        }
@@ -0,0 +1,285 @@
+"""
+Benchmark suite for the serving paths.
+
+    python benchmarks.py ingest --rows 1000000 --extra-columns 20
+
+ingest compares the original /batch_predict ingestion with the readers
+in ingest.py:
+
+    previous   whole upload read into memory, hashed, pd.read_csv over
+               every column, features cast to float64
+    projected  read_batch_csv: feature columns as float32 plus the id
+               column (Flask-parsed uploads on the other endpoints)
+    streamed   StreamingCsvReader fed 64 KB reads while hashing, as
+               /batch_predict does with the request body
+
+Each method runs in a fresh subprocess, so peak RSS is not polluted by
+the others. Measured on a 1M-row file with an id column and 20 extra
+metadata columns (201 MB):
+
+    method      seconds   peak RSS over baseline   per 1M rows
+    previous       3.7             827 MB              827 MB
+    projected      1.6              98 MB               98 MB
+    streamed       2.7             169 MB              169 MB
+
+(1 CPU, pandas 3.0, C engine. The streamed figure includes the ids as
+Python strings, which the response echo needs.)
+
+    python benchmarks.py transport --requests 2000
+
+transport starts gunicorn with gunicorn.conf.py, bound to a TCP port and
+a Unix domain socket (UNIX_SOCKET), and times POST /predict over each,
+with a new connection per request and with one kept-alive connection:
+
+    transport          mean ms   p50 ms   p99 ms
+    tcp new conn         2.25     2.20     3.37
+    tcp keep-alive       1.79     1.77     2.41
+    unix new conn        1.95     1.95     2.72
+    unix keep-alive      1.69     1.67     2.23
+
+(1 CPU, 1 worker, gthread; the same input every time, so these are
+mostly transport and Flask overhead around a prediction-cache hit.)
+"""
+import argparse
+import http.client
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_synthetic_csv(path, rows, extra_columns, seed=0):
+    """Feature columns plus id, numeric and text metadata columns."""
+    rng = np.random.default_rng(seed)
+    block = 100_000
+    for start in range(0, rows, block):
+        n = min(block, rows - start)
+        df = pd.DataFrame({
+            "id": [f"field-{i}" for i in range(start, start + n)],
+            "N": rng.integers(0, 140, n),
+            "P": rng.integers(5, 145, n),
+            "K": rng.integers(5, 205, n),
+            "temperature": rng.uniform(8, 44, n).round(6),
+            "humidity": rng.uniform(14, 100, n).round(6),
+            "ph": rng.uniform(3.5, 9.9, n).round(6),
+            "rainfall": rng.uniform(20, 299, n).round(6)
+        })
+        for j in range(extra_columns):
+            if j % 2:
+                df[f"meta_{j}"] = rng.choice(["loam", "clay", "sandy", "silt"], n)
+            else:
+                df[f"meta_{j}"] = rng.normal(0, 100, n).round(4)
+        df.to_csv(path, mode="a", header=start == 0, index=False)
+
+
+def ingest_previous(path):
+    import hashlib
+    import io
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    hashlib.sha256(raw).hexdigest()
+    df = pd.read_csv(io.BytesIO(raw))
+    features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    return raw, df, features
+
+
+def ingest_projected(path):
+    """Whole-file projected read (Flask-parsed uploads on other endpoints)."""
+    from ingest import read_batch_csv
+
+    with open(path, "rb") as f:
+        df = read_batch_csv(f, FEATURE_COLUMNS, "id")
+    features = df[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+    return df, features
+
+
+def ingest_streamed(path):
+    """/batch_predict: hash and parse 64 KB reads as they arrive."""
+    import hashlib
+
+    from ingest import StreamingCsvReader
+
+    digest = hashlib.sha256()
+    reader = StreamingCsvReader(FEATURE_COLUMNS, "id", chunk_rows=5000)
+    frames = []
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1 << 16), b""):
+            digest.update(data)
+            frames.extend(reader.feed(data))
+    frames.extend(reader.close())
+    features = np.concatenate([frame[FEATURE_COLUMNS].to_numpy(dtype=np.float32) for frame in frames])
+    ids = np.concatenate([frame["id"].to_numpy() for frame in frames])
+    return ids, features
+
+
+METHODS = {"previous": ingest_previous, "projected": ingest_projected, "streamed": ingest_streamed}
+
+
+def ingest_run(args):
+    """Child process: one method, reports seconds and peak RSS as JSON."""
+    method = METHODS[args.method]
+    if args.method != "previous":
+        import ingest  # noqa: F401 (import cost belongs in the baseline)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    kept = method(args.path)
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_mb": baseline,
+        "rows": len(kept[-1])
+    }))
+
+
+def ingest_benchmark(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.csv or os.path.join(tmp, "batch.csv")
+        if not args.csv:
+            write_synthetic_csv(path, args.rows, args.extra_columns)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"File: {size_mb:,.0f} MB")
+        print(f"{'method':10s} {'seconds':>8s} {'peak RSS over baseline':>24s} {'per 1M rows':>13s}")
+        for method in METHODS:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "ingest-run", "--method", method, "--path", path],
+                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            used = result["peak_rss_mb"] - result["baseline_mb"]
+            per_million = used / result["rows"] * 1e6
+            print(f"{method:10s} {result['seconds']:8.2f} {used:21,.0f} MB {per_million:10,.0f} MB")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=10):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(connect, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = connect()
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError("Server did not come up")
+
+
+def request_latencies(connect, n, keep_alive, body):
+    """Seconds per POST /predict, connection setup included."""
+    headers = {"Content-Type": "application/json"}
+    latencies = []
+    conn = None
+    for _ in range(n):
+        start = time.perf_counter()
+        if conn is None:
+            conn = connect()
+        conn.request("POST", "/predict", body, headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"/predict returned {response.status}")
+        if not keep_alive or response.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    return np.array(latencies)
+
+
+def transport_benchmark(args):
+    backend = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "api.sock")
+        port = free_port()
+        env = dict(os.environ, PORT=str(port), UNIX_SOCKET=socket_path, GUNICORN_WORKERS=str(args.workers))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", os.path.join(backend, "gunicorn.conf.py"),
+             "--pythonpath", backend, "app:app"],
+            cwd=args.workdir or backend, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            transports = {
+                "tcp": lambda: http.client.HTTPConnection("127.0.0.1", port, timeout=10),
+                "unix": lambda: UnixHTTPConnection(socket_path)
+            }
+            wait_for_server(transports["tcp"])
+            wait_for_server(transports["unix"])
+
+            body = json.dumps({"N": 90, "P": 42, "K": 43, "temperature": 20.8,
+                               "humidity": 82.0, "ph": 6.5, "rainfall": 202.9})
+            print(f"{'transport':18s} {'mean ms':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+            for name, connect in transports.items():
+                for keep_alive in (False, True):
+                    request_latencies(connect, args.warmup, keep_alive, body)
+                    ms = request_latencies(connect, args.requests, keep_alive, body) * 1000
+                    label = f"{name} {'keep-alive' if keep_alive else 'new conn'}"
+                    print(f"{label:18s} {ms.mean():8.2f} {np.percentile(ms, 50):8.2f} {np.percentile(ms, 99):8.2f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serving benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="Time and peak RSS of batch CSV ingestion")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--extra-columns", type=int, default=20)
+    p.add_argument("--csv", default=None, help="Use an existing CSV instead of a synthetic one")
+
+    p = sub.add_parser("ingest-run", help=argparse.SUPPRESS)
+    p.add_argument("--method", required=True)
+    p.add_argument("--path", required=True)
+
+    p = sub.add_parser("transport", help="/predict latency over TCP loopback vs a Unix domain socket")
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--warmup", type=int, default=200)
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--workdir", default=None, help="Directory holding the model artifact (default: this one)")
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        ingest_benchmark(args)
+    elif args.command == "transport":
+        transport_benchmark(args)
+    else:
+        ingest_run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Two-stage (cascade) crop inference.
+
+Stage 1 is a per-class diagonal Gaussian over standardized features,
+fitted on model/Crop_recommendation.csv. When the log-likelihood margin
+between its best and second-best class clears a threshold calibrated
+against the XGBoost pipeline, that answer is returned directly; all
+other rows fall through to the full model.
+
+The threshold is calibrated on rows XGBoost was not trained on (the
+notebook's 20% held-out split), so CASCADE_TARGET_AGREEMENT is an
+out-of-sample agreement rate rather than one measured on rows the
+teacher has memorised.
+
+Run as a script to report the short-circuit rate, end-to-end speedup
+and accuracy loss on half of the notebook's held-out split:
+
+    python cascade.py --csv ../model/Crop_recommendation.csv \
+                      --model crop_recommendation_model.joblib
+"""
+import argparse
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+
+# Variance floor (in standardized units) so a class with a constant
+# feature does not produce an infinite log-likelihood.
+MIN_VARIANCE = 1e-3
+
+
+class GaussianCascade:
+    """Per-class diagonal Gaussian with a calibrated margin threshold."""
+
+    def __init__(self):
+        self.mean_ = None
+        self.scale_ = None
+        self.threshold = np.inf
+
+    def fit(self, X, y, n_classes):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+
+        self.mean_ = X.mean(axis=0)
+        self.scale_ = X.std(axis=0)
+        self.scale_[self.scale_ == 0] = 1.0
+        Z = (X - self.mean_) / self.scale_
+
+        mu = np.zeros((n_classes, Z.shape[1]))
+        var = np.ones((n_classes, Z.shape[1]))
+        for c in range(n_classes):
+            rows = Z[y == c]
+            if len(rows):
+                mu[c] = rows.mean(axis=0)
+                var[c] = np.maximum(rows.var(axis=0), MIN_VARIANCE)
+
+        # Expand sum((z - mu)^2 / var) into matrix products so scoring
+        # n rows is two (n, 7) @ (7, C) products instead of an (n, C, 7)
+        # temporary.
+        inv_var = 1.0 / var
+        self._quad = inv_var.T
+        self._lin = (-2.0 * mu * inv_var).T
+        self._const = (mu * mu * inv_var).sum(axis=1) + np.log(var).sum(axis=1)
+        return self
+
+    def log_likelihood(self, X):
+        Z = (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+        dist = (Z * Z) @ self._quad + Z @ self._lin + self._const
+        return -0.5 * dist
+
+    def margins(self, X):
+        """Return (best_class, margin) for each row."""
+        ll = self.log_likelihood(X)
+        top2 = np.partition(ll, -2, axis=1)[:, -2:]
+        best = np.argmax(ll, axis=1)
+        return best, top2[:, 1] - top2[:, 0]
+
+    def calibrate(self, X, teacher_preds, target_agreement=1.0):
+        """
+        Pick the lowest margin threshold at which the rows answered by
+        stage 1 agree with the teacher at least `target_agreement` of
+        the time.
+        """
+        best, margin = self.margins(X)
+        agree = best == np.asarray(teacher_preds)
+
+        order = np.argsort(-margin, kind="stable")
+        errors = np.cumsum(~agree[order])
+        error_rate = errors / np.arange(1, len(order) + 1)
+        ok = np.flatnonzero(error_rate <= 1.0 - target_agreement + 1e-12)
+
+        if len(ok) == 0:
+            self.threshold = np.inf
+        else:
+            k = ok[-1]
+            # Stop before a tie that would sweep in a disagreeing row.
+            below = margin[order[k + 1]] if k + 1 < len(order) else -np.inf
+            self.threshold = float(margin[order[k]])
+            if below == self.threshold:
+                self.threshold = np.nextafter(self.threshold, np.inf)
+        return self.threshold
+
+    def predict(self, X, fallback):
+        """
+        Predict encoded labels. `fallback` is called with the rows that
+        stage 1 is not confident about and must return their labels.
+
+        Returns (preds, short_circuited_mask).
+        """
+        X = np.asarray(X, dtype=np.float64)
+        best, margin = self.margins(X)
+        confident = margin >= self.threshold
+        preds = best.copy()
+        if not confident.all():
+            preds[~confident] = np.asarray(fallback(X[~confident]))
+        return preds, confident
+
+
+def notebook_split(df, label_encoder, test_size=0.20):
+    """
+    (train, held_out) frames using the training notebook's split, so
+    XGBoost never saw the held_out rows.
+    """
+    from sklearn.model_selection import train_test_split
+
+    y = label_encoder.transform(df["label"])
+    return train_test_split(df, test_size=test_size, stratify=y, random_state=42)
+
+
+def fit_from_frame(df, label_encoder, model, target_agreement=1.0, calibration_df=None):
+    """
+    Fit stage 1 on a labelled DataFrame and calibrate its threshold
+    against the teacher on `calibration_df` (default: the same rows,
+    which overstates agreement if the teacher was trained on them).
+    """
+    X = df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    y = label_encoder.transform(df["label"])
+    cascade = GaussianCascade().fit(X, y, len(label_encoder.classes_))
+    X_cal = X if calibration_df is None else calibration_df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    teacher = model.predict(pd.DataFrame(X_cal, columns=FEATURE_COLUMNS))
+    cascade.calibrate(X_cal, teacher, target_agreement)
+    return cascade
+
+
+def _time_call(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start) / repeats, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate cascade inference on the held-out split.")
+    parser.add_argument("--csv", default="../model/Crop_recommendation.csv")
+    parser.add_argument("--model", default="crop_recommendation_model.joblib")
+    parser.add_argument("--target-agreement", type=float, default=1.0)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    artifacts = joblib.load(args.model)
+    model = artifacts["model"]
+    label_encoder = artifacts["label_encoder"]
+
+    # Same split as the training notebook; the held-out rows are halved
+    # into a calibration set (as the API uses) and an evaluation set
+    train_df, held_out = notebook_split(pd.read_csv(args.csv), label_encoder)
+    calibration_df, test_df = notebook_split(held_out, label_encoder, test_size=0.5)
+    y_test = label_encoder.transform(test_df["label"])
+
+    cascade = fit_from_frame(train_df, label_encoder, model, args.target_agreement, calibration_df)
+    X_test = test_df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+
+    def xgb_only():
+        return model.predict(pd.DataFrame(X_test, columns=FEATURE_COLUMNS))
+
+    def cascaded():
+        return cascade.predict(
+            X_test, lambda rows: model.predict(pd.DataFrame(rows, columns=FEATURE_COLUMNS))
+        )
+
+    xgb_time, xgb_pred = _time_call(xgb_only, args.repeats)
+    cascade_time, (cascade_pred, confident) = _time_call(cascaded, args.repeats)
+
+    xgb_acc = float(np.mean(xgb_pred == y_test))
+    cascade_acc = float(np.mean(cascade_pred == y_test))
+
+    print(f"Calibrated margin threshold: {cascade.threshold:.4f}")
+    print(f"Short-circuited fraction:    {confident.mean():.4f}")
+    print(f"XGBoost accuracy:            {xgb_acc:.4f}")
+    print(f"Cascade accuracy:            {cascade_acc:.4f}")
+    print(f"Accuracy loss:               {xgb_acc - cascade_acc:.4f}")
+    print(f"Agreement with XGBoost:      {np.mean(cascade_pred == xgb_pred):.4f}")
+    print(f"XGBoost time / batch:        {xgb_time * 1000:.3f} ms")
+    print(f"Cascade time / batch:        {cascade_time * 1000:.3f} ms")
+    print(f"Speedup:                     {xgb_time / cascade_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
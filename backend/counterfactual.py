@@ -0,0 +1,232 @@
+"""
+Counterfactual search: the smallest weighted change to the controllable
+inputs (N, P, K, ph) that makes the model recommend a target crop.
+
+The booster only ever compares a feature against its split thresholds,
+so between two consecutive thresholds the model output cannot change.
+Each feature therefore has a small, finite set of useful values: one
+per interval, chosen as close to the original value as the interval
+allows. A beam search moves one feature at a time to one of those
+values and scores all candidates of a step in a single predict_proba
+call. When the beam finds nothing, random restarts sample the bounds
+uniformly before giving up.
+
+The search is heuristic: found=False means no counterfactual was found
+within the search budget, not that the target crop is unreachable.
+"""
+import numpy as np
+
+CONTROLLABLE_FEATURES = ["N", "P", "K", "ph"]
+
+
+def split_thresholds(booster, n_features):
+    """
+    Collect the sorted unique split thresholds per input feature.
+
+    Thresholds are in the space the booster was trained on (after the
+    pipeline's preprocessor).
+    """
+    trees = booster.trees_to_dataframe()
+    splits = trees[trees["Feature"] != "Leaf"]
+    names = booster.feature_names or [f"f{i}" for i in range(n_features)]
+    index = {name: i for i, name in enumerate(names)}
+
+    thresholds = [np.empty(0) for _ in range(n_features)]
+    for name, group in splits.groupby("Feature"):
+        i = index[name]
+        thresholds[i] = np.unique(group["Split"].to_numpy(dtype=np.float64))
+    return thresholds
+
+
+def interval_representatives(x0, thresholds, low, high):
+    """
+    One value per threshold interval inside [low, high], each as close
+    to x0 as its interval allows. Splits send `x < t` left, so every
+    representative stays a hair below the upper edge of its interval.
+    """
+    inner = thresholds[(thresholds > low) & (thresholds < high)]
+    edges = np.concatenate([[low], inner, [high]])
+    lo, hi = edges[:-1], edges[1:]
+    nudge = np.minimum((hi - lo) * 1e-3, 1e-6 * np.maximum(1.0, np.abs(hi)))
+    upper = np.where(np.arange(len(hi)) == len(hi) - 1, hi, hi - nudge)
+    return np.unique(np.clip(x0, lo, upper))
+
+
+def _spread(values, x0, max_values):
+    """
+    Thin sorted `values` to at most `max_values`, spread evenly by rank
+    but always keeping the nearest value on each side of x0.
+    """
+    if len(values) <= max_values:
+        return values
+    picks = set(np.linspace(0, len(values) - 1, max_values - 2).round().astype(int).tolist())
+    pos = int(np.searchsorted(values, x0))
+    picks.update(i for i in (pos - 1, pos) if 0 <= i < len(values))
+    return values[sorted(picks)]
+
+
+def _expand(beam, cols, candidates):
+    """Every beam state with one feature moved to each candidate value."""
+    blocks = []
+    for c, values in zip(cols, candidates):
+        block = np.repeat(beam, len(values), axis=0)
+        block[:, c] = np.tile(values, len(beam))
+        blocks.append(block)
+    return np.vstack(blocks)
+
+
+def _dedupe(states, seen):
+    """Drop states already evaluated and remember the new ones."""
+    keys = [row.tobytes() for row in states]
+    fresh = np.array([key not in seen for key in keys], dtype=bool)
+    seen.update(key for key, is_new in zip(keys, fresh) if is_new)
+    return states[fresh]
+
+
+class CounterfactualSearch:
+    """Beam search over per-feature threshold intervals."""
+
+    def __init__(self, predict_proba, feature_columns, thresholds, bounds, scales):
+        """
+        predict_proba: callable taking a (n, n_features) raw matrix.
+        thresholds:    per-feature split thresholds in raw units.
+        bounds:        (low, high) arrays of allowed raw values.
+        scales:        per-feature unit of change (e.g. training std).
+        """
+        self.predict_proba = predict_proba
+        self.feature_columns = feature_columns
+        self.thresholds = thresholds
+        self.low, self.high = bounds
+        self.scales = np.where(np.asarray(scales) > 0, scales, 1.0)
+
+    def search(self, x0, target, features=None, weights=None, beam_width=4, max_steps=4,
+               max_values=16, restarts=4, restart_samples=512, seed=0):
+        """
+        Return a dict describing the cheapest counterfactual found.
+
+        Cost is sum(weight * |x - x0| / scale) over the changed features.
+        The beam explores at most `max_values` representatives per
+        feature. If it finds no hit, up to `restarts` rounds of
+        `restart_samples` uniform draws within the bounds are scored
+        (seeded, so answers are reproducible). The best hit is then
+        refined against every interval between it and the original
+        value.
+        """
+        features = features or CONTROLLABLE_FEATURES
+        cols = [self.feature_columns.index(f) for f in features]
+        weights = weights or {}
+        w = np.array([float(weights.get(f, 1.0)) for f in features]) / self.scales[cols]
+
+        x0 = np.asarray(x0, dtype=np.float64)
+        representatives = [
+            interval_representatives(x0[c], self.thresholds[c], self.low[c], self.high[c])
+            for c in cols
+        ]
+        coarse = [_spread(values, x0[c], max_values) for values, c in zip(representatives, cols)]
+
+        def cost(states):
+            return (np.abs(states[:, cols] - x0[cols]) * w).sum(axis=1)
+
+        proba0 = self.predict_proba(x0[None, :])[0]
+        best = {"state": None, "cost": np.inf, "probability": float(proba0[target])}
+        closest = {"state": x0, "probability": float(proba0[target])}
+        evaluated = 1
+        if proba0.argmax() == target:
+            best.update(state=x0.copy(), cost=0.0)
+            return self._result(best, closest, x0, evaluated)
+
+        def evaluate(states):
+            nonlocal evaluated
+            state_cost = cost(states)
+            keep = state_cost < best["cost"]
+            states, state_cost = states[keep], state_cost[keep]
+            if not len(states):
+                return states, state_cost, np.empty(0)
+            proba = self.predict_proba(states)
+            evaluated += len(states)
+            p_target = proba[:, target]
+            hits = np.flatnonzero(proba.argmax(axis=1) == target)
+            if len(hits):
+                i = hits[np.argmin(state_cost[hits])]
+                best.update(state=states[i], cost=float(state_cost[i]), probability=float(p_target[i]))
+            i = int(np.argmax(p_target))
+            if p_target[i] > closest["probability"]:
+                closest.update(state=states[i], probability=float(p_target[i]))
+            return states, state_cost, p_target
+
+        # Beam search: move one feature per step to a coarse value
+        beam = x0[None, :]
+        seen = {x0.tobytes()}
+        for _ in range(max_steps):
+            states = _dedupe(_expand(beam, cols, coarse), seen)
+            states, state_cost, p_target = evaluate(states)
+            if not len(states):
+                break
+
+            # Carry forward the states that look most promising per
+            # unit of change and are still cheaper than the best hit.
+            score = np.log(p_target + 1e-12) - state_cost
+            score[state_cost >= best["cost"]] = -np.inf
+            order = np.argsort(-score)[:beam_width]
+            beam = states[order[np.isfinite(score[order])]]
+            if not len(beam):
+                break
+
+        # Random restarts: the beam only sees coarse values and follows
+        # the target probability, which can stay flat until the state is
+        # already inside the target region.
+        rng = np.random.default_rng(seed)
+        for _ in range(restarts):
+            if best["state"] is not None:
+                break
+            states = np.repeat(x0[None, :], restart_samples, axis=0)
+            states[:, cols] = rng.uniform(self.low[cols], self.high[cols], (restart_samples, len(cols)))
+            evaluate(states)
+
+        # Refinement: pull each changed feature back towards x0 through
+        # every interval between the hit and the original value.
+        for _ in range(3):
+            if best["state"] is None:
+                break
+            previous = best["cost"]
+            anchor = best["state"]
+            blocks = []
+            for j, c in enumerate(cols):
+                lo, hi = sorted((x0[c], anchor[c]))
+                values = representatives[j]
+                values = values[(values >= lo) & (values <= hi) & (values != anchor[c])]
+                if len(values):
+                    block = np.repeat(anchor[None, :], len(values), axis=0)
+                    block[:, c] = values
+                    blocks.append(block)
+            if not blocks:
+                break
+            evaluate(np.vstack(blocks))
+            if best["cost"] >= previous:
+                break
+
+        return self._result(best, closest, x0, evaluated)
+
+    def _result(self, best, closest, x0, evaluated):
+        if best["state"] is None:
+            return {
+                "found": False,
+                "reason": "not found within search budget",
+                "evaluated": evaluated,
+                "closest": dict(zip(self.feature_columns, closest["state"].tolist())),
+                "target_probability": round(closest["probability"], 6)
+            }
+        state = best["state"]
+        changes = {
+            col: {"from": float(x0[i]), "to": float(state[i]), "delta": float(state[i] - x0[i])}
+            for i, col in enumerate(self.feature_columns)
+            if state[i] != x0[i]
+        }
+        return {
+            "found": True,
+            "counterfactual": dict(zip(self.feature_columns, state.tolist())),
+            "changes": changes,
+            "cost": round(best["cost"], 6),
+            "target_probability": round(best["probability"], 6),
+            "evaluated": evaluated
+        }
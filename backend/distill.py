@@ -0,0 +1,176 @@
+"""
+Distilled decision-tree model for ultra-low-latency predictions.
+
+The tuned XGBoost pipeline (the teacher) labels the training rows plus
+synthetic samples (jittered training rows and uniform draws over the
+feature ranges). A single decision tree (the student, depth 14 by
+default) is fitted to those labels and compiled into flat arrays, so a
+prediction is a few comparisons in plain Python with no sklearn or
+xgboost call.
+
+    python distill.py --csv ../model/Crop_recommendation.csv --out distilled_model.npz
+
+prints fidelity against the teacher, size in bytes and per-row latency.
+The API serves it with INFERENCE_MODE=distilled or /predict?mode=distilled,
+and refuses a file whose class list differs from the model's label
+encoder, so re-run this after retraining.
+"""
+import argparse
+import io
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+
+
+class CompiledTree:
+    """Decision tree stored as flat node arrays (leaf when feature < 0)."""
+
+    def __init__(self, feature, threshold, left, right, leaf_class, classes):
+        self.feature = np.asarray(feature, dtype=np.int8)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.leaf_class = np.asarray(leaf_class, dtype=np.uint8)
+        self.classes = np.asarray(classes)
+        # Python lists make the scalar walk several times faster than
+        # indexing numpy arrays element by element
+        self._nodes = list(zip(
+            self.feature.tolist(), self.threshold.tolist(),
+            self.left.tolist(), self.right.tolist(), self.leaf_class.tolist()
+        ))
+
+    @classmethod
+    def from_sklearn(cls, tree, classes):
+        t = tree.tree_
+        leaf = t.children_left == -1
+        return cls(
+            feature=np.where(leaf, -1, t.feature),
+            threshold=np.where(leaf, 0.0, t.threshold),
+            left=t.children_left,
+            right=t.children_right,
+            leaf_class=tree.classes_[t.value[:, 0, :].argmax(axis=1)],
+            classes=classes
+        )
+
+    def predict_one(self, row):
+        """Encoded class for one row given as a sequence of 7 floats."""
+        nodes = self._nodes
+        feature, threshold, left, right, leaf = nodes[0]
+        while feature >= 0:
+            # Same rule as sklearn: x <= threshold goes left
+            node = left if row[feature] <= threshold else right
+            feature, threshold, left, right, leaf = nodes[node]
+        return leaf
+
+    def predict(self, X):
+        """Encoded classes for a (n, 7) matrix, one tree level per step."""
+        X = np.asarray(X, dtype=np.float64)
+        node = np.zeros(len(X), dtype=np.int32)
+        rows = np.arange(len(X))
+        active = self.feature[node] >= 0
+        while active.any():
+            idx = rows[active]
+            n = node[idx]
+            go_left = X[idx, self.feature[n]] <= self.threshold[n]
+            node[idx] = np.where(go_left, self.left[n], self.right[n])
+            active[idx] = self.feature[node[idx]] >= 0
+        return self.leaf_class[node].astype(np.int64)
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer, feature=self.feature, threshold=self.threshold, left=self.left,
+            right=self.right, leaf_class=self.leaf_class, classes=self.classes.astype(str)
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["feature"], data["threshold"], data["left"], data["right"],
+                       data["leaf_class"], data["classes"])
+
+
+def synthetic_samples(X, n, rng, jitter=0.05):
+    """Half jittered training rows, half uniform over the feature ranges."""
+    low, high = X.min(axis=0), X.max(axis=0)
+    n_jitter = n // 2
+    base = X[rng.integers(0, len(X), n_jitter)]
+    jittered = base + rng.standard_normal(base.shape) * X.std(axis=0) * jitter
+    uniform = rng.uniform(low, high, size=(n - n_jitter, X.shape[1]))
+    return np.clip(np.vstack([jittered, uniform]), low, high)
+
+
+def distill(teacher, classes, X, n_synthetic=200_000, max_depth=14, seed=42):
+    from sklearn.tree import DecisionTreeClassifier
+
+    rng = np.random.default_rng(seed)
+    X_train = np.vstack([X, synthetic_samples(X, n_synthetic, rng)])
+    y_train = teacher.predict(pd.DataFrame(X_train, columns=FEATURE_COLUMNS))
+    student = DecisionTreeClassifier(max_depth=max_depth, random_state=seed)
+    student.fit(X_train, y_train)
+    return CompiledTree.from_sklearn(student, classes)
+
+
+def _per_row_latency(fn, rows, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for row in rows:
+            fn(row)
+        best = min(best, (time.perf_counter() - start) / len(rows))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil the XGBoost pipeline into a compact decision tree.")
+    parser.add_argument("--model", default="crop_recommendation_model.joblib")
+    parser.add_argument("--csv", default="../model/Crop_recommendation.csv")
+    parser.add_argument("--out", default="distilled_model.npz")
+    parser.add_argument("--synthetic", type=int, default=200_000)
+    parser.add_argument("--max-depth", type=int, default=14)
+    args = parser.parse_args()
+
+    artifacts = joblib.load(args.model)
+    teacher = artifacts["model"]
+    classes = artifacts["label_encoder"].classes_
+    X = pd.read_csv(args.csv)[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+
+    tree = distill(teacher, classes, X, args.synthetic, args.max_depth)
+    blob = tree.to_bytes()
+    with open(args.out, "wb") as f:
+        f.write(blob)
+
+    # Fidelity on the dataset and on fresh synthetic samples
+    X_eval = synthetic_samples(X, 50_000, np.random.default_rng(7))
+    for name, data in (("dataset", X), ("synthetic", X_eval)):
+        teacher_pred = teacher.predict(pd.DataFrame(data, columns=FEATURE_COLUMNS))
+        fidelity = np.mean(tree.predict(data) == teacher_pred)
+        print(f"Fidelity vs teacher ({name:9s}): {fidelity:.4f}")
+
+    # Scalar and vectorized paths must agree
+    sample = X[:500]
+    assert all(tree.predict_one(r) == p for r, p in zip(sample.tolist(), tree.predict(sample)))
+
+    teacher_latency = _per_row_latency(
+        lambda r: teacher.predict(pd.DataFrame([r], columns=FEATURE_COLUMNS)), sample[:100].tolist()
+    )
+    student_latency = _per_row_latency(tree.predict_one, sample.tolist())
+    start = time.perf_counter()
+    tree.predict(X_eval)
+    batch_latency = (time.perf_counter() - start) / len(X_eval)
+
+    print(f"Nodes:                          {len(tree.feature)}")
+    print(f"Size on disk:                   {len(blob):,} bytes")
+    print(f"Teacher latency (single row):   {teacher_latency * 1e6:,.1f} us")
+    print(f"Distilled latency (single row): {student_latency * 1e6:,.2f} us")
+    print(f"Distilled latency (batched):    {batch_latency * 1e9:,.1f} ns/row")
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Feature-drift monitoring against the training distribution.
+
+Baseline statistics (mean, variance and quantile-bin histograms per
+feature) are computed once from model/Crop_recommendation.csv. Every
+scored row then updates running Welford means/variances and fixed-bin
+histogram counts, which is a constant amount of work per row. The
+drift report compares the two with:
+
+    PSI  population stability index over the baseline bins
+    KS   max distance between the binned CDFs (a lower bound on the
+         exact two-sample KS statistic at this bin resolution)
+"""
+import threading
+
+import numpy as np
+
+from features import FEATURE_COLUMNS
+
+N_BINS = 20
+
+# Usual PSI rules of thumb
+PSI_WARNING = 0.1
+PSI_DRIFT = 0.25
+
+# Floor for empty bins so PSI stays finite
+PSI_EPSILON = 1e-4
+
+
+class BaselineStats:
+    """Training-set reference for each feature."""
+
+    def __init__(self, features, n_bins=N_BINS):
+        features = np.asarray(features, dtype=np.float64)
+        self.mean = features.mean(axis=0)
+        self.var = features.var(axis=0)
+
+        # Quantile edges give roughly equal baseline mass per bin; the
+        # outer bins are open-ended so out-of-range values still count.
+        quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+        self.edges = [np.unique(np.quantile(features[:, j], quantiles)) for j in range(features.shape[1])]
+        self.proportions = [
+            _bin_counts(features[:, j], edges) / len(features) for j, edges in enumerate(self.edges)
+        ]
+
+
+def _bin_counts(values, edges):
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+
+class FeatureDriftMonitor:
+    """Streaming per-feature statistics compared against a baseline."""
+
+    def __init__(self, baseline, min_samples=100):
+        self.baseline = baseline
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        n_features = len(self.baseline.edges)
+        with self._lock:
+            self.count = 0
+            self.mean = np.zeros(n_features)
+            self.m2 = np.zeros(n_features)
+            self.counts = [np.zeros(len(edges) + 1, dtype=np.int64) for edges in self.baseline.edges]
+
+    def update(self, features):
+        """Fold a (n, 7) batch into the running statistics."""
+        features = np.asarray(features, dtype=np.float64)
+        features = features[np.isfinite(features).all(axis=1)]
+        n = len(features)
+        if not n:
+            return
+
+        batch_mean = features.mean(axis=0)
+        batch_m2 = ((features - batch_mean) ** 2).sum(axis=0)
+        batch_counts = [_bin_counts(features[:, j], edges) for j, edges in enumerate(self.baseline.edges)]
+
+        with self._lock:
+            # Chan et al. parallel form of Welford's update
+            total = self.count + n
+            delta = batch_mean - self.mean
+            self.mean += delta * n / total
+            self.m2 += batch_m2 + delta * delta * self.count * n / total
+            self.count = total
+            for counts, new in zip(self.counts, batch_counts):
+                counts += new
+
+    def report(self):
+        """Per-feature drift scores and an overall status."""
+        with self._lock:
+            count = self.count
+            mean = self.mean.copy()
+            var = self.m2 / count if count else np.zeros_like(self.m2)
+            counts = [c.copy() for c in self.counts]
+
+        features = {}
+        for j, name in enumerate(FEATURE_COLUMNS):
+            expected = self.baseline.proportions[j]
+            entry = {
+                "mean": round(float(mean[j]), 6),
+                "std": round(float(np.sqrt(var[j])), 6),
+                "baseline_mean": round(float(self.baseline.mean[j]), 6),
+                "baseline_std": round(float(np.sqrt(self.baseline.var[j])), 6),
+                "mean_shift_std": None,
+                "psi": None,
+                "ks": None
+            }
+            if count:
+                actual = counts[j] / count
+                e = np.maximum(expected, PSI_EPSILON)
+                a = np.maximum(actual, PSI_EPSILON)
+                entry["psi"] = round(float(((a - e) * np.log(a / e)).sum()), 6)
+                entry["ks"] = round(float(np.abs(np.cumsum(actual) - np.cumsum(expected)).max()), 6)
+                baseline_std = np.sqrt(self.baseline.var[j]) or 1.0
+                entry["mean_shift_std"] = round(float((mean[j] - self.baseline.mean[j]) / baseline_std), 6)
+            features[name] = entry
+
+        psi_values = [f["psi"] for f in features.values() if f["psi"] is not None]
+        max_psi = max(psi_values) if psi_values else 0.0
+        if count < self.min_samples:
+            status = "insufficient_data"
+        elif max_psi >= PSI_DRIFT:
+            status = "drift"
+        elif max_psi >= PSI_WARNING:
+            status = "warning"
+        else:
+            status = "ok"
+
+        return {
+            "samples": count,
+            "status": status,
+            "max_psi": round(max_psi, 6),
+            "features": features
+        }
@@ -0,0 +1,7 @@
+"""
+Model input columns, shared by the API and the offline tools.
+
+This is the column order the training notebook fitted the pipeline on;
+every feature matrix in the backend is laid out in it.
+"""
+FEATURE_COLUMNS = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
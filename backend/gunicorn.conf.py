@@ -0,0 +1,59 @@
+"""
+Gunicorn settings driven by the serving profile (see serving_config.py).
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Listens on PORT and, when UNIX_SOCKET is set, also on that Unix domain
+socket.
+"""
+import os
+import sys
+
+# Gunicorn loads this file before the app directory is on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from serving_config import apply_thread_limits, load_profile, pin_worker
+
+profile = load_profile()
+apply_thread_limits(profile)
+
+bind = [f"0.0.0.0:{os.environ.get('PORT', '8000')}"]
+# A frontend on the same host can skip TCP: UNIX_SOCKET=/tmp/crop-api.sock
+# here and BACKEND_UNIX_SOCKET=/tmp/crop-api.sock in the frontend
+if os.environ.get("UNIX_SOCKET"):
+    bind.append(f"unix:{os.environ['UNIX_SOCKET']}")
+workers = profile["workers"]
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+# gthread keeps idle keep-alive connections in its poller, not on a
+# thread, so holding them open for a pooled client costs only a file
+# descriptor (gunicorn's default is 2 seconds)
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "75"))
+
+
+# CPU slot -> worker holding it, kept in the arbiter. A respawned worker
+# takes the lowest free slot, i.e. the CPU block of the one it replaces.
+cpu_slots = {}
+
+
+def pre_fork(server, worker):
+    slot = next(i for i in range(len(cpu_slots) + 1) if i not in cpu_slots)
+    cpu_slots[slot] = worker
+    worker.cpu_slot = slot
+
+
+def release_cpu_slot(server, worker):
+    for slot, holder in list(cpu_slots.items()):
+        if holder is worker:
+            del cpu_slots[slot]
+
+
+# The arbiter calls child_exit when it reaps a worker, and worker_exit
+# for one that vanished before it could be reaped
+child_exit = worker_exit = release_cpu_slot
+
+
+def post_fork(server, worker):
+    cpus = pin_worker(worker.cpu_slot, profile)
+    if cpus:
+        server.log.info("Worker %s pinned to CPUs %s (slot %s)", worker.pid, cpus, worker.cpu_slot)
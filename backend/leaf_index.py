@@ -0,0 +1,231 @@
+"""
+Leaf-region index: exact lookups compiled from the XGBoost ensemble.
+
+Every tree compares a feature against one of that feature's split
+thresholds, so the thresholds of the whole ensemble cut the 7-D input
+space into a grid of cells. Two rows in the same cell follow the same
+path through every tree and therefore get the same prediction. The
+index bins a row with one np.searchsorted per feature and looks the
+cell up in a bounded LRU table. Only a miss runs the booster, once per
+cell.
+
+Binning happens in the booster's own input space: the pipeline's
+StandardScaler output cast to float32, the precision XGBoost compares
+at. Splits send `x < t` left, so a value equal to a threshold belongs
+to the cell above it (side="right"). This makes the index exact, not an
+approximation. Rows with missing or infinite values skip the index and
+go straight to the booster.
+
+    python leaf_index.py --csv ../model/Crop_recommendation.csv
+
+checks agreement with the booster and reports cell counts, memory and
+latency.
+"""
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+
+# Rough per-cell cost of the table: key bytes object, int value and the
+# OrderedDict entry
+BYTES_PER_CELL = 200
+
+
+def tree_thresholds(booster, n_features):
+    """
+    Sorted unique float32 split thresholds per feature, read from the
+    model JSON so they match the values the booster compares against
+    bit for bit.
+    """
+    model = json.loads(booster.save_raw("json"))
+    trees = model["learner"]["gradient_booster"]["model"]["trees"]
+    collected = [[] for _ in range(n_features)]
+    for tree in trees:
+        left = np.asarray(tree["left_children"])
+        feature = np.asarray(tree["split_indices"])[left != -1]
+        condition = np.asarray(tree["split_conditions"], dtype=np.float32)[left != -1]
+        for j in np.unique(feature):
+            collected[j].append(condition[feature == j])
+    return [np.unique(np.concatenate(c)) if c else np.empty(0, dtype=np.float32) for c in collected]
+
+
+class LeafRegionIndex:
+    """Threshold grid plus an LRU table of cell -> encoded class."""
+
+    def __init__(self, thresholds, mean, scale, predict_transformed, max_cells=200_000):
+        self.thresholds = [np.asarray(t, dtype=np.float32) for t in thresholds]
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.predict_transformed = predict_transformed
+        self.max_cells = max_cells
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._cells = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pipeline(cls, model, feature_columns, max_cells=200_000):
+        """
+        Build from the training pipeline. The preprocessor must be the
+        single StandardScaler ("num") over feature_columns that the
+        notebook fits.
+        """
+        preprocessor = model.named_steps["preprocessor"]
+        transformers = [t for t in preprocessor.transformers_ if t[0] != "remainder"]
+        if len(transformers) != 1 or list(transformers[0][2]) != list(feature_columns):
+            raise ValueError("Leaf index needs a single scaler over the feature columns")
+        scaler = transformers[0][1]
+        classifier = model.named_steps["classifier"]
+        thresholds = tree_thresholds(classifier.get_booster(), len(feature_columns))
+        return cls(thresholds, scaler.mean_, scaler.scale_, classifier.predict, max_cells)
+
+    def __len__(self):
+        return len(self._cells)
+
+    def transform(self, features):
+        """Raw rows -> booster input space (what the pipeline feeds XGBoost)."""
+        return ((np.asarray(features, dtype=np.float64) - self.mean) / self.scale).astype(np.float32)
+
+    def cell_ids(self, transformed):
+        """(n, 7) int32 bin index per feature."""
+        return np.stack([
+            np.searchsorted(t, transformed[:, j], side="right")
+            for j, t in enumerate(self.thresholds)
+        ], axis=1).astype(np.int32)
+
+    def predict(self, features):
+        """Encoded classes for a (n, 7) raw feature matrix."""
+        transformed = self.transform(features)
+        preds = np.empty(len(transformed), dtype=np.int64)
+
+        finite = np.isfinite(transformed).all(axis=1)
+        if not finite.all():
+            preds[~finite] = self.predict_transformed(transformed[~finite])
+            with self._lock:
+                self.bypassed += int((~finite).sum())
+        rows = np.flatnonzero(finite)
+        if not len(rows):
+            return preds
+
+        cells = self.cell_ids(transformed[rows])
+        if len(rows) == 1:
+            first = inverse = np.zeros(1, dtype=np.int64)
+        else:
+            cells, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+        keys = [cell.tobytes() for cell in cells]
+        values = np.empty(len(keys), dtype=np.int64)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._cells.get(key)
+                if value is None:
+                    missing.append(i)
+                else:
+                    self._cells.move_to_end(key)
+                    values[i] = value
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # Any row of a cell represents it exactly; use the first one
+            values[missing] = self.predict_transformed(transformed[rows[first[missing]]])
+            with self._lock:
+                for i in missing:
+                    self._cells[keys[i]] = int(values[i])
+                while len(self._cells) > self.max_cells:
+                    self._cells.popitem(last=False)
+
+        preds[rows] = values[inverse.reshape(-1)]
+        return preds
+
+    def warm(self, features):
+        """Precompute the cells occupied by `features` (e.g. the training set)."""
+        self.predict(features)
+
+    def stats(self):
+        with self._lock:
+            cells, hits, misses, bypassed = len(self._cells), self.hits, self.misses, self.bypassed
+        return {
+            "thresholds_per_feature": [len(t) for t in self.thresholds],
+            "grid_cells_log10": round(float(sum(np.log10(len(t) + 1) for t in self.thresholds)), 2),
+            "cells": cells,
+            "max_cells": self.max_cells,
+            "approx_bytes": cells * BYTES_PER_CELL,
+            "hits": hits,
+            "misses": misses,
+            "bypassed": bypassed
+        }
+
+
+def _per_row_latency(fn, rows, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for row in rows:
+            fn(row)
+        best = min(best, (time.perf_counter() - start) / len(rows))
+    return best
+
+
+def main():
+    from distill import synthetic_samples
+
+    parser = argparse.ArgumentParser(description="Benchmark the leaf-region index against the booster.")
+    parser.add_argument("--model", default="crop_recommendation_model.joblib")
+    parser.add_argument("--csv", default="../model/Crop_recommendation.csv")
+    parser.add_argument("--samples", type=int, default=50_000)
+    parser.add_argument("--max-cells", type=int, default=200_000)
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)["model"]
+    X = pd.read_csv(args.csv)[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+
+    start = time.perf_counter()
+    index = LeafRegionIndex.from_pipeline(model, FEATURE_COLUMNS, args.max_cells)
+    compile_s = time.perf_counter() - start
+    start = time.perf_counter()
+    index.warm(X)
+    warm_s = time.perf_counter() - start
+
+    stats = index.stats()
+    print(f"Thresholds per feature:  {stats['thresholds_per_feature']}")
+    print(f"Grid size:               10^{stats['grid_cells_log10']} cells, {stats['cells']} occupied by the dataset")
+    print(f"Compile / warm:          {compile_s:.2f} s / {warm_s:.2f} s")
+
+    # Exactness: every row must match the pipeline's own prediction
+    X_eval = synthetic_samples(X, args.samples, np.random.default_rng(7))
+    for name, data in (("dataset", X), ("synthetic", X_eval)):
+        expected = model.predict(pd.DataFrame(data, columns=FEATURE_COLUMNS))
+        mismatches = int((index.predict(data) != expected).sum())
+        print(f"Mismatches ({name:9s}):   {mismatches} of {len(data)}")
+    print(f"Cells after evaluation:  {len(index)} (~{len(index) * BYTES_PER_CELL / 1e6:.1f} MB)")
+
+    sample = X[:200]
+    booster_latency = _per_row_latency(
+        lambda r: model.predict(pd.DataFrame([r], columns=FEATURE_COLUMNS)), sample[:100]
+    )
+    index_latency = _per_row_latency(lambda r: index.predict(r[None, :]), sample)
+    start = time.perf_counter()
+    model.predict(pd.DataFrame(X_eval, columns=FEATURE_COLUMNS))
+    booster_batch = (time.perf_counter() - start) / len(X_eval)
+    start = time.perf_counter()
+    index.predict(X_eval)
+    index_batch = (time.perf_counter() - start) / len(X_eval)
+
+    print(f"Booster latency (single row):  {booster_latency * 1e6:,.1f} us")
+    print(f"Index latency (single row):    {index_latency * 1e6:,.1f} us")
+    print(f"Booster batch:                 {booster_batch * 1e6:,.2f} us/row")
+    print(f"Index batch (warm cells):      {index_batch * 1e6:,.2f} us/row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+"Similar fields" lookup: k nearest real samples to a field.
+
+A KD-tree is built once over standardized features of the training
+dataset (and, optionally, a CSV of stored production inputs labelled
+with their recommended crop). Queries are batched, so scoring a whole
+uploaded CSV is a single tree traversal call.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from features import FEATURE_COLUMNS
+
+MAX_K = 50
+
+
+class SimilarFieldsIndex:
+    """KD-tree over standardized N/P/K/climate features."""
+
+    def __init__(self, frames, leaf_size=40):
+        """
+        `frames` is a list of (source_name, DataFrame) pairs. Each frame
+        must have the feature columns plus a `label` column.
+        """
+        features, labels, sources, rows = [], [], [], []
+        for source, df in frames:
+            features.append(df[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+            labels.append(df["label"].astype(str).to_numpy())
+            sources.append(np.full(len(df), source, dtype=object))
+            rows.append(np.arange(len(df)))
+
+        self.features = np.vstack(features)
+        self.labels = np.concatenate(labels)
+        self.sources = np.concatenate(sources)
+        self.source_rows = np.concatenate(rows)
+
+        self.mean_ = self.features.mean(axis=0)
+        self.scale_ = self.features.std(axis=0)
+        self.scale_[self.scale_ == 0] = 1.0
+        self.tree = KDTree(self._standardize(self.features), leaf_size=leaf_size)
+
+    def __len__(self):
+        return len(self.features)
+
+    def _standardize(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+    def query(self, X, k=5):
+        """
+        Return (distances, indices) of shape (n, k). Distances are
+        Euclidean in standardized feature space.
+        """
+        k = max(1, min(int(k), MAX_K, len(self)))
+        return self.tree.query(self._standardize(X), k=k)
+
+    def neighbors(self, X, k=5):
+        """Return one list of neighbor dicts per query row."""
+        distances, indices = self.query(X, k)
+        results = []
+        for dist_row, idx_row in zip(distances, indices):
+            results.append([
+                {
+                    "source": self.sources[i],
+                    "row": int(self.source_rows[i]),
+                    "label": self.labels[i],
+                    "distance": round(float(d), 6),
+                    **dict(zip(FEATURE_COLUMNS, self.features[i].tolist()))
+                }
+                for d, i in zip(dist_row, idx_row)
+            ])
+        return results
+
+
+def build_index(dataset_path, production_path=None):
+    """Build the index from the training CSV and an optional production CSV."""
+    frames = [("training", pd.read_csv(dataset_path))]
+    if production_path:
+        production = pd.read_csv(production_path)
+        if "label" not in production.columns and "recommended_crop" in production.columns:
+            production = production.rename(columns={"recommended_crop": "label"})
+        frames.append(("production", production))
+    return SimilarFieldsIndex(frames)
@@ -0,0 +1,69 @@
+"""
+Quantized prediction cache shared by the prediction and explanation
+endpoints.
+
+Keys are the input rows rounded to a fixed number of decimals, so two
+requests that differ only below that resolution hit the same entry and
+get the answer computed for whichever of them was scored first. Each
+entry is a small dict, so /predict can store the class while /explain
+adds the feature contributions for the same row. Fields are named after
+their producer (pred_xgb, pred_cascade, contribs) so answers from
+different models never stand in for one another.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class QuantizedPredictionCache:
+    """Thread-safe LRU keyed by quantized feature rows."""
+
+    def __init__(self, max_entries=100_000, decimals=4):
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def quantize(self, features):
+        """Round a (n, 7) matrix to the cache resolution."""
+        return np.round(np.asarray(features, dtype=np.float64), self.decimals)
+
+    @staticmethod
+    def keys(quantized):
+        # +0.0 folds -0.0 into 0.0 so both hash to the same bytes
+        return [row.tobytes() for row in np.ascontiguousarray(quantized + 0.0)]
+
+    def get_many(self, keys, field):
+        """Return the cached `field` for each key (None when absent)."""
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and field in entry:
+                    self._entries.move_to_end(key)
+                    values.append(entry[field])
+                else:
+                    values.append(None)
+        return values
+
+    def put_many(self, keys, **fields):
+        """Merge per-key field values (each a sequence aligned with keys)."""
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = {}
+                else:
+                    self._entries.move_to_end(key)
+                for name, values in fields.items():
+                    entry[name] = values[i]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,322 @@
+"""
+Append-only binary prediction log.
+
+Every scored row becomes one fixed-width little-endian record:
+
+    timestamp_ns   int64    unix time in nanoseconds
+    features       7 x f32  N, P, K, temperature, humidity, ph, rainfall
+    class_index    int16    encoded prediction
+    model_version  uint32   CRC32 of the model artifact
+    latency_us     uint32   request latency in microseconds
+
+The request thread only enqueues a numpy record array. A background
+thread writes queued records in batches and fsyncs once per batch, and
+starts a new segment file when the current one passes the size limit.
+A failed write (disk full, directory removed) drops that batch, is
+logged, and the next batch goes to a fresh segment; after
+max_write_failures consecutive failures the log disables itself and
+drops every further row, all of which /metrics reports.
+
+Tools:
+
+    python prediction_log.py to-parquet --dir logs --out predictions.parquet
+    python prediction_log.py replay --dir logs --url http://127.0.0.1:8000 --concurrency 8
+"""
+import argparse
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp_ns", "<i8"),
+    ("features", "<f4", (len(FEATURE_COLUMNS),)),
+    ("class_index", "<i2"),
+    ("model_version", "<u4"),
+    ("latency_us", "<u4"),
+])
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CRPLOG01"
+HEADER = MAGIC + np.uint32(RECORD_DTYPE.itemsize).astype("<u4").tobytes()
+SEGMENT_GLOB = "predictions-*.bin"
+
+
+def file_version(path):
+    """CRC32 of a file, used as the model_version field."""
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class PredictionLogWriter:
+    """Size-rotated segment writer fed from a background thread."""
+
+    def __init__(self, directory, model_version, segment_bytes=64 << 20,
+                 flush_interval=0.5, max_pending_records=1_000_000, max_write_failures=5):
+        self.directory = directory
+        self.model_version = model_version
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.max_pending_records = max_pending_records
+        self.max_write_failures = max_write_failures
+
+        self.written = 0
+        self.dropped = 0
+        self.segments = 0
+        self.write_errors = 0
+        self.last_error = None
+        self.disabled = False
+        self._consecutive_failures = 0
+        self._pending = 0
+        # Guards _pending and dropped, which request threads update
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._file = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+
+    def append(self, features, class_index, latency_s):
+        """
+        Queue one record per row. Never blocks on I/O: when the backlog
+        would exceed max_pending_records the rows are counted as dropped
+        instead.
+        """
+        n = len(class_index)
+        with self._lock:
+            if self.disabled or self._pending + n > self.max_pending_records:
+                self.dropped += n
+                return
+            self._pending += n
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        records["timestamp_ns"] = time.time_ns()
+        records["features"] = features
+        records["class_index"] = class_index
+        records["model_version"] = self.model_version
+        records["latency_us"] = min(int(latency_s * 1e6), 0xFFFFFFFF)
+        self._queue.put(records)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        name = f"predictions-{time.time_ns()}-{self.segments:06d}.bin"
+        self._file = open(os.path.join(self.directory, name), "ab")
+        self._file.write(HEADER)
+        self.segments += 1
+
+    def _drain(self):
+        batches = []
+        while True:
+            try:
+                batches.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batches:
+            return
+
+        records = np.concatenate(batches)
+        with self._lock:
+            self._pending -= len(records)
+        try:
+            if self._file is None or self._file.tell() >= self.segment_bytes:
+                self._open_segment()
+            self._file.write(records.tobytes())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            self._write_failed(e, len(records))
+            return
+        self._consecutive_failures = 0
+        self.written += len(records)
+
+    def _write_failed(self, error, n_records):
+        """
+        Count the batch as dropped and abandon the segment, which may now
+        end in a torn record; the next batch opens a new one.
+        """
+        self.write_errors += 1
+        self.last_error = str(error)
+        self._consecutive_failures += 1
+        with self._lock:
+            self.dropped += n_records
+            if self._consecutive_failures >= self.max_write_failures:
+                self.disabled = True
+        logger.error("Prediction log write failed, dropped %d records: %s", n_records, error)
+        if self.disabled:
+            logger.error("Prediction log disabled after %d consecutive write failures", self._consecutive_failures)
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._drain()
+            if self.disabled:
+                # Release anything queued before append() saw the flag
+                self._discard()
+        self._drain()
+        if self._file is not None:
+            self._file.close()
+
+    def _discard(self):
+        n = 0
+        while True:
+            try:
+                n += len(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._pending -= n
+            self.dropped += n
+
+
+# --------------------------------------------------
+# Reading segments
+# --------------------------------------------------
+def read_segment(path):
+    """Records of one segment; a torn trailing record is ignored."""
+    with open(path, "rb") as f:
+        header = f.read(len(HEADER))
+        if header != HEADER:
+            raise ValueError(f"{path}: not a prediction log segment (or record layout changed)")
+        data = f.read()
+    usable = len(data) - len(data) % RECORD_DTYPE.itemsize
+    return np.frombuffer(data[:usable], dtype=RECORD_DTYPE)
+
+
+def read_log(directory):
+    paths = sorted(glob.glob(os.path.join(directory, SEGMENT_GLOB)))
+    if not paths:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.concatenate([read_segment(p) for p in paths])
+
+
+def records_to_frame(records, classes=None):
+    df = pd.DataFrame(records["features"], columns=FEATURE_COLUMNS)
+    df.insert(0, "timestamp", pd.to_datetime(records["timestamp_ns"], unit="ns", utc=True))
+    df["class_index"] = records["class_index"]
+    if classes is not None:
+        df["recommended_crop"] = np.asarray(classes)[records["class_index"]]
+    df["model_version"] = records["model_version"]
+    df["latency_us"] = records["latency_us"]
+    return df
+
+
+def parquet_engine_available():
+    """pandas writes Parquet through pyarrow or fastparquet."""
+    for module in ("pyarrow", "fastparquet"):
+        try:
+            __import__(module)
+            return True
+        except ImportError:
+            pass
+    return False
+
+
+def to_parquet(directory, out, model_path=None):
+    classes = None
+    if model_path and os.path.exists(model_path):
+        import joblib
+        classes = joblib.load(model_path)["label_encoder"].classes_
+    df = records_to_frame(read_log(directory), classes)
+    df.to_parquet(out, index=False)
+    print(f"Wrote {len(df)} records to {out}")
+
+
+def replay(directory, url, concurrency=8, limit=None, model_path=None):
+    """
+    Replay logged inputs against /predict as a benchmark. Reports
+    throughput, latency percentiles and, when the artifact is available
+    to name the classes, agreement with the logged predictions.
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+
+    records = read_log(directory)
+    if limit:
+        records = records[:limit]
+    if not len(records):
+        print("No records to replay")
+        return
+
+    session = requests.Session()
+    endpoint = url.rstrip("/") + "/predict"
+
+    def send(i):
+        payload = dict(zip(FEATURE_COLUMNS, records["features"][i].astype(float).tolist()))
+        start = time.perf_counter()
+        resp = session.post(endpoint, json=payload, timeout=20)
+        elapsed = time.perf_counter() - start
+        crop = resp.json().get("recommended_crop") if resp.status_code == 200 else None
+        return elapsed, crop
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(len(records))))
+    wall = time.perf_counter() - start
+
+    latencies = np.array([elapsed for elapsed, _ in results]) * 1000
+    crops = [crop for _, crop in results]
+    errors = sum(1 for crop in crops if crop is None)
+
+    print(f"Replayed {len(records)} requests in {wall:.2f}s ({len(records) / wall:.1f} req/s), {errors} errors")
+    print(f"Latency p50 {np.percentile(latencies, 50):.2f} ms, "
+          f"p95 {np.percentile(latencies, 95):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+
+    if model_path and os.path.exists(model_path):
+        import joblib
+        classes = joblib.load(model_path)["label_encoder"].classes_
+        agree = np.mean([crop == classes[c] for crop, c in zip(crops, records["class_index"])])
+        print(f"Agreement with logged predictions: {agree:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction log tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("to-parquet", help="Convert log segments to a Parquet file")
+    p.add_argument("--dir", required=True)
+    p.add_argument("--out", required=True)
+    p.add_argument("--model", default="crop_recommendation_model.joblib",
+                   help="Artifact used to add crop names (optional)")
+
+    p = sub.add_parser("replay", help="Replay logged inputs against the API as a benchmark")
+    p.add_argument("--dir", required=True)
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--limit", type=int, default=None)
+    p.add_argument("--model", default="crop_recommendation_model.joblib",
+                   help="Artifact used to check agreement (optional)")
+
+    args = parser.parse_args()
+    if args.command == "to-parquet":
+        if not parquet_engine_available():
+            parser.exit(1, "error: to-parquet needs pyarrow (pip install pyarrow) or fastparquet\n")
+        to_parquet(args.dir, args.out, args.model)
+    else:
+        replay(args.dir, args.url, args.concurrency, args.limit, args.model)
+
+
+if __name__ == "__main__":
+    main()
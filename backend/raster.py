@@ -0,0 +1,295 @@
+"""
+Crop-suitability maps from gridded feature layers.
+
+Input is either one .npy stack of shape (7, H, W) in FEATURE_COLUMNS
+order, or a directory holding one (H, W) .npy file per feature
+(N.npy, P.npy, ...). Layers are opened memory-mapped and scored tile by
+tile on a process pool; each worker writes its tile straight into two
+output rasters:
+
+    class_index.npy       uint8,   255 where any input is NaN (nodata)
+    max_probability.npy   float32, NaN where nodata
+
+Completed tiles are appended to progress.txt, so re-running the same
+command after an interruption only scores the missing tiles. meta.json
+records the size and mtime of every input layer and a hash of the
+model; a re-run whose inputs differ is refused rather than resumed into
+a mixed raster (pass --overwrite to start over).
+
+    python raster.py --features district.npy --out runs/district --tile 512 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+
+NODATA_CLASS = 255
+
+CLASS_RASTER = "class_index.npy"
+PROBABILITY_RASTER = "max_probability.npy"
+PROGRESS_FILE = "progress.txt"
+META_FILE = "meta.json"
+
+
+def open_feature_stack(path):
+    """Return a list of 7 memory-mapped (H, W) layers."""
+    if os.path.isdir(path):
+        layers = [np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r") for col in FEATURE_COLUMNS]
+    else:
+        stack = np.load(path, mmap_mode="r")
+        if stack.ndim != 3 or stack.shape[0] != len(FEATURE_COLUMNS):
+            raise ValueError(f"Expected a (7, H, W) stack, got shape {stack.shape}")
+        layers = [stack[i] for i in range(len(FEATURE_COLUMNS))]
+
+    shapes = {layer.shape for layer in layers}
+    if len(shapes) != 1:
+        raise ValueError(f"Feature layers have different shapes: {sorted(shapes)}")
+    return layers
+
+
+def feature_files(path):
+    """The .npy files behind a feature stack path."""
+    if os.path.isdir(path):
+        return [os.path.join(path, f"{col}.npy") for col in FEATURE_COLUMNS]
+    return [path]
+
+
+def input_fingerprint(features_path, model_path):
+    """
+    Identify the inputs of a run: (name, size, mtime_ns) per feature file
+    and a SHA-256 of the model artifact.
+    """
+    files = []
+    for path in feature_files(features_path):
+        stat = os.stat(path)
+        files.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"features": files, "model_sha256": digest.hexdigest()}
+
+
+def tile_grid(height, width, tile):
+    """Yield (row, col, r0, r1, c0, c1) for each tile."""
+    for row, r0 in enumerate(range(0, height, tile)):
+        for col, c0 in enumerate(range(0, width, tile)):
+            yield row, col, r0, min(r0 + tile, height), c0, min(c0 + tile, width)
+
+
+# --------------------------------------------------
+# Worker process state
+# --------------------------------------------------
+_worker = {}
+
+
+def _init_worker(model_path, features_path, out_dir):
+    artifacts = joblib.load(model_path)
+    model = artifacts["model"]
+    # One thread per process: the pool provides the parallelism
+    model.named_steps["classifier"].set_params(n_jobs=1)
+    _worker["model"] = model
+    _worker["layers"] = open_feature_stack(features_path)
+    _worker["classes"] = np.load(os.path.join(out_dir, CLASS_RASTER), mmap_mode="r+")
+    _worker["probability"] = np.load(os.path.join(out_dir, PROBABILITY_RASTER), mmap_mode="r+")
+
+
+def _score_tile(bounds):
+    r0, r1, c0, c1 = bounds
+    block = np.stack([layer[r0:r1, c0:c1] for layer in _worker["layers"]], axis=-1)
+    rows = block.reshape(-1, len(FEATURE_COLUMNS)).astype(np.float64)
+    valid = ~np.isnan(rows).any(axis=1)
+
+    classes = np.full(len(rows), NODATA_CLASS, dtype=np.uint8)
+    probability = np.full(len(rows), np.nan, dtype=np.float32)
+    if valid.any():
+        proba = _worker["model"].predict_proba(pd.DataFrame(rows[valid], columns=FEATURE_COLUMNS))
+        classes[valid] = proba.argmax(axis=1)
+        probability[valid] = proba.max(axis=1)
+
+    shape = (r1 - r0, c1 - c0)
+    _worker["classes"][r0:r1, c0:c1] = classes.reshape(shape)
+    _worker["probability"][r0:r1, c0:c1] = probability.reshape(shape)
+    _worker["classes"].flush()
+    _worker["probability"].flush()
+    return int(valid.sum())
+
+
+# --------------------------------------------------
+# Run management
+# --------------------------------------------------
+def prepare_run(out_dir, shape, tile, classes, features_path, fingerprint, overwrite=False):
+    """
+    Create output rasters, or reuse them when resuming a run with the
+    same shape, tile size, classes and input fingerprint. Returns the
+    set of completed tiles.
+
+    Raises ValueError if out_dir holds a run over different inputs,
+    unless overwrite is set.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, META_FILE)
+    meta = {
+        "shape": list(shape),
+        "tile": tile,
+        "classes": list(classes),
+        "features": os.path.abspath(features_path),
+        "inputs": fingerprint,
+        "nodata_class": NODATA_CLASS
+    }
+
+    if os.path.exists(meta_path) and not overwrite:
+        with open(meta_path) as f:
+            previous = json.load(f)
+        changed = [key for key in ("shape", "tile", "classes", "inputs") if previous.get(key) != meta[key]]
+        if changed:
+            raise ValueError(
+                f"{out_dir} holds a run with different {', '.join(changed)}; "
+                "use a new --out directory or pass --overwrite"
+            )
+        return read_progress(out_dir)
+
+    np.lib.format.open_memmap(
+        os.path.join(out_dir, CLASS_RASTER), mode="w+", dtype=np.uint8, shape=shape
+    )[:] = NODATA_CLASS
+    np.lib.format.open_memmap(
+        os.path.join(out_dir, PROBABILITY_RASTER), mode="w+", dtype=np.float32, shape=shape
+    )[:] = np.nan
+    open(os.path.join(out_dir, PROGRESS_FILE), "w").close()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return set()
+
+
+def read_progress(out_dir):
+    done = set()
+    path = os.path.join(out_dir, PROGRESS_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                parts = line.strip().split(",")
+                if len(parts) == 2:
+                    done.add((int(parts[0]), int(parts[1])))
+    return done
+
+
+def read_tile(out_dir, row, col):
+    """
+    Read one finished tile. Returns (bounds, class_index, max_probability)
+    or None when the tile does not exist or is not scored yet.
+    """
+    with open(os.path.join(out_dir, META_FILE)) as f:
+        meta = json.load(f)
+    height, width = meta["shape"]
+    tile = meta["tile"]
+    r0, c0 = row * tile, col * tile
+    if row < 0 or col < 0 or r0 >= height or c0 >= width or (row, col) not in read_progress(out_dir):
+        return None
+    r1, c1 = min(r0 + tile, height), min(c0 + tile, width)
+    classes = np.load(os.path.join(out_dir, CLASS_RASTER), mmap_mode="r")[r0:r1, c0:c1]
+    probability = np.load(os.path.join(out_dir, PROBABILITY_RASTER), mmap_mode="r")[r0:r1, c0:c1]
+    return (r0, r1, c0, c1), np.array(classes), np.array(probability)
+
+
+class TileCache:
+    """
+    Thread-safe LRU of read_tile results bounded by the bytes of their
+    arrays, not by entry count. Callers encode the arrays per request.
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _size(tile):
+        _, classes, probability = tile
+        return classes.nbytes + probability.nbytes
+
+    def get(self, key):
+        with self._lock:
+            tile = self._entries.get(key)
+            if tile is not None:
+                self._entries.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        size = self._size(tile)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._size(self._entries.pop(key))
+            self._entries[key] = tile
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+
+
+def score_raster(features_path, out_dir, model_path, tile=512, workers=None, overwrite=False):
+    layers = open_feature_stack(features_path)
+    shape = layers[0].shape
+    classes = joblib.load(model_path)["label_encoder"].classes_
+    fingerprint = input_fingerprint(features_path, model_path)
+    done = prepare_run(out_dir, shape, tile, classes, features_path, fingerprint, overwrite)
+
+    pending = [t for t in tile_grid(shape[0], shape[1], tile) if (t[0], t[1]) not in done]
+    total = len(done) + len(pending)
+    print(f"Raster {shape[0]}x{shape[1]}, {total} tiles, {len(done)} already done")
+
+    start = time.perf_counter()
+    cells = 0
+    with open(os.path.join(out_dir, PROGRESS_FILE), "a") as progress, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(model_path, features_path, out_dir)
+    ) as pool:
+        futures = {pool.submit(_score_tile, t[2:]): t[:2] for t in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            cells += future.result()
+            row, col = futures[future]
+            # The worker has flushed its tile; only now mark it done
+            progress.write(f"{row},{col}\n")
+            progress.flush()
+            os.fsync(progress.fileno())
+            if i % 50 == 0 or i == len(pending):
+                print(f"  {len(done) + i}/{total} tiles")
+
+    elapsed = time.perf_counter() - start
+    rate = cells / elapsed if elapsed > 0 else 0.0
+    print(f"Scored {cells} cells in {elapsed:.1f}s ({rate:,.0f} cells/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score gridded feature layers into crop-suitability rasters.")
+    parser.add_argument("--features", required=True, help="(7, H, W) .npy stack or directory of per-feature .npy files")
+    parser.add_argument("--out", required=True, help="Output directory for rasters and progress")
+    parser.add_argument("--model", default="crop_recommendation_model.joblib")
+    parser.add_argument("--tile", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true", help="Discard a previous run in --out over different inputs")
+    args = parser.parse_args()
+    try:
+        score_raster(args.features, args.out, args.model, args.tile, args.workers, args.overwrite)
+    except ValueError as e:
+        parser.exit(1, f"error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Server-side store for /batch_predict results.
+
+With ?store=1 the scored rows are written to RESULT_STORE_DIR as one
+.npy file per column: the features as float32, the predicted class
+index as int16 (-1 for invalid rows) and the id column if one was sent.
+Ids are variable-length, so they are stored as concatenated UTF-8 bytes
+(ids_data.npy) plus row offsets (ids_offsets.npy); a fixed-width string
+array would pad every id to the longest one.
+Sparse row errors are stored the same way, one JSON document per
+invalid row (errors_data.npy, errors_offsets.npy) keyed by the sorted
+row positions in errors_rows.npy, so a page reads only its own rows'
+errors. The request metadata goes to meta.json. The response carries
+only a result_id and the metadata.
+Clients page through /batch_results/<id> with an opaque cursor,
+filtered by crop or status, and fetch per-crop aggregates from
+/batch_results/<id>/summary. A 500k-row result therefore never travels
+as one JSON document.
+
+Columns are opened with mmap_mode="r", so a page only touches the rows
+it returns. They are all mapped when a result is opened, so a result
+deleted or pruned while a request reads it stays readable until that
+request ends. Results expire after `ttl` seconds.
+"""
+import base64
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS
+from ingest import echo_values
+
+RESULT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def encode_cursor(row):
+    payload = json.dumps({"row": int(row)}).encode()
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Row index to resume the scan from; ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return max(int(json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))["row"]), 0)
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Malformed cursor")
+
+
+def encode_strings(values):
+    """(uint8 UTF-8 bytes, int64 offsets of length n + 1) for a string column."""
+    encoded = [str(value).encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class BatchResultStore:
+    """Directory of stored results, one sub-directory per result id."""
+
+    def __init__(self, directory, ttl=24 * 3600):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, features, class_index, classes, ids=None, id_column=None, errors=None, metadata=None):
+        result_id = uuid.uuid4().hex
+        staging = os.path.join(self.directory, f".{result_id}.tmp")
+        os.makedirs(staging)
+
+        for j, col in enumerate(FEATURE_COLUMNS):
+            np.save(os.path.join(staging, f"{col}.npy"), np.ascontiguousarray(features[:, j], dtype=np.float32))
+        np.save(os.path.join(staging, "class_index.npy"), np.asarray(class_index, dtype=np.int16))
+        if ids is not None:
+            data, offsets = encode_strings(ids)
+            np.save(os.path.join(staging, "ids_data.npy"), data)
+            np.save(os.path.join(staging, "ids_offsets.npy"), offsets)
+        error_rows = sorted(errors or {})
+        data, offsets = encode_strings(json.dumps(errors[row]) for row in error_rows)
+        np.save(os.path.join(staging, "errors_rows.npy"), np.asarray(error_rows, dtype=np.int64))
+        np.save(os.path.join(staging, "errors_data.npy"), data)
+        np.save(os.path.join(staging, "errors_offsets.npy"), offsets)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({
+                "rows": len(class_index),
+                "classes": [str(c) for c in classes],
+                "id_column": id_column if ids is not None else None,
+                "created_at": time.time(),
+                "metadata": metadata or {}
+            }, f)
+
+        # Readers only ever see complete results
+        os.replace(staging, os.path.join(self.directory, result_id))
+        self.prune()
+        return result_id
+
+    def open(self, result_id):
+        """StoredResult, or None for unknown/expired ids."""
+        if not RESULT_ID.match(result_id or ""):
+            return None
+        path = os.path.join(self.directory, result_id)
+        try:
+            result = StoredResult(path)
+        except FileNotFoundError:
+            # Never stored, or deleted while it was being opened
+            return None
+        if time.time() - result.meta["created_at"] > self.ttl:
+            return None
+        return result
+
+    def delete(self, result_id):
+        if not RESULT_ID.match(result_id or ""):
+            return False
+        path = os.path.join(self.directory, result_id)
+        if not os.path.isdir(path):
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    def prune(self):
+        """Remove expired results (and staging leftovers past the TTL)."""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and now - os.path.getmtime(path) > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class StoredResult:
+    """Read-only, memory-mapped view of one stored result."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.classes = np.asarray(self.meta["classes"])
+        self.id_column = self.meta["id_column"]
+        names = FEATURE_COLUMNS + ["class_index", "errors_rows", "errors_data", "errors_offsets"]
+        if self.id_column:
+            names += ["ids_data", "ids_offsets"]
+        self._columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in names
+        }
+        self.class_index = self._columns["class_index"]
+
+    def _column(self, name):
+        return self._columns[name]
+
+    def _strings(self, name, positions):
+        """Strings of a UTF-8 + offsets column for an array of positions."""
+        data, offsets = self._column(f"{name}_data"), self._column(f"{name}_offsets")
+        return [bytes(data[offsets[p]:offsets[p + 1]]).decode("utf-8") for p in positions.tolist()]
+
+    def _ids(self, positions):
+        """Id strings for an array of row positions."""
+        return self._strings("ids", positions)
+
+    def _id_range(self, start, stop):
+        """Id strings for rows start..stop, read as one contiguous slice."""
+        offsets = np.asarray(self._column("ids_offsets")[start:stop + 1])
+        blob = bytes(self._column("ids_data")[offsets[0]:offsets[-1]])
+        bounds = (offsets - offsets[0]).tolist()
+        return [blob[a:b].decode("utf-8") for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _errors(self, positions):
+        """{row: errors} for the invalid rows among `positions`."""
+        error_rows = self._column("errors_rows")
+        at = np.searchsorted(error_rows, positions)
+        found = at < len(error_rows)
+        found[found] = error_rows[at[found]] == positions[found]
+        documents = self._strings("errors", at[found])
+        return {int(row): json.loads(doc) for row, doc in zip(positions[found].tolist(), documents)}
+
+    def crop_index(self, crop):
+        """Class index for a crop name; ValueError if unknown."""
+        matches = np.flatnonzero(self.classes == crop)
+        if not len(matches):
+            raise ValueError(f"Unknown crop: {crop}")
+        return int(matches[0])
+
+    def matching_rows(self, crop=None, status=None):
+        """Row indices that pass the filters."""
+        index = self.class_index
+        mask = np.ones(len(index), dtype=bool)
+        if crop is not None:
+            mask &= index == self.crop_index(crop)
+        if status == "ok":
+            mask &= index >= 0
+        elif status == "error":
+            mask &= index < 0
+        return np.flatnonzero(mask)
+
+    def rows(self, positions):
+        """Result rows (same shape as the /batch_predict echo) for positions."""
+        if not len(positions):
+            return []
+        features = echo_values(np.stack([self._column(col)[positions] for col in FEATURE_COLUMNS], axis=1))
+        index = self.class_index[positions]
+        ids = self._ids(positions) if self.id_column else None
+        errors = self._errors(positions[index < 0])
+
+        out = []
+        for k, row in enumerate(positions.tolist()):
+            record = {self.id_column: ids[k]} if ids is not None else {}
+            for j, col in enumerate(FEATURE_COLUMNS):
+                value = features[k, j]
+                record[col] = None if np.isnan(value) else float(value)
+            if index[k] >= 0:
+                record["recommended_crop"] = str(self.classes[index[k]])
+                record["status"] = "ok"
+            else:
+                record["recommended_crop"] = None
+                record["status"] = "error"
+                record["errors"] = errors.get(row, [])
+            record["row"] = row
+            out.append(record)
+        return out
+
+    def page(self, cursor=None, limit=100, crop=None, status=None):
+        """(rows, next_cursor or None, total rows matching the filters)."""
+        start = decode_cursor(cursor) if cursor else 0
+        matching = self.matching_rows(crop, status)
+        positions = matching[np.searchsorted(matching, start):]
+        total = len(matching)
+        page = positions[:limit]
+        next_cursor = encode_cursor(positions[limit]) if len(positions) > limit else None
+        return self.rows(page), next_cursor, total
+
+    def iter_csv(self, chunk_rows=50_000):
+        """CSV text of the whole result in chunks (header first)."""
+        n = self.meta["rows"]
+        for start in range(0, max(n, 1), chunk_rows):
+            stop = min(start + chunk_rows, n)
+            frame = pd.DataFrame(
+                echo_values(np.stack([self._column(col)[start:stop] for col in FEATURE_COLUMNS], axis=1)),
+                columns=FEATURE_COLUMNS
+            )
+            if self.id_column:
+                frame.insert(0, self.id_column, self._id_range(start, stop))
+            index = np.asarray(self.class_index[start:stop])
+            frame["recommended_crop"] = np.where(index >= 0, self.classes[np.maximum(index, 0)], "")
+            frame["status"] = np.where(index >= 0, "ok", "error")
+            yield frame.to_csv(index=False, header=start == 0)
+
+    def summary(self):
+        """Per-crop counts, shares and mean features over valid rows."""
+        index = np.asarray(self.class_index, dtype=np.int64)
+        valid = index >= 0
+        n_classes = len(self.classes)
+        counts = np.bincount(index[valid], minlength=n_classes)
+        means = {}
+        for col in FEATURE_COLUMNS:
+            values = np.asarray(self._column(col), dtype=np.float64)[valid]
+            sums = np.bincount(index[valid], weights=values, minlength=n_classes)
+            means[col] = np.divide(sums, counts, out=np.full(n_classes, np.nan), where=counts > 0)
+
+        n_valid = int(valid.sum())
+        crops = []
+        for c in np.argsort(-counts, kind="stable"):
+            if not counts[c]:
+                break
+            crops.append({
+                "crop": str(self.classes[c]),
+                "count": int(counts[c]),
+                "share": round(counts[c] / n_valid, 6),
+                "mean_features": {col: round(float(means[col][c]), 4) for col in FEATURE_COLUMNS}
+            })
+        return {
+            "rows": len(index),
+            "rows_valid": n_valid,
+            "rows_invalid": len(index) - n_valid,
+            "error_counts": self.meta["metadata"].get("error_counts", {}),
+            "crops": crops
+        }
@@ -0,0 +1,245 @@
+"""
+Serving configuration: worker count, XGBoost threads per worker, batch
+chunk size and optional CPU pinning.
+
+By default XGBoost uses every core inside every gunicorn worker, so N
+workers oversubscribe the CPU N times over. A profile caps the threads
+per worker and can pin each worker to its own block of cores. Profiles
+are JSON (SERVING_PROFILE, default serving_profile.json); environment
+variables override single values:
+
+    GUNICORN_WORKERS, XGB_NTHREAD, BATCH_CHUNK_ROWS, CPU_PINNING=1
+
+The autotune command benchmarks workers x threads x batch size on this
+host and writes the best profile:
+
+    python serving_config.py autotune --csv ../model/Crop_recommendation.csv \
+        --workers 1,2,4 --threads 1,2,4 --batch-sizes 1,512,5000
+"""
+import argparse
+import json
+import os
+import time
+
+DEFAULT_PROFILE_PATH = "serving_profile.json"
+
+
+def default_profile():
+    cpus = os.cpu_count() or 1
+    return {
+        "workers": 1,
+        "threads_per_worker": cpus,
+        "batch_chunk_rows": 5000,
+        "pin_cpus": False
+    }
+
+
+def load_profile(path=None):
+    """Defaults, then the profile file (if present), then env overrides."""
+    profile = default_profile()
+    path = path or os.environ.get("SERVING_PROFILE", DEFAULT_PROFILE_PATH)
+    if os.path.exists(path):
+        with open(path) as f:
+            stored = json.load(f)
+        profile.update({k: stored[k] for k in profile if k in stored})
+
+    overrides = {
+        "workers": ("GUNICORN_WORKERS", int),
+        "threads_per_worker": ("XGB_NTHREAD", int),
+        "batch_chunk_rows": ("BATCH_CHUNK_ROWS", int),
+        "pin_cpus": ("CPU_PINNING", lambda v: v == "1"),
+    }
+    for key, (env, cast) in overrides.items():
+        if os.environ.get(env):
+            profile[key] = cast(os.environ[env])
+    return profile
+
+
+def apply_thread_limits(profile):
+    """
+    Cap OpenMP threads for this process. Must run before xgboost is
+    imported for OMP_NUM_THREADS to take effect; the model's own nthread
+    is set separately with configure_model().
+    """
+    threads = str(profile["threads_per_worker"])
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, threads)
+
+
+def configure_model(model, profile):
+    """Set nthread on the pipeline's XGBoost classifier and its booster."""
+    classifier = model.named_steps["classifier"]
+    classifier.set_params(n_jobs=profile["threads_per_worker"])
+    classifier.get_booster().set_param({"nthread": profile["threads_per_worker"]})
+
+
+def worker_cpus(slot, profile):
+    """CPU ids for the worker in `slot`, in contiguous blocks."""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if not available:
+        return []
+    threads = profile["threads_per_worker"]
+    start = (slot * threads) % len(available)
+    return [available[(start + i) % len(available)] for i in range(min(threads, len(available)))]
+
+
+def pin_worker(slot, profile):
+    """Pin the current process to its CPU block (Linux only)."""
+    if not profile["pin_cpus"] or not hasattr(os, "sched_setaffinity"):
+        return []
+    cpus = worker_cpus(slot, profile)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    return cpus
+
+
+# --------------------------------------------------
+# Autotune
+# --------------------------------------------------
+_bench = {}
+
+
+def _bench_init(model_path, threads):
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import joblib
+    model = joblib.load(model_path)["model"]
+    configure_model(model, {"threads_per_worker": threads})
+    _bench["model"] = model
+
+
+def _bench_run(rows, batch_size, start_at, duration, seed):
+    import numpy as np
+    import pandas as pd
+
+    model = _bench["model"]
+    rng = np.random.default_rng(seed)
+    columns = list(rows.columns)
+    values = rows.to_numpy()
+    latencies = []
+    scored = 0
+
+    while time.time() < start_at:
+        time.sleep(0.001)
+    end = start_at + duration
+    while time.time() < end:
+        batch = pd.DataFrame(values[rng.integers(0, len(values), batch_size)], columns=columns)
+        t0 = time.perf_counter()
+        model.predict(batch)
+        latencies.append(time.perf_counter() - t0)
+        scored += batch_size
+    return scored, latencies
+
+
+def benchmark(model_path, rows, workers, threads, batch_size, duration):
+    """Aggregate rows/s and per-call latency for one combination."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    import numpy as np
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_bench_init,
+                             initargs=(model_path, threads)) as pool:
+        # Warm up every worker (loads the model) before the timed run
+        list(pool.map(_bench_run, [rows] * workers, [batch_size] * workers,
+                      [0] * workers, [0.2] * workers, range(workers)))
+        start_at = time.time() + 0.5
+        results = list(pool.map(_bench_run, [rows] * workers, [batch_size] * workers,
+                                [start_at] * workers, [duration] * workers, range(workers)))
+
+    scored = sum(r[0] for r in results)
+    latencies = np.concatenate([r[1] for r in results]) * 1000
+    return {
+        "workers": workers,
+        "threads_per_worker": threads,
+        "batch_size": batch_size,
+        "rows_per_second": round(scored / duration, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3)
+    }
+
+
+def autotune(args):
+    import pandas as pd
+
+    cpus = os.cpu_count() or 1
+    rows = pd.read_csv(args.csv)[["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]]
+    worker_options = [int(v) for v in args.workers.split(",")]
+    thread_options = [int(v) for v in args.threads.split(",")]
+    batch_options = [int(v) for v in args.batch_sizes.split(",")]
+
+    results = []
+    for workers in worker_options:
+        for threads in thread_options:
+            if workers * threads > cpus and not args.allow_oversubscribe:
+                continue
+            for batch_size in batch_options:
+                result = benchmark(args.model, rows, workers, threads, batch_size, args.duration)
+                results.append(result)
+                print(f"workers={workers:<3} threads={threads:<3} batch={batch_size:<6} "
+                      f"{result['rows_per_second']:>12,.0f} rows/s  "
+                      f"p50 {result['p50_ms']:8.3f} ms  p95 {result['p95_ms']:8.3f} ms")
+
+    if not results:
+        raise SystemExit("No combination fits the CPU budget; pass --allow-oversubscribe to try anyway")
+
+    # Workers x threads: among combinations whose single-row p95 (the
+    # /predict path) meets the SLO, take the highest peak throughput.
+    combos = {}
+    for r in results:
+        combos.setdefault((r["workers"], r["threads_per_worker"]), []).append(r)
+    smallest = min(batch_options)
+    eligible = [
+        key for key, runs in combos.items()
+        if all(r["p95_ms"] <= args.latency_slo_ms for r in runs if r["batch_size"] == smallest)
+    ] or list(combos)
+    best_key = max(eligible, key=lambda key: max(r["rows_per_second"] for r in combos[key]))
+
+    # Batch chunk size: highest throughput for that combination within
+    # the per-chunk latency budget (deadlines are checked between chunks)
+    runs = combos[best_key]
+    chunk_ok = [r for r in runs if r["p95_ms"] <= args.chunk_budget_ms] or runs
+    best_chunk = max(chunk_ok, key=lambda r: r["rows_per_second"])
+    best_combo = {"workers": best_key[0], "threads_per_worker": best_key[1]}
+
+    profile = {
+        "workers": best_combo["workers"],
+        "threads_per_worker": best_combo["threads_per_worker"],
+        "batch_chunk_rows": best_chunk["batch_size"],
+        "pin_cpus": args.pin_cpus and best_combo["workers"] * best_combo["threads_per_worker"] <= cpus,
+        "host": {"cpu_count": cpus, "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "benchmarks": results
+    }
+    with open(args.out, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Best: workers={profile['workers']} threads={profile['threads_per_worker']} "
+          f"chunk={profile['batch_chunk_rows']} -> {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serving profile tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("show", help="Print the effective profile")
+    p.add_argument("--profile", default=None)
+
+    p = sub.add_parser("autotune", help="Benchmark workers x threads x batch size and write a profile")
+    p.add_argument("--model", default="crop_recommendation_model.joblib")
+    p.add_argument("--csv", default="../model/Crop_recommendation.csv")
+    p.add_argument("--out", default=DEFAULT_PROFILE_PATH)
+    p.add_argument("--workers", default="1,2,4")
+    p.add_argument("--threads", default="1,2,4")
+    p.add_argument("--batch-sizes", default="1,512,5000")
+    p.add_argument("--duration", type=float, default=3.0, help="Seconds per combination")
+    p.add_argument("--latency-slo-ms", type=float, default=20.0, help="p95 budget for single-row predictions")
+    p.add_argument("--chunk-budget-ms", type=float, default=500.0, help="p95 budget per batch chunk")
+    p.add_argument("--pin-cpus", action="store_true")
+    p.add_argument("--allow-oversubscribe", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "show":
+        print(json.dumps(load_profile(args.profile), indent=2))
+    else:
+        autotune(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Shared fixtures for the backend tests.
+
+Run from the repository root or backend/:
+
+    python -m pytest backend/tests
+
+The API loads crop_recommendation_model.joblib (and, if present,
+distilled_model.npz) from the working directory, so the `api` fixture
+changes into CROP_MODEL_DIR (default: backend/) first. Tests that need
+the API are skipped when the artifact is not there; the unit tests of
+the helper modules run either way.
+
+The API is imported once per session with the prediction cache, request
+coalescing and the leaf-region index all enabled. "Baseline" below means
+the artifact's XGBoost pipeline called directly, which is what /predict
+answered before any of those layers existed.
+"""
+import importlib
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+MODEL_DIR = os.environ.get("CROP_MODEL_DIR", BACKEND_DIR)
+MODEL_PATH = os.path.join(MODEL_DIR, "crop_recommendation_model.joblib")
+DATASET_PATH = os.path.join(REPO_DIR, "model", "Crop_recommendation.csv")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from features import FEATURE_COLUMNS  # noqa: E402
+
+
+def needs_model():
+    if not os.path.exists(MODEL_PATH):
+        pytest.skip(f"model artifact not found at {MODEL_PATH} (set CROP_MODEL_DIR)")
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """The backend's app module, imported with every serving layer enabled."""
+    needs_model()
+    work = tmp_path_factory.mktemp("api")
+    os.environ.update({
+        "DATASET_PATH": DATASET_PATH,
+        "LEAF_INDEX": "1",
+        "PREDICT_COALESCING": "1",
+        "CASCADE_INFERENCE": "0",
+        "INFERENCE_MODE": "xgboost",
+        "RESULT_STORE_DIR": str(work / "results"),
+        "RASTER_OUTPUT_DIR": str(work / "raster"),
+        "PREDICTION_LOG_DIR": str(work / "log"),
+        "DRIFT_MIN_SAMPLES": "10",
+    })
+    os.chdir(MODEL_DIR)
+    return importlib.import_module("app")
+
+
+@pytest.fixture(scope="session")
+def client(api):
+    return api.app.test_client()
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    """Crop names from the artifact's pipeline, bypassing the API."""
+    needs_model()
+    artifacts = joblib.load(MODEL_PATH)
+    model, label_encoder = artifacts["model"], artifacts["label_encoder"]
+
+    def predict(features):
+        frame = pd.DataFrame(np.asarray(features, dtype=np.float64), columns=FEATURE_COLUMNS)
+        return label_encoder.inverse_transform(model.predict(frame)).tolist()
+    return predict
+
+
+@pytest.fixture(scope="session")
+def rows():
+    """
+    (200, 7) inputs: half training rows, half uniform draws over the
+    training ranges, so both dense and sparse regions are covered.
+    """
+    df = pd.read_csv(DATASET_PATH)
+    train = df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    rng = np.random.default_rng(0)
+    picked = train[rng.choice(len(train), 100, replace=False)]
+    low, high = train.min(axis=0), train.max(axis=0)
+    drawn = np.round(rng.uniform(low, high, (100, len(FEATURE_COLUMNS))), 3)
+    return np.vstack([picked, drawn])
+
+
+def as_payload(row):
+    return {col: float(value) for col, value in zip(FEATURE_COLUMNS, row)}
+
+
+def csv_bytes(features, ids=None):
+    frame = pd.DataFrame(features, columns=FEATURE_COLUMNS)
+    if ids is not None:
+        frame.insert(0, "id", ids)
+    return frame.to_csv(index=False).encode()
@@ -0,0 +1,158 @@
+"""/batch_predict, /batch_predict_files and /batch_results against the baseline pipeline."""
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from conftest import FEATURE_COLUMNS, csv_bytes
+
+
+def batch_rows(rows):
+    """The rows with every one repeated, as float32 (how batches are read)."""
+    return np.vstack([rows, rows[::2]]).astype(np.float32)
+
+
+def upload(client, data, query="", headers=None, name="fields.csv"):
+    return client.post(
+        "/batch_predict" + query,
+        data={"file": (io.BytesIO(data), name)},
+        content_type="multipart/form-data",
+        headers=headers
+    )
+
+
+def test_batch_predict_matches_baseline(client, baseline, rows):
+    features = batch_rows(rows)
+    resp = upload(client, csv_bytes(features))
+    assert resp.status_code == 200
+    body = resp.json
+    assert [r["recommended_crop"] for r in body["results"]] == baseline(features)
+    assert body["metadata"]["rows"] == len(features)
+    # Duplicates are scored once
+    assert body["metadata"]["unique_rows"] <= len(rows)
+
+
+def test_batch_predict_passes_ids_and_reports_bad_rows(client, baseline, rows):
+    features = rows[:5].astype(np.float32)
+    data = csv_bytes(features, ids=[f"f{i}" for i in range(5)])
+    data += b"f5,,1,1,20,50,6.5,100\nf6,abc,1,1,20,50,6.5,100\n"
+    body = upload(client, data).json
+    results = body["results"]
+    assert [r["id"] for r in results] == [f"f{i}" for i in range(7)]
+    assert [r["recommended_crop"] for r in results[:5]] == baseline(features)
+    assert [r["status"] for r in results[5:]] == ["error", "error"]
+    assert results[5]["errors"][0]["code"] == "missing_value"
+    assert results[6]["errors"][0]["code"] == "not_a_number"
+    assert body["metadata"]["rows_invalid"] == 2
+
+
+def test_batch_predict_missing_columns(client):
+    resp = upload(client, b"N,P\n1,2\n")
+    assert resp.status_code == 400
+    assert resp.json["missing_columns"] == FEATURE_COLUMNS[2:]
+
+
+def test_batch_predict_no_file(client):
+    assert client.post("/batch_predict", data={}, content_type="multipart/form-data").status_code == 400
+
+
+def test_stored_result_pages_match_baseline(client, baseline, rows):
+    features = batch_rows(rows)
+    resp = upload(client, csv_bytes(features, ids=[str(i) for i in range(len(features))]), "?store=1")
+    assert resp.status_code == 200
+    result_id = resp.json["result_id"]
+    assert "results" not in resp.json
+
+    crops, cursor = [], None
+    while True:
+        query = "?limit=64" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(f"/batch_results/{result_id}{query}").json
+        crops += [r["recommended_crop"] for r in page["results"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    expected = baseline(features)
+    assert crops == expected
+
+    summary = client.get(f"/batch_results/{result_id}/summary").json
+    assert {c["crop"]: c["count"] for c in summary["crops"]} == pd.Series(expected).value_counts().to_dict()
+
+    exported = pd.read_csv(io.BytesIO(client.get(f"/batch_results/{result_id}/export").data))
+    assert exported["recommended_crop"].tolist() == expected
+    assert exported["id"].astype(str).tolist() == [str(i) for i in range(len(features))]
+
+    crop = expected[0]
+    filtered = client.get(f"/batch_results/{result_id}?crop={crop}&limit=1000").json
+    assert filtered["total_matching"] == expected.count(crop)
+
+    assert client.delete(f"/batch_results/{result_id}").status_code == 200
+    assert client.get(f"/batch_results/{result_id}").status_code == 404
+
+
+def test_batch_results_unknown_id(client):
+    assert client.get(f"/batch_results/{'0' * 32}").status_code == 404
+    assert client.get("/batch_results/not-an-id/summary").status_code == 404
+
+
+def test_partial_continuation_matches_full_run(api, client, baseline, rows, monkeypatch):
+    # Large enough to arrive in several reads of the request body
+    features = np.tile(batch_rows(rows), (20, 1))
+    data = csv_bytes(features)
+    monkeypatch.setattr(api, "batch_chunk_rows", lambda: 16)
+
+    # Let the "deadline" pass after a few chunks of the first request
+    calls = {"n": 0}
+    real_deadline_passed = api.deadline_passed
+
+    def deadline_passed(deadline):
+        calls["n"] += 1
+        return deadline is not None and calls["n"] > 6
+
+    monkeypatch.setattr(api, "deadline_passed", deadline_passed)
+    first = upload(client, data, "?partial=1", headers={"X-Request-Timeout": "60"}).json
+    monkeypatch.setattr(api, "deadline_passed", real_deadline_passed)
+
+    metadata = first["metadata"]
+    assert metadata["partial"]
+    assert metadata["rows_total"] == len(features)
+    assert 0 < metadata["rows"] < len(features)
+    token = metadata["continuation"]
+
+    rest = upload(client, data, f"?partial=1&continuation={token}").json
+    assert rest["metadata"]["row_offset"] == metadata["rows"]
+    assert not rest["metadata"]["partial"]
+    crops = [r["recommended_crop"] for r in first["results"] + rest["results"]]
+    assert crops == baseline(features)
+
+    # A file that differs before the offset is refused
+    tampered = features.copy()
+    tampered[0, 0] += 1
+    resp = upload(client, csv_bytes(tampered), f"?partial=1&continuation={token}")
+    assert resp.status_code == 400
+
+
+def test_batch_predict_files_zip_matches_baseline(client, baseline, rows):
+    halves = np.array_split(rows.astype(np.float32), 2)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("north.csv", csv_bytes(halves[0]))
+        zf.writestr("south.csv", csv_bytes(halves[1]))
+        zf.writestr("notes.txt", "not a csv")
+    resp = client.post(
+        "/batch_predict_files",
+        data={"file": [(io.BytesIO(archive.getvalue()), "villages.zip"),
+                       (io.BytesIO(b"N,P\n1,2\n"), "broken.csv")]},
+        content_type="multipart/form-data"
+    )
+    assert resp.status_code == 200
+    files = resp.json["files"]
+    for name, part in zip(["villages.zip/north.csv", "villages.zip/south.csv"], halves):
+        assert files[name]["status"] == "ok"
+        assert [r["recommended_crop"] for r in files[name]["results"]] == baseline(part)
+    assert files["broken.csv"]["status"] == "error"
+
+    summary = resp.json["summary"]
+    assert (summary["files"], summary["files_ok"], summary["rows"]) == (3, 2, len(rows))
+    expected = pd.Series(baseline(rows.astype(np.float32))).value_counts().to_dict()
+    assert summary["crop_counts"] == expected
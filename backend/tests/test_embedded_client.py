@@ -0,0 +1,48 @@
+"""The frontend's embedded client answers like the API."""
+import os
+import sys
+
+import pytest
+
+from conftest import MODEL_PATH, REPO_DIR, as_payload, needs_model
+
+# After backend/, so `app` stays the API module
+sys.path.append(os.path.join(REPO_DIR, "frontend"))
+
+backend_client = pytest.importorskip("backend_client")
+
+
+@pytest.fixture(scope="module")
+def embedded():
+    needs_model()
+    return backend_client.EmbeddedBackendClient(MODEL_PATH)
+
+
+def test_embedded_predict_matches_api(client, embedded, baseline, rows):
+    for row, expected in zip(rows, baseline(rows)):
+        payload = as_payload(row)
+        assert embedded.predict(payload) == client.post("/predict", json=payload).json
+        assert embedded.predict(payload)["recommended_crop"] == expected
+
+
+def test_embedded_predict_proba_matches_api(client, embedded, rows):
+    for row in rows:
+        payload = as_payload(row)
+        assert embedded.predict_proba(payload, output="topk", k=3) == \
+            client.post("/predict_proba?output=topk&k=3", json=payload).json
+
+
+def test_embedded_explain_matches_api(client, embedded, rows):
+    for row in rows[::10]:
+        payload = as_payload(row)
+        ours = embedded.explain(payload)
+        theirs = client.post("/explain", json=payload).json
+        assert ours["recommended_crop"] == theirs["recommended_crop"]
+        for col, value in ours["contributions"].items():
+            assert value == pytest.approx(theirs["contributions"][col], abs=1e-4)
+
+
+def test_embedded_missing_fields(embedded):
+    with pytest.raises(backend_client.BackendError) as e:
+        embedded.predict({"N": 1})
+    assert e.value.status == 400
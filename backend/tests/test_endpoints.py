@@ -0,0 +1,199 @@
+"""The analysis endpoints against the baseline pipeline."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import DATASET_PATH, FEATURE_COLUMNS, MODEL_PATH, as_payload
+
+
+def test_similar_fields_finds_training_rows(client):
+    df = pd.read_csv(DATASET_PATH).head(20)
+    body = client.post("/similar_fields?k=3", json=df[FEATURE_COLUMNS].to_dict(orient="records")).json
+    for (_, row), result in zip(df.iterrows(), body["results"]):
+        nearest = result["neighbors"][0]
+        assert len(result["neighbors"]) == 3
+        assert nearest["distance"] == pytest.approx(0.0, abs=1e-6)
+        assert nearest["label"] == row["label"]
+
+
+def test_similar_fields_rejects_bad_k(client, rows):
+    assert client.post("/similar_fields?k=0", json=as_payload(rows[0])).status_code == 400
+    assert client.post("/similar_fields?k=x", json=as_payload(rows[0])).status_code == 400
+
+
+def test_explain_matches_baseline(api, client, baseline, rows):
+    body = client.post("/explain", json=[as_payload(row) for row in rows]).json
+    assert [r["recommended_crop"] for r in body["results"]] == baseline(rows)
+
+    single = client.post("/explain?all_classes=1", json=as_payload(rows[0])).json
+    assert single["recommended_crop"] == baseline(rows[:1])[0]
+    assert len(single["all_contributions"]) == len(api.label_encoder.classes_)
+    assert set(single["contributions"]) == set(FEATURE_COLUMNS)
+
+
+def test_predict_proba_matches_baseline(client, baseline, rows):
+    body = client.post("/predict_proba?k=3", json={"rows": [as_payload(row) for row in rows]}).json
+    classes = body["classes"]
+    matrix = np.asarray(body["probabilities"]["data"])
+    assert matrix.shape == (len(rows), len(classes))
+    assert np.allclose(matrix.sum(axis=1), 1.0, atol=1e-4)
+    top = np.asarray(body["top_k"]["indices"]["data"])
+    assert [classes[i] for i in top[:, 0]] == baseline(rows)
+
+    single = client.post("/predict_proba?output=topk&k=100", json=as_payload(rows[0])).json
+    assert single["recommended_crop"] == baseline(rows[:1])[0]
+    assert single["top_k"]["k"] == len(classes)
+
+
+@pytest.mark.parametrize("query", ["k=0", "k=x", "dtype=float64", "output=nope", "encoding=hex"])
+def test_predict_proba_rejects_bad_parameters(client, rows, query):
+    assert client.post(f"/predict_proba?{query}", json=as_payload(rows[0])).status_code == 400
+
+
+def test_predict_proba_float16_json_is_rounded(client, rows):
+    body = client.post("/predict_proba?dtype=float16&output=matrix", json=as_payload(rows[0])).json
+    assert body["probabilities"]["dtype"] == "float16"
+    assert all(value == round(value, 3) for value in body["probabilities"]["data"][0])
+
+
+def test_what_if_matches_baseline(client, baseline, rows):
+    base = as_payload(rows[0])
+    body = client.post("/what_if", json={
+        "base": base,
+        "sweeps": [
+            {"feature": "rainfall", "start": 50, "stop": 300, "step": 50},
+            {"feature": "N", "values": [0, 70, 140]}
+        ]
+    }).json
+    assert body["shape"] == [6, 3]
+    assert body["axes"][0]["values"] == [50, 100, 150, 200, 250, 300]
+
+    grid = np.tile(rows[0], (18, 1))
+    rainfall, n = np.meshgrid([50, 100, 150, 200, 250, 300], [0, 70, 140], indexing="ij")
+    grid[:, FEATURE_COLUMNS.index("rainfall")] = rainfall.ravel()
+    grid[:, FEATURE_COLUMNS.index("N")] = n.ravel()
+    assert [body["classes"][i] for i in body["class_indices"]] == baseline(grid)
+
+
+@pytest.mark.parametrize("sweep", [
+    {"feature": "rainfall", "start": 0, "stop": 1e18, "step": 1},
+    {"feature": "rainfall", "start": 0, "stop": 10, "step": 0},
+    {"feature": "rainfall", "start": 0, "stop": "inf", "step": 1},
+    {"feature": "soil", "values": [1]},
+    "rainfall",
+])
+def test_what_if_rejects_bad_sweeps(client, rows, sweep):
+    resp = client.post("/what_if", json={"base": as_payload(rows[0]), "sweeps": [sweep]})
+    assert resp.status_code == 400
+
+
+def test_counterfactuals_reach_target_under_baseline(api, client, baseline, rows):
+    payload = as_payload(rows[0])
+    source = baseline(rows[:1])[0]
+    found = 0
+    for target in api.label_encoder.classes_:
+        if target == source:
+            continue
+        body = client.post("/counterfactual", json={"input": payload, "target_crop": target}).json
+        assert body["target_crop"] == target
+        if not body["found"]:
+            continue
+        found += 1
+        assert baseline([[body["counterfactual"][col] for col in FEATURE_COLUMNS]]) == [target]
+        for col in ("temperature", "humidity", "rainfall"):
+            assert body["counterfactual"][col] == payload[col]
+    # The search is heuristic, but some crops are a small N/P/K/ph change away
+    assert found
+
+
+def test_counterfactual_rejects_unknown_crop(client, rows):
+    resp = client.post("/counterfactual", json={"input": as_payload(rows[0]), "target_crop": "kale"})
+    assert resp.status_code == 400
+
+
+def test_uncertainty_without_noise_matches_baseline(client, baseline, rows):
+    body = client.post("/uncertainty", json={
+        "rows": [as_payload(row) for row in rows[:20]],
+        "uncertainty": {},
+        "samples": 10,
+        "seed": 0
+    }).json
+    assert [r["recommended_crop"] for r in body["results"]] == baseline(rows[:20])
+    assert all(r["stability"] == 1.0 for r in body["results"])
+
+
+def test_uncertainty_is_reproducible_with_seed(client, rows):
+    payload = {**as_payload(rows[150]), "samples": 200, "seed": 7}
+    first = client.post("/uncertainty", json=payload).json
+    second = client.post("/uncertainty", json=payload).json
+    assert first["crop_frequencies"] == second["crop_frequencies"]
+    assert first["metadata"]["samples"] == 200
+
+
+@pytest.mark.parametrize("options", [
+    {"samples": 0},
+    {"samples": "many"},
+    {"seed": -1},
+    {"budget_ms": 1.5},
+    {"uncertainty": {"soil": 0.1}},
+    {"uncertainty": [0.1]},
+])
+def test_uncertainty_rejects_bad_options(client, rows, options):
+    assert client.post("/uncertainty", json={**as_payload(rows[0]), **options}).status_code == 400
+
+
+def test_drift_counts_predictions(client, rows):
+    client.delete("/drift")
+    for row in rows[:15]:
+        client.post("/predict", json=as_payload(row))
+    report = client.get("/drift").json
+    assert report["samples"] == 15
+    assert set(report["features"]) == set(FEATURE_COLUMNS)
+
+
+def test_batch_tuning_reports_coalescer(client):
+    body = client.get("/batch_tuning").json
+    assert body["coalescing"] is True
+    assert body["chunk_rows"] > 0
+    assert "coalescer" in body
+
+
+def test_metrics_snapshot(client, rows):
+    client.post("/predict", json=as_payload(rows[0]))
+    body = client.get("/metrics").json
+    assert body["inference_mode"] == "xgboost"
+    assert body["archive_workers"] >= 1
+    assert body["prediction_log_written"] + body["prediction_log_dropped"] >= 0
+    assert body["cache_hits"] + body["cache_misses"] > 0
+
+
+def test_raster_tiles_match_baseline(api, client, baseline, rows):
+    import raster
+
+    # 20 x 10 cells of the test rows, with one nodata cell
+    stack = rows.T.reshape(len(FEATURE_COLUMNS), 20, 10).astype(np.float32)
+    stack[:, 0, 0] = np.nan
+    features_path = os.path.join(api.RASTER_OUTPUT_DIR, "features.npy")
+    os.makedirs(api.RASTER_OUTPUT_DIR, exist_ok=True)
+    np.save(features_path, stack)
+    raster.score_raster(features_path, os.path.join(api.RASTER_OUTPUT_DIR, "test"), MODEL_PATH, tile=8, workers=1)
+
+    meta = client.get("/raster/test").json
+    assert meta["shape"] == [20, 10]
+    assert meta["tiles"] == {"rows": 3, "cols": 2, "completed": 6}
+
+    classes = np.full((20, 10), -1)
+    for row in range(3):
+        for col in range(2):
+            tile = client.get(f"/raster/test/tiles/{row}/{col}").json
+            bounds = tile["bounds"]
+            classes[bounds["row_start"]:bounds["row_stop"], bounds["col_start"]:bounds["col_stop"]] = \
+                tile["class_index"]["data"]
+    assert classes[0, 0] == raster.NODATA_CLASS
+    cells = stack.reshape(len(FEATURE_COLUMNS), -1).T[1:]
+    assert api.label_encoder.classes_[classes.ravel()[1:]].tolist() == baseline(cells)
+
+    assert client.get("/raster/test/tiles/9/9").status_code == 404
+    assert client.get("/raster/missing").status_code == 404
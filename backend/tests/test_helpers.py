@@ -0,0 +1,198 @@
+"""Unit tests for the helper modules; these need no model artifact."""
+import io
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask, request
+
+from admission import AdmissionController, admission_controlled, default_limits, thread_budget_problem
+from conftest import FEATURE_COLUMNS, csv_bytes
+from ingest import RowLimitError, StreamingCsvReader, validate_features
+from result_store import BatchResultStore
+
+
+# --------------------------------------------------
+# admission
+# --------------------------------------------------
+@pytest.mark.parametrize("threads", [2, 4, 8, 16, 32])
+def test_default_limits_fit_thread_count(threads):
+    limits = default_limits(threads)
+    controllers = [AdmissionController(name, *limits[name], 0.1) for name in limits]
+    assert all(in_flight >= 1 for in_flight, _ in limits.values())
+    if threads >= 4:
+        assert thread_budget_problem(controllers, threads) is None
+
+
+def test_thread_budget_problem_names_budgets():
+    controllers = [AdmissionController("predict", 6, 2, 0.1), AdmissionController("batch", 1, 1, 0.1)]
+    assert "predict=6+2" in thread_budget_problem(controllers, 8)
+
+
+def test_admission_sheds_with_budget_header():
+    controller = AdmissionController("batch", 1, 0, 0.05)
+    app = Flask(__name__)
+    inside, leave = threading.Event(), threading.Event()
+
+    @app.route("/slow")
+    @admission_controlled(controller)
+    def slow():
+        inside.set()
+        leave.wait(5)
+        return "done"
+
+    client = app.test_client()
+    worker = threading.Thread(target=client.get, args=("/slow",))
+    worker.start()
+    inside.wait(5)
+    try:
+        resp = client.get("/slow")
+        assert resp.status_code == 429
+        assert resp.headers["X-Admission-Budget"] == "batch"
+        assert int(resp.headers["Retry-After"]) >= 1
+    finally:
+        leave.set()
+        worker.join()
+    assert client.get("/slow").status_code == 200
+    assert controller.stats()["shed_queue_full"] == 1
+
+
+def test_admission_selector_picks_budget_per_request():
+    small = AdmissionController("small", 1, 0, 0.05)
+    large = AdmissionController("large", 1, 0, 0.05)
+    app = Flask(__name__)
+
+    @app.route("/work")
+    @admission_controlled(lambda: small if request.args.get("size") == "small" else large)
+    def work():
+        return "done"
+
+    client = app.test_client()
+    for query in ("?size=small", "?size=large", "?size=large"):
+        assert client.get("/work" + query).status_code == 200
+    assert (small.stats()["admitted"], large.stats()["admitted"]) == (1, 2)
+
+
+# --------------------------------------------------
+# ingest
+# --------------------------------------------------
+def feed_in_pieces(reader, data, size):
+    frames = []
+    for start in range(0, len(data), size):
+        frames += reader.feed(data[start:start + size])
+    return frames + reader.close()
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1 << 20])
+def test_streaming_reader_is_chunking_invariant(size):
+    rng = np.random.default_rng(1)
+    features = np.round(rng.uniform(0, 100, (50, len(FEATURE_COLUMNS))), 2)
+    data = csv_bytes(features, ids=[f"r{i}" for i in range(50)]).rstrip(b"\n")  # unterminated last row
+    reader = StreamingCsvReader(FEATURE_COLUMNS, "id", chunk_rows=8)
+    frame = pd.concat(feed_in_pieces(reader, data, size), ignore_index=True)
+    assert frame["id"].tolist() == [f"r{i}" for i in range(50)]
+    assert np.array_equal(frame[FEATURE_COLUMNS].to_numpy(), features.astype(np.float32))
+    assert reader.rows_seen == 50
+
+
+@pytest.mark.parametrize("unterminated", [False, True])
+def test_streaming_reader_skip_counts_rows(unterminated):
+    data = csv_bytes(np.ones((30, len(FEATURE_COLUMNS))))
+    if unterminated:
+        data = data.rstrip(b"\n")
+    reader = StreamingCsvReader(FEATURE_COLUMNS, chunk_rows=4)
+    split = data.index(b"\n", len(data) // 3) + 5  # part-way through a row
+    parsed = reader.feed(data[:split])
+    for start in range(split, len(data), 11):
+        assert reader.skip(data[start:start + 11]) == []
+    assert reader.close() == []
+    assert reader.skipping
+    assert sum(len(frame) for frame in parsed) < 30
+    assert reader.rows_seen == 30
+
+
+def test_streaming_reader_row_limit():
+    reader = StreamingCsvReader(FEATURE_COLUMNS, chunk_rows=100, max_rows=10)
+    with pytest.raises(RowLimitError):
+        feed_in_pieces(reader, csv_bytes(np.ones((11, len(FEATURE_COLUMNS)))), 64)
+
+
+def test_validate_features_codes():
+    frame = pd.DataFrame({col: ["1"] * 4 for col in FEATURE_COLUMNS})
+    frame.loc[0, "N"] = None
+    frame.loc[1, "P"] = "abc"
+    frame.loc[2, "ph"] = "99"
+    features, codes = validate_features(frame)
+    assert codes.any(axis=1).tolist() == [True, True, True, False]
+    assert np.isnan(features[0, 0]) and np.isnan(features[1, 1])
+    assert features[3].tolist() == [1.0] * len(FEATURE_COLUMNS)
+
+
+# --------------------------------------------------
+# result_store
+# --------------------------------------------------
+def stored(tmp_path, n=10):
+    store = BatchResultStore(str(tmp_path))
+    features = np.arange(n * len(FEATURE_COLUMNS), dtype=np.float32).reshape(n, -1)
+    class_index = np.arange(n) % 3
+    class_index[[2, 7]] = -1
+    errors = {2: [{"column": "N", "code": "missing_value"}], 7: [{"column": "ph", "code": "out_of_range", "value": "99"}]}
+    ids = [f"field-{i}" for i in range(n)]
+    result_id = store.save(features, class_index, ["maize", "rice", "cotton"], ids, "id", errors, {"rows": n})
+    return store, result_id, errors
+
+
+def test_result_store_pages_and_errors(tmp_path):
+    store, result_id, errors = stored(tmp_path)
+    result = store.open(result_id)
+    rows, cursor, total = result.page(limit=4)
+    assert total == 10 and [r["row"] for r in rows] == [0, 1, 2, 3]
+    assert rows[2]["errors"] == errors[2] and rows[2]["status"] == "error"
+    rows, cursor, _ = result.page(cursor, limit=100)
+    assert cursor is None and [r["row"] for r in rows] == list(range(4, 10))
+    assert rows[3]["errors"] == errors[7]
+
+    bad, _, total = result.page(status="error")
+    assert total == 2 and [r["id"] for r in bad] == ["field-2", "field-7"]
+    maize, _, total = result.page(crop="maize")
+    assert [r["row"] for r in maize] == [0, 3, 6, 9]
+    with pytest.raises(ValueError):
+        result.page(crop="kale")
+
+
+def test_result_store_summary_and_export(tmp_path):
+    store, result_id, _ = stored(tmp_path)
+    result = store.open(result_id)
+    summary = result.summary()
+    assert (summary["rows"], summary["rows_valid"], summary["rows_invalid"]) == (10, 8, 2)
+    assert {c["crop"]: c["count"] for c in summary["crops"]} == {"maize": 4, "rice": 2, "cotton": 2}
+    exported = pd.read_csv(io.StringIO("".join(result.iter_csv(chunk_rows=3))))
+    assert exported["id"].tolist() == [f"field-{i}" for i in range(10)]
+    assert exported["status"].tolist().count("error") == 2
+
+
+def test_result_store_survives_delete_while_open(tmp_path):
+    store, result_id, errors = stored(tmp_path)
+    result = store.open(result_id)
+    assert store.delete(result_id)
+    assert store.open(result_id) is None
+    assert not store.delete(result_id)
+    rows, _, _ = result.page(status="error")
+    assert [r["errors"] for r in rows] == [errors[2], errors[7]]
+
+
+def test_result_store_rejects_bad_ids_and_expired(tmp_path):
+    store, result_id, _ = stored(tmp_path)
+    assert store.open("../etc") is None
+    assert store.open("0" * 32) is None
+    store.ttl = -1
+    assert store.open(result_id) is None
+
+
+def test_result_store_meta(tmp_path):
+    store, result_id, _ = stored(tmp_path)
+    with open(tmp_path / result_id / "meta.json") as f:
+        meta = json.load(f)
+    assert meta["id_column"] == "id" and meta["metadata"] == {"rows": 10}
@@ -0,0 +1,64 @@
+"""/predict and its serving layers against the baseline pipeline."""
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import as_payload
+
+
+def test_predict_matches_baseline(client, baseline, rows):
+    expected = baseline(rows)
+    got = [client.post("/predict", json=as_payload(row)).json["recommended_crop"] for row in rows]
+    assert got == expected
+
+
+def test_predict_cache_hit_matches_baseline(client, baseline, rows):
+    row = as_payload(rows[0])
+    first = client.post("/predict", json=row).json
+    hits = client.get("/metrics").json["cache_hits"]
+    second = client.post("/predict", json=row).json
+    assert client.get("/metrics").json["cache_hits"] == hits + 1
+    assert first["recommended_crop"] == second["recommended_crop"] == baseline(rows[:1])[0]
+
+
+def test_coalesced_predictions_match_baseline(api, baseline, rows):
+    assert api.predict_coalescer is not None
+    results = [None] * len(rows)
+
+    def work(i):
+        results[i] = int(api.predict_coalescer.predict(rows[i:i + 1])[0])
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(len(rows))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert api.label_encoder.inverse_transform(results).tolist() == baseline(rows)
+
+
+def test_leaf_index_matches_baseline(api, baseline, rows):
+    assert api.leaf_index is not None
+    preds = api.leaf_index.predict(rows)
+    assert api.label_encoder.inverse_transform(preds).tolist() == baseline(rows)
+    stats = api.leaf_index.stats()
+    assert stats["hits"] + stats["misses"] > 0
+
+
+def test_distilled_mode_mostly_agrees(api, client, baseline, rows):
+    if api.distilled_model is None:
+        pytest.skip("distilled_model.npz not found (run distill.py)")
+    expected = baseline(rows)
+    got = [client.post("/predict?mode=distilled", json=as_payload(row)).json["recommended_crop"] for row in rows]
+    # The distilled tree is an approximation (see INFERENCE_MODE in app.py)
+    assert np.mean(np.asarray(got) == np.asarray(expected)) >= 0.9
+
+
+def test_predict_missing_fields(client):
+    resp = client.post("/predict", json={"N": 1})
+    assert resp.status_code == 400
+    assert resp.json["missing_fields"] == ["P", "K", "temperature", "humidity", "ph", "rainfall"]
+
+
+def test_predict_unknown_mode(client, rows):
+    assert client.post("/predict?mode=nope", json=as_payload(rows[0])).status_code == 400
@@ -0,0 +1,197 @@
+"""
+Upload handling: streamed multipart bodies and configurable spooling.
+
+Flask parses a multipart body completely before the view runs, so a
+2 GB CSV is fully received (and partly held in memory) before anything
+is scored. StreamingUpload instead reads the body straight from the
+WSGI input stream and yields the bytes of one file part as they
+arrive. It hashes them along the way, so a caller can parse and score
+rows while the rest of the upload is still in flight.
+
+Endpoints that keep Flask's parser use SpooledRequest. It makes the
+size at which uploaded files move from memory to a temporary file
+configurable; Werkzeug's default is 500 KB.
+
+The total body size is capped through Flask's MAX_CONTENT_LENGTH. That
+gives an immediate 413 when Content-Length is too large, and a 413 mid-
+stream for bodies that do not declare their length.
+
+csv_sources turns several uploaded files, ZIP archives among them, into
+one list of CSVs. A ZIP keeps its central directory at the end, so an
+archive cannot be read while it streams in. It is spooled like any
+other Flask-parsed file. Each member is then decompressed in 64 KB
+reads by whoever iterates it, and nothing is extracted up front.
+Decompressed bytes and rows of all files in one request are charged to
+a shared UploadBudget, so a deflate bomb or many mid-sized members fail
+as a whole instead of filling the worker's memory.
+"""
+import functools
+import os
+import tempfile
+import threading
+import zipfile
+import zlib
+
+from flask import Request
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+
+class SpooledRequest(Request):
+    """Request whose uploaded files move to disk past `spool_bytes`."""
+
+    spool_bytes = 1 << 20
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_bytes, mode="rb+")
+
+
+class StreamingUpload:
+    """
+    The bytes of one file field of a multipart/form-data body, yielded
+    incrementally by iterating. After iteration, `filename` is None if
+    the field was absent.
+    """
+
+    def __init__(self, stream, content_type, field="file", chunk_size=1 << 16):
+        mimetype, options = parse_options_header(content_type or "")
+        if mimetype != "multipart/form-data" or not options.get("boundary"):
+            raise ValueError("Expected a multipart/form-data upload")
+        self.stream = stream
+        self.boundary = options["boundary"].encode("latin-1")
+        self.field = field
+        self.chunk_size = chunk_size
+
+        self.filename = None
+        self.bytes = 0
+
+    def __iter__(self):
+        decoder = MultipartDecoder(self.boundary)
+        in_field = False
+        while True:
+            data = self.stream.read(self.chunk_size)
+            decoder.receive_data(data or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, File) and event.name == self.field and self.filename is None:
+                    self.filename = event.filename
+                    in_field = True
+                elif isinstance(event, Data) and in_field:
+                    if event.data:
+                        self.bytes += len(event.data)
+                        yield event.data
+                    in_field = event.more_data
+                elif not isinstance(event, Data):
+                    in_field = False
+                event = decoder.next_event()
+            if not data or isinstance(event, Epilogue):
+                return
+
+
+class ArchiveError(ValueError):
+    """A ZIP member that cannot be read."""
+
+
+class ArchiveLimitError(ArchiveError):
+    """Too many CSVs in one request, or a member too large uncompressed."""
+
+
+class UploadBudgetError(ArchiveLimitError):
+    """The request as a whole is over its decompressed-byte or row budget."""
+
+
+class UploadBudget:
+    """
+    Decompressed bytes and parsed rows shared by every file of one
+    request, charged from the threads that read them. Once exceeded,
+    every further charge raises, so the other files stop early too.
+    """
+
+    def __init__(self, max_bytes, max_rows):
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.bytes = 0
+        self.rows = 0
+        self.exceeded = None
+        self._lock = threading.Lock()
+
+    def charge(self, n_bytes=0, n_rows=0):
+        with self._lock:
+            if self.exceeded is None:
+                self.bytes += n_bytes
+                self.rows += n_rows
+                if self.bytes > self.max_bytes:
+                    self.exceeded = f"more than {self.max_bytes} bytes uncompressed"
+                elif self.rows > self.max_rows:
+                    self.exceeded = f"more than {self.max_rows} rows"
+            if self.exceeded is not None:
+                raise UploadBudgetError(f"The upload holds {self.exceeded} in total.")
+
+    def metered(self, chunks):
+        """Pass `chunks` through, charging their bytes."""
+        for data in chunks:
+            self.charge(n_bytes=len(data))
+            yield data
+
+
+def read_stream(stream, chunk_size=1 << 16):
+    stream.seek(0)
+    yield from iter(lambda: stream.read(chunk_size), b"")
+
+
+def read_member(archive, info, chunk_size=1 << 16, max_bytes=None):
+    """
+    Decompressed bytes of one ZIP member. The declared size is not
+    trusted: reading stops with ArchiveLimitError past `max_bytes`.
+    Corrupt or unsupported members raise ArchiveError.
+    """
+    if max_bytes is not None and info.file_size > max_bytes:
+        raise ArchiveLimitError(f"{info.filename} is larger than {max_bytes} bytes uncompressed.")
+    total = 0
+    try:
+        with archive.open(info) as member:
+            for data in iter(lambda: member.read(chunk_size), b""):
+                total += len(data)
+                if max_bytes is not None and total > max_bytes:
+                    raise ArchiveLimitError(f"{info.filename} is larger than {max_bytes} bytes uncompressed.")
+                yield data
+    except (zipfile.BadZipFile, NotImplementedError, RuntimeError, zlib.error) as e:
+        # RuntimeError: encrypted member; NotImplementedError: compression method
+        raise ArchiveError(f"Cannot read {info.filename}: {e}")
+
+
+def csv_sources(files, max_sources=1000, max_member_bytes=None):
+    """
+    (name, chunks) for every CSV among uploaded FileStorage objects, the
+    ZipFiles opened along the way (close them when done) and the highest
+    declared compression ratio among the members (1.0 without any).
+
+    Plain files are taken as CSVs and named by their filename. ZIP
+    members ending in .csv are named "<archive>/<member>"; directories,
+    hidden files and __MACOSX/ entries are skipped. `chunks` is a
+    zero-argument callable returning an iterator of bytes, so members
+    are decompressed on whichever thread scores them. ZipFile serialises
+    its seeks, so members of one archive can be read concurrently.
+    """
+    sources = []
+    archives = []
+    max_ratio = 1.0
+    for storage in files:
+        if zipfile.is_zipfile(storage.stream):
+            archive = zipfile.ZipFile(storage.stream)
+            archives.append(archive)
+            for info in archive.infolist():
+                base = os.path.basename(info.filename)
+                if (info.is_dir() or base.startswith(".") or info.filename.startswith("__MACOSX/")
+                        or not base.lower().endswith(".csv")):
+                    continue
+                name = f"{storage.filename}/{info.filename}"
+                max_ratio = max(max_ratio, info.file_size / max(info.compress_size, 1))
+                sources.append((name, functools.partial(read_member, archive, info, max_bytes=max_member_bytes)))
+        else:
+            sources.append((storage.filename, functools.partial(read_stream, storage.stream)))
+        if len(sources) > max_sources:
+            for archive in archives:
+                archive.close()
+            raise ArchiveLimitError(f"More than {max_sources} CSV files in one request.")
+    return sources, archives, max_ratio
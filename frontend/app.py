@@ -7,6 +7,8 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 
+from backend_client import BackendConnection, BackendError, make_client
+
 # ===========================================
 # CONFIGURATION
 # ===========================================
@@ -15,8 +17,56 @@ BACKEND_URL = os.getenv(
     "https://prerna-gade-crop-recommendation-backend.hf.space"
 )
 
-SINGLE_PREDICT_ENDPOINT = f"{BACKEND_URL}/predict"
+# Backend on the same host: talk to its Unix domain socket instead of
+# TCP (the backend's UNIX_SOCKET). The URL host is then only a label.
+BACKEND_UNIX_SOCKET = os.getenv("BACKEND_UNIX_SOCKET")
+if BACKEND_UNIX_SOCKET:
+    BACKEND_URL = "http://backend"
+
 BATCH_PREDICT_ENDPOINT = f"{BACKEND_URL}/batch_predict"
+BATCH_RESULTS_ENDPOINT = f"{BACKEND_URL}/batch_results"
+
+# Rows fetched per page of a stored batch result
+BATCH_PAGE_SIZE = int(os.getenv("BATCH_PAGE_SIZE", "500"))
+
+# Interactive predictions: "http" calls the backend; "embedded" loads
+# the model artifact into this process (falls back to HTTP without it)
+FRONTEND_INFERENCE = os.getenv("FRONTEND_INFERENCE", "http")
+MODEL_ARTIFACT_PATH = os.getenv(
+    "MODEL_ARTIFACT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "crop_recommendation_model.joblib")
+)
+
+# Backend connection pool and retries (see backend_client.BackendConnection)
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "10"))
+BACKEND_MAX_RETRIES = int(os.getenv("BACKEND_MAX_RETRIES", "2"))
+BACKEND_RETRY_BACKOFF = float(os.getenv("BACKEND_RETRY_BACKOFF", "0.2"))
+
+# Backend calls kept per user session for the latency panel
+BACKEND_CALL_LOG_SIZE = 200
+
+def record_backend_call(call):
+    """Append one call's timing to the current user's session metrics."""
+    calls = st.session_state.setdefault("backend_calls", [])
+    calls.append(call)
+    del calls[:-BACKEND_CALL_LOG_SIZE]
+
+@st.cache_resource
+def backend_connection():
+    """One pooled connection per server process, shared by every user session and rerun."""
+    return BackendConnection(
+        BACKEND_URL,
+        BACKEND_UNIX_SOCKET,
+        pool_size=BACKEND_POOL_SIZE,
+        max_retries=BACKEND_MAX_RETRIES,
+        backoff=BACKEND_RETRY_BACKOFF,
+        on_call=record_backend_call
+    )
+
+@st.cache_resource
+def backend_client():
+    """Client for predict / top-k / explain; the model is loaded once per process."""
+    return make_client(BACKEND_URL, backend_connection(), FRONTEND_INFERENCE, MODEL_ARTIFACT_PATH)
 
 # ===========================================
 # PAGE CONFIGURATION
@@ -3852,6 +3902,90 @@ def generate_why_crop_explanations(crop_name, user_inputs):
     
     return explanations
 
+FEATURE_DISPLAY = {
+    "N": ("🌿", "Nitrogen"),
+    "P": ("🌿", "Phosphorus"),
+    "K": ("🌿", "Potassium"),
+    "temperature": ("🌡️", "Temperature"),
+    "humidity": ("💧", "Humidity"),
+    "ph": ("🧪", "Soil pH"),
+    "rainfall": ("🌧️", "Rainfall"),
+}
+
+def fetch_model_explanations(crop_name, user_inputs):
+    """Explain the prediction from the model's own feature contributions.
+
+    /explain reports XGBoost's own top crop, which can differ from
+    crop_name when /predict answered from the cascade or the distilled
+    tree, so the contributions are taken for crop_name itself.
+
+    Returns None when the backend /explain endpoint is unavailable (or
+    has no contributions for crop_name) so the caller can fall back to
+    the rule-based explanations.
+    """
+    try:
+        result = backend_client().explain(user_inputs, all_classes=True)
+    except (BackendError, requests.exceptions.RequestException, ValueError):
+        return None
+    if result.get("recommended_crop") == crop_name:
+        contributions = result.get("contributions", {})
+    else:
+        contributions = result.get("all_contributions", {}).get(crop_name, {})
+
+    if not contributions:
+        return None
+
+    display_name = get_crop_display_name(crop_name)
+    ranked = sorted(contributions.items(), key=lambda item: abs(item[1]), reverse=True)
+    explanations = []
+    for feature, value in ranked[:4]:
+        emoji, label = FEATURE_DISPLAY.get(feature, ("🌱", feature))
+        direction = "pushed the model towards" if value > 0 else "weighed against"
+        explanations.append(
+            f"{emoji} Your {label.lower()} ({user_inputs.get(feature)}) {direction} {display_name} "
+            f"(contribution {value:+.2f})."
+        )
+    return explanations
+
+def fetch_top_crops(user_inputs, k=3):
+    """Top-k crops with model probabilities, or None if unavailable."""
+    try:
+        result = backend_client().predict_proba(user_inputs, output="topk", k=k)
+        classes = result["classes"]
+        top_k = result["top_k"]
+        indices = top_k["indices"]["data"][0]
+        probabilities = top_k["probabilities"]["data"][0]
+    except (BackendError, requests.exceptions.RequestException, ValueError, KeyError, IndexError):
+        return None
+    return [(classes[i], p) for i, p in zip(indices, probabilities)]
+
+def fetch_batch_page(result_id, cursor=None, crop=None, status=None, limit=BATCH_PAGE_SIZE):
+    """One page of a stored batch result, or None if unavailable."""
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    if crop:
+        params["crop"] = crop
+    if status:
+        params["status"] = status
+    try:
+        resp = backend_connection().get(f"{BATCH_RESULTS_ENDPOINT}/{result_id}", params=params, timeout=30)
+        if resp.status_code != 200:
+            return None
+        return resp.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+def fetch_batch_summary(result_id):
+    """Server-side per-crop aggregates of a stored batch result."""
+    try:
+        resp = backend_connection().get(f"{BATCH_RESULTS_ENDPOINT}/{result_id}/summary", timeout=30)
+        if resp.status_code != 200:
+            return None
+        return resp.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
 def create_visualization(data, previous_data=None):
     features = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
     feature_labels = ["Nitrogen (N)", "Phosphorus (P)", "Potassium (K)", "Temperature", "Humidity", "pH", "Rainfall"]
@@ -4778,10 +4912,13 @@ with tab1:
 
         try:
             with st.spinner("🤖 Analyzing soil and climate data with AI..."):
-                resp = requests.post(SINGLE_PREDICT_ENDPOINT, json=input_payload, timeout=20)
+                try:
+                    data = backend_client().predict(input_payload)
+                    error = None
+                except BackendError as e:
+                    data, error = None, e
 
-            if resp.status_code == 200:
-                data = resp.json()
+            if error is None:
                 crop = data.get("recommended_crop", "Unknown")
                 crop_info = get_crop_info(crop)
                 crop_emoji = get_crop_emoji(crop)
@@ -4789,8 +4926,9 @@ with tab1:
                 crop_color = get_crop_color(crop)
                 crop_display_name = get_crop_display_name(crop)
                 
-                # Generate why crop explanations
-                why_explanations = generate_why_crop_explanations(crop, input_payload)
+                # Generate why crop explanations (model contributions, else rule-based)
+                why_explanations = fetch_model_explanations(crop, input_payload) or \
+                    generate_why_crop_explanations(crop, input_payload)
                 
                 st.balloons()
                 
@@ -4888,7 +5026,16 @@ with tab1:
                 
                 with info_col1:
                     st.success(f"✅ **Crop:** {crop_display_name}")
-                    st.info(f"📊 **Model Confidence:** High (99%+ accuracy)")
+                    top_crops = fetch_top_crops(input_payload)
+                    if top_crops:
+                        st.info(f"📊 **Model Confidence:** {top_crops[0][1] * 100:.1f}%")
+                        alternatives = ", ".join(
+                            f"{get_crop_display_name(name)} ({p * 100:.1f}%)" for name, p in top_crops[1:]
+                        )
+                        if alternatives:
+                            st.caption(f"Next best: {alternatives}")
+                    else:
+                        st.info(f"📊 **Model Confidence:** High (99%+ accuracy)")
                 
                 with info_col2:
                     st.warning("💡 **Next Steps:**")
@@ -4902,8 +5049,11 @@ with tab1:
                 with st.expander("📊 View Input Parameters Used"):
                     st.json(input_payload)
             
+            elif error.status in (429, 503):
+                retry_after = error.retry_after or "a few"
+                st.warning(f"⏳ The prediction service is busy. Please try again in {retry_after} seconds.")
             else:
-                st.error(f"❌ Error: Backend returned status {resp.status_code}")
+                st.error(f"❌ Error: Backend returned status {error.status}")
 
         except requests.exceptions.RequestException as e:
             st.error("❌ Connection Error: Could not reach the backend API.")
@@ -4952,6 +5102,12 @@ with tab2:
                 
                 uploaded_file.seek(0)
                 
+                # A new upload discards the previous stored result
+                upload_key = (uploaded_file.name, uploaded_file.size)
+                if st.session_state.get("batch_upload_key") != upload_key:
+                    st.session_state.batch_upload_key = upload_key
+                    st.session_state.batch_result = None
+                
                 if st.button("🚀 Get Batch Predictions", use_container_width=True, type="primary"):
                     files = {
                         "file": ("batch.csv", uploaded_file.getvalue(), "text/csv")
@@ -4959,78 +5115,149 @@ with tab2:
                     
                     try:
                         with st.spinner("🤖 Processing batch predictions with AI..."):
-                            resp = requests.post(BATCH_PREDICT_ENDPOINT, files=files, timeout=60)
+                            # Let the backend stop scoring shortly before we give up waiting.
+                            # store=1 keeps the rows on the backend; we page through them below.
+                            resp = backend_connection().post(
+                                BATCH_PREDICT_ENDPOINT,
+                                params={"store": "1"},
+                                files=files,
+                                headers={"X-Request-Timeout": "55"},
+                                timeout=60
+                            )
                         
-                        if resp.status_code == 200:
-                            result = resp.json()
-                            
-                            if isinstance(result, list):
-                                df_result = pd.DataFrame(result)
-                                
-                                desired_order = [
-                                    "N", "P", "K",
-                                    "temperature", "humidity", "ph", "rainfall",
-                                    "recommended_crop"
-                                ]
-                                existing_cols = [c for c in desired_order if c in df_result.columns]
-                                df_result = df_result[existing_cols]
-                                
-                                st.success(f"✅ Successfully processed {len(df_result)} predictions!")
-                                st.balloons()
-                                
-                                st.markdown("### 🌾 Prediction Results")
-                                st.dataframe(df_result, use_container_width=True, height=400)
-                                
-                                st.markdown("### 📊 Crop Distribution")
-                                crop_counts = df_result['recommended_crop'].value_counts()
-                                
-                                col_chart1, col_chart2 = st.columns(2)
-                                
-                                with col_chart1:
-                                    fig_bar = px.bar(
-                                        x=crop_counts.index,
-                                        y=crop_counts.values,
-                                        title="Crop Recommendations Count",
-                                        labels={"x": "Crop", "y": "Count"},
-                                        color=crop_counts.values,
-                                        color_continuous_scale="Greens"
-                                    )
-                                    fig_bar.update_layout(
-                                        paper_bgcolor='rgba(0,0,0,0)',
-                                        plot_bgcolor='rgba(0,0,0,0)'
-                                    )
-                                    st.plotly_chart(fig_bar, use_container_width=True)
-                                
-                                with col_chart2:
-                                    fig_pie = px.pie(
-                                        values=crop_counts.values,
-                                        names=crop_counts.index,
-                                        title="Crop Distribution (%)"
-                                    )
-                                    fig_pie.update_layout(
-                                        paper_bgcolor='rgba(0,0,0,0)',
-                                        plot_bgcolor='rgba(0,0,0,0)'
-                                    )
-                                    st.plotly_chart(fig_pie, use_container_width=True)
-                                
-                                csv_buffer = io.StringIO()
-                                df_result.to_csv(csv_buffer, index=False)
-                                st.download_button(
-                                    label="⬇️ Download Results as CSV",
-                                    data=csv_buffer.getvalue(),
-                                    file_name="crop_recommendations.csv",
-                                    mime="text/csv",
-                                    use_container_width=True
-                                )
-                            else:
-                                st.warning("⚠️ Unexpected response format")
-                                st.json(result)
+                        if resp.status_code == 200 and "result_id" in resp.json():
+                            st.session_state.batch_result = resp.json()
+                            st.session_state.batch_cursors = [None]
+                            st.balloons()
+                        elif resp.status_code == 200:
+                            st.warning("⚠️ Unexpected response format")
+                            st.json(resp.json())
+                        elif resp.status_code in (429, 503):
+                            retry_after = resp.headers.get("Retry-After", "a few")
+                            st.warning(f"⏳ The batch service is busy. Please try again in {retry_after} seconds.")
                         else:
                             st.error(f"❌ Error: Backend returned status {resp.status_code}")
                             st.text(resp.text)
                     
                     except Exception as e:
                         st.error(f"❌ An error occurred: {str(e)}")
+                
+                stored = st.session_state.get("batch_result")
+                if stored:
+                    result_id = stored["result_id"]
+                    metadata = stored.get("metadata", {})
+                    summary = fetch_batch_summary(result_id)
+                    if summary is None:
+                        st.warning("⚠️ These results have expired on the server. Please run the batch again.")
+                        st.session_state.batch_result = None
+                    else:
+                        st.success(f"✅ Successfully processed {summary['rows_valid']} predictions!")
+                        
+                        if summary["rows_invalid"]:
+                            st.warning(
+                                f"⚠️ {summary['rows_invalid']} row(s) could not be scored. "
+                                "Fix the cells listed below and re-upload only those rows."
+                            )
+                            invalid_page = fetch_batch_page(result_id, status="error") or {"results": []}
+                            st.dataframe(
+                                pd.DataFrame([
+                                    {"row": row["row"] + metadata.get("row_offset", 0) + 1, "column": err["column"], "problem": err["code"], "value": err.get("value", "")}
+                                    for row in invalid_page["results"]
+                                    for err in row.get("errors", [])
+                                ]),
+                                use_container_width=True
+                            )
+                        
+                        st.markdown("### 🌾 Prediction Results")
+                        crop_options = ["All crops"] + [c["crop"] for c in summary["crops"]]
+                        crop_filter = st.selectbox("Filter by crop", crop_options, key="batch_crop_filter")
+                        if st.session_state.get("batch_filter_applied") != crop_filter:
+                            st.session_state.batch_filter_applied = crop_filter
+                            st.session_state.batch_cursors = [None]
+                        cursors = st.session_state.batch_cursors
+                        page = fetch_batch_page(
+                            result_id,
+                            cursor=cursors[-1],
+                            crop=None if crop_filter == "All crops" else crop_filter
+                        )
+                        
+                        if page is not None:
+                            df_result = pd.DataFrame(page["results"])
+                            desired_order = [
+                                "N", "P", "K",
+                                "temperature", "humidity", "ph", "rainfall",
+                                "recommended_crop", "status"
+                            ]
+                            existing_cols = [c for c in desired_order if c in df_result.columns]
+                            st.dataframe(df_result[existing_cols] if existing_cols else df_result, use_container_width=True, height=400)
+                            
+                            first = (len(cursors) - 1) * BATCH_PAGE_SIZE
+                            st.caption(
+                                f"Rows {first + 1 if len(df_result) else 0}-{first + len(df_result)} "
+                                f"of {page['total_matching']:,}"
+                            )
+                            col_prev, col_next = st.columns(2)
+                            with col_prev:
+                                if st.button("⬅️ Previous page", disabled=len(cursors) == 1, use_container_width=True):
+                                    cursors.pop()
+                                    st.rerun()
+                            with col_next:
+                                if st.button("Next page ➡️", disabled=page["next_cursor"] is None, use_container_width=True):
+                                    cursors.append(page["next_cursor"])
+                                    st.rerun()
+                        
+                        st.markdown("### 📊 Crop Distribution")
+                        crop_counts = pd.Series(
+                            {c["crop"]: c["count"] for c in summary["crops"]},
+                            dtype="int64"
+                        )
+                        
+                        col_chart1, col_chart2 = st.columns(2)
+                        
+                        with col_chart1:
+                            fig_bar = px.bar(
+                                x=crop_counts.index,
+                                y=crop_counts.values,
+                                title="Crop Recommendations Count",
+                                labels={"x": "Crop", "y": "Count"},
+                                color=crop_counts.values,
+                                color_continuous_scale="Greens"
+                            )
+                            fig_bar.update_layout(
+                                paper_bgcolor='rgba(0,0,0,0)',
+                                plot_bgcolor='rgba(0,0,0,0)'
+                            )
+                            st.plotly_chart(fig_bar, use_container_width=True)
+                        
+                        with col_chart2:
+                            fig_pie = px.pie(
+                                values=crop_counts.values,
+                                names=crop_counts.index,
+                                title="Crop Distribution (%)"
+                            )
+                            fig_pie.update_layout(
+                                paper_bgcolor='rgba(0,0,0,0)',
+                                plot_bgcolor='rgba(0,0,0,0)'
+                            )
+                            st.plotly_chart(fig_pie, use_container_width=True)
+                        
+                        # The full file is only fetched when asked for
+                        if st.button("📦 Prepare CSV download", use_container_width=True):
+                            try:
+                                with st.spinner("Fetching all results..."):
+                                    export = backend_connection().get(f"{BATCH_RESULTS_ENDPOINT}/{result_id}/export", timeout=120)
+                                if export.status_code == 200:
+                                    st.download_button(
+                                        label="⬇️ Download Results as CSV",
+                                        data=export.content,
+                                        file_name="crop_recommendations.csv",
+                                        mime="text/csv",
+                                        use_container_width=True
+                                    )
+                                else:
+                                    st.error(f"❌ Error: Backend returned status {export.status_code}")
+                            except requests.exceptions.RequestException as e:
+                                st.error(f"❌ An error occurred: {str(e)}")
 
         except Exception as e:
             st.error(f"❌ Could not read CSV file: {str(e)}")
@@ -7090,6 +7317,24 @@ with tab12:
             </ul>
         </div>
         """, unsafe_allow_html=True)
+    
+    with st.expander("🔌 Backend call latency (this session)"):
+        backend_calls = st.session_state.get("backend_calls", [])
+        if backend_calls:
+            calls_df = pd.DataFrame(backend_calls)
+            calls_df["failed"] = pd.to_numeric(calls_df["status"]).fillna(599) >= 400
+            calls_df["retries"] = calls_df["attempts"] - 1
+            latency = calls_df.groupby(["method", "path"]).agg(
+                calls=("ms", "size"),
+                p50_ms=("ms", "median"),
+                p95_ms=("ms", lambda ms: ms.quantile(0.95)),
+                retries=("retries", "sum"),
+                failed=("failed", "sum")
+            ).reset_index()
+            st.dataframe(latency.round(2), use_container_width=True, hide_index=True)
+            st.caption(f"Last {len(calls_df)} calls, retries and back-off included.")
+        else:
+            st.info("No backend calls yet in this session.")
 
 # ===========================================
 # TAB 13: ABOUT
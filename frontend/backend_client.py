@@ -0,0 +1,359 @@
+"""
+HTTP transport to the crop recommendation backend.
+
+When the frontend and the backend share a host, the backend can also
+listen on a Unix domain socket (UNIX_SOCKET in gunicorn.conf.py). Set
+BACKEND_UNIX_SOCKET to the same path and every request goes over that
+socket instead of TCP loopback: there is no handshake, no Nagle/delayed
+ACK interplay and no port to expose. URLs keep their usual form; the
+host part is ignored.
+
+BackendConnection wraps a requests.Session whose pool keeps up to
+`pool_size` connections alive between calls. Keep one per process, not
+one per call, so a click does not pay for a new TCP and TLS handshake.
+It retries idempotent calls a bounded number of times: on connection
+failures and on 502/503/504, with full-jitter exponential backoff, and
+honouring a short Retry-After. Other POSTs (/predict and friends feed
+the prediction log and drift monitor, so a repeat is counted twice) are
+retried only when the backend provably never ran them: the connection
+could not be opened, or admission control shed the request before its
+handler (marked by the X-Admission-Budget header). It also reports each
+call's latency to an optional callback.
+
+The interactive calls (predict, top-k probabilities, explanations) go
+through a client object. HttpBackendClient posts to the API.
+EmbeddedBackendClient loads the backend's model artifact and answers in
+this process with the same JSON, so the app cannot tell them apart.
+Embedded mode needs the backend's model dependencies (joblib,
+scikit-learn, xgboost) next to Streamlit. make_client falls back to
+HTTP when they or the artifact are missing. Batch uploads and stored
+results always use HTTP, since they depend on the server's result
+store.
+"""
+import logging
+import os
+import random
+import socket
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+# Answers worth retrying: the proxy or backend is restarting or busy
+RETRY_STATUSES = (502, 503, 504)
+# Set by the backend's admission control on requests it shed unrun
+ADMISSION_HEADER = "X-Admission-Budget"
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+logger = logging.getLogger(__name__)
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTPConnection whose socket is a Unix domain socket."""
+
+    def __init__(self, socket_path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None and self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    def __init__(self, socket_path, maxsize=10, **kwargs):
+        super().__init__("localhost", maxsize=maxsize, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        return UnixHTTPConnection(self.socket_path, host=self.host, port=self.port, timeout=self.timeout.connect_timeout)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """Sends every request mounted on it to one Unix domain socket."""
+
+    def __init__(self, socket_path, pool_maxsize=10, **kwargs):
+        self.socket_path = socket_path
+        self._unix_pool = UnixHTTPConnectionPool(socket_path, maxsize=pool_maxsize, block=False)
+        super().__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._unix_pool
+
+    def get_connection(self, url, proxies=None):
+        # requests < 2.32
+        return self._unix_pool
+
+    def close(self):
+        super().close()
+        self._unix_pool.close()
+
+
+def make_session(base_url, unix_socket=None, pool_size=10):
+    """
+    Session for requests to `base_url` keeping up to `pool_size`
+    connections per host alive, routed over `unix_socket` when given.
+    """
+    session = requests.Session()
+    for prefix in ("http://", "https://"):
+        session.mount(prefix, HTTPAdapter(pool_maxsize=pool_size))
+    if unix_socket:
+        session.mount(base_url.rstrip("/") + "/", UnixSocketAdapter(unix_socket, pool_maxsize=pool_size))
+    return session
+
+
+class BackendConnection:
+    """
+    Pooled session with bounded, jittered retries: for idempotent calls
+    on any retryable failure, for others only when nothing ran.
+
+    on_call, if given, receives one dict per call: method, path, status
+    (None if no response), ms (all attempts and back-off included),
+    attempts.
+    """
+
+    def __init__(self, base_url, unix_socket=None, pool_size=10, max_retries=2, backoff=0.2,
+                 max_backoff=2.0, on_call=None):
+        self.session = make_session(base_url, unix_socket, pool_size)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_call = on_call
+
+    def _delay(self, attempt, resp):
+        """Seconds to wait before retry `attempt` + 1, or None to give up."""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if resp is not None and resp.headers.get("Retry-After"):
+            try:
+                retry_after = float(resp.headers["Retry-After"])
+            except ValueError:
+                return delay
+            # A long Retry-After goes back to the user rather than blocking the click
+            if retry_after > self.max_backoff:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _never_ran(error, resp):
+        """True if the backend certainly did not run the request's handler."""
+        if error is not None:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True
+            reason = getattr(error.args[0], "reason", None) if error.args else None
+            return isinstance(reason, NewConnectionError)
+        return resp.status_code == 503 and ADMISSION_HEADER in resp.headers
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        session.request with retries. Idempotent calls (default: by
+        method) are retried on connection errors and RETRY_STATUSES;
+        others only when _never_ran. Read timeouts are not retried, as
+        the backend is then slow rather than unreachable.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            resp = error = None
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                error = e
+            if idempotent:
+                retryable = error is not None or resp.status_code in RETRY_STATUSES
+            else:
+                retryable = self._never_ran(error, resp)
+            delay = self._delay(attempt, resp) if retryable and attempt < self.max_retries else None
+            if delay is None:
+                break
+            if resp is not None:
+                resp.close()  # hand the connection back to the pool
+            time.sleep(delay)
+            attempt += 1
+
+        if self.on_call is not None:
+            self.on_call({
+                "method": method.upper(),
+                "path": requests.utils.urlparse(url).path,
+                "status": resp.status_code if resp is not None else None,
+                "ms": round((time.perf_counter() - start) * 1000, 2),
+                "attempts": attempt + 1
+            })
+        if error is not None:
+            raise error
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, idempotent=False, **kwargs):
+        return self.request("POST", url, idempotent=idempotent, **kwargs)
+
+
+class BackendError(Exception):
+    """A non-200 answer, with the status and Retry-After the API sent."""
+
+    def __init__(self, status, message="", retry_after=None):
+        super().__init__(f"Backend returned status {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class HttpBackendClient:
+    """Interactive calls over HTTP; returns the decoded JSON bodies."""
+
+    mode = "http"
+
+    def __init__(self, base_url, connection):
+        self.base_url = base_url.rstrip("/")
+        self.connection = connection
+
+    def _post(self, path, payload, params=None, timeout=20):
+        # Not idempotent: each call is logged and feeds drift monitoring,
+        # so the connection only retries requests the backend never ran
+        resp = self.connection.post(f"{self.base_url}{path}", json=payload, params=params, timeout=timeout)
+        if resp.status_code != 200:
+            raise BackendError(resp.status_code, resp.text, resp.headers.get("Retry-After"))
+        return resp.json()
+
+    def predict(self, payload):
+        return self._post("/predict", payload)
+
+    def predict_proba(self, payload, output="both", k=3):
+        return self._post("/predict_proba", payload, params={"output": output, "k": k})
+
+    def explain(self, payload, all_classes=False):
+        return self._post("/explain", payload, params={"all_classes": int(all_classes)})
+
+
+class EmbeddedBackendClient:
+    """
+    The same calls answered in-process from the model artifact, with
+    responses shaped like the API's (JSON encoding, single row).
+    """
+
+    mode = "embedded"
+
+    def __init__(self, model_path, on_call=None):
+        import joblib
+        import xgboost as xgb
+
+        artifacts = joblib.load(model_path)
+        self.model = artifacts["model"]
+        self.label_encoder = artifacts["label_encoder"]
+        self.classes = [str(c) for c in self.label_encoder.classes_]
+        # The columns (and order) the pipeline was fitted on, as recorded
+        # in the artifact, so the frontend keeps no copy of the list
+        self.feature_columns = [str(c) for c in self.model.feature_names_in_]
+        # One row per call: extra OpenMP threads would only contend with
+        # Streamlit's own
+        classifier = self.model.named_steps["classifier"]
+        classifier.set_params(n_jobs=1)
+        self.booster = classifier.get_booster()
+        self.booster.set_param({"nthread": 1})
+        self._dmatrix = xgb.DMatrix
+        self.on_call = on_call
+
+    def _frame(self, payload):
+        missing = [col for col in self.feature_columns if col not in payload]
+        if missing:
+            raise BackendError(400, f"Missing required fields: {missing}")
+        try:
+            row = [float(payload[col]) for col in self.feature_columns]
+        except (TypeError, ValueError):
+            raise BackendError(400, "All feature values must be numeric")
+        return pd.DataFrame([row], columns=self.feature_columns)
+
+    def _record(self, path, start):
+        if self.on_call is not None:
+            self.on_call({
+                "method": "embedded",
+                "path": path,
+                "status": 200,
+                "ms": round((time.perf_counter() - start) * 1000, 2),
+                "attempts": 1
+            })
+
+    def predict(self, payload):
+        start = time.perf_counter()
+        encoded = self.model.predict(self._frame(payload))
+        self._record("/predict", start)
+        return {
+            "input": {col: payload[col] for col in self.feature_columns},
+            "recommended_crop": self.classes[int(encoded[0])],
+            "model": "xgboost"
+        }
+
+    def predict_proba(self, payload, output="both", k=3):
+        start = time.perf_counter()
+        proba = np.asarray(self.model.predict_proba(self._frame(payload))).astype(np.float32)
+        response = {"classes": self.classes, "rows": 1}
+        if output in ("matrix", "both"):
+            response["probabilities"] = _json_array(proba)
+        if output in ("topk", "both"):
+            k = max(1, min(int(k), len(self.classes)))
+            top = np.argsort(-proba, axis=1, kind="stable")[:, :k]
+            response["top_k"] = {
+                "k": k,
+                "indices": _json_array(top.astype(np.uint8)),
+                "probabilities": _json_array(np.take_along_axis(proba, top, axis=1))
+            }
+        response["recommended_crop"] = self.classes[int(proba[0].argmax())]
+        self._record("/predict_proba", start)
+        return response
+
+    def explain(self, payload, all_classes=False):
+        start = time.perf_counter()
+        preprocessor = self.model.named_steps["preprocessor"]
+        transformed = preprocessor.transform(self._frame(payload))
+        contribs = np.asarray(self.booster.predict(self._dmatrix(transformed), pred_contribs=True), dtype=np.float32)
+        row = contribs.reshape(len(self.classes), -1)
+        cls = int(row.sum(axis=1).argmax())
+        response = {
+            "recommended_crop": self.classes[cls],
+            "bias": round(float(row[cls, -1]), 6),
+            "contributions": {col: round(float(v), 6) for col, v in zip(self.feature_columns, row[cls, :-1])}
+        }
+        if all_classes:
+            response["all_contributions"] = {
+                name: {col: round(float(v), 6) for col, v in zip(self.feature_columns, class_row[:-1])}
+                for name, class_row in zip(self.classes, row)
+            }
+        self._record("/explain", start)
+        return response
+
+
+def _json_array(array):
+    # Same rounding as the API's encode_array for float32 JSON lists
+    data = np.round(array.astype(np.float64), 6).tolist() if array.dtype == np.float32 else array.tolist()
+    return {"dtype": str(array.dtype), "shape": list(array.shape), "encoding": "json", "data": data}
+
+
+def make_client(base_url, connection, mode="http", model_path=None):
+    """
+    EmbeddedBackendClient for mode "embedded" when the artifact and its
+    dependencies are available, else HttpBackendClient.
+    """
+    if mode == "embedded":
+        if model_path and os.path.exists(model_path):
+            try:
+                return EmbeddedBackendClient(model_path, connection.on_call)
+            except ImportError as e:
+                logger.warning("Embedded inference unavailable (%s); using the HTTP backend", e)
+        else:
+            logger.warning("Model artifact %s not found; using the HTTP backend", model_path)
+    return HttpBackendClient(base_url, connection)